@@ -20,11 +20,11 @@
 #     http://asdl.sourceforge.net/
 #-------------------------------------------------------------------------------
 from collections import namedtuple
-import re
+import codecs, hashlib, locale, mmap, os, pickle, re, sys, tempfile, time
 
 __all__ = [
-    'builtin_types', 'parse', 'AST', 'Module', 'Type', 'Constructor',
-    'Field', 'Sum', 'Product', 'VisitorBase', 'Check', 'check']
+    'builtin_types', 'parse', 'parse_stream', 'parse_cached', 'AST', 'Module', 'Type', 'Constructor',
+    'Field', 'Sum', 'Product', 'VisitorBase', 'VisitorProfile', 'Check', 'check']
 
 # The following classes define nodes into which the ASDL description is parsed.
 # Note: this is a "meta-AST". ASDL files (such as Python.asdl) describe the AST
@@ -36,13 +36,26 @@ __all__ = [
 builtin_types = set(
     ['identifier', 'string', 'bytes', 'int', 'object', 'singleton'])
 
+# Node classes use __slots__ and intern the type, constructor and field names
+# they hold, since large schemas repeat the same few names (int, expr, lineno)
+# many times. Nodes without fields or attributes all share one immutable empty
+# sequence.
+_EMPTY = ()
+
+def _intern(name):
+    return None if name is None else sys.intern(str(name))
+
 class AST:
+    __slots__ = ()
+
     def __repr__(self):
         raise NotImplementedError
 
 class Module(AST):
+    __slots__ = ('name', 'dfns', 'types')
+
     def __init__(self, name, dfns):
-        self.name = name
+        self.name = _intern(name)
         self.dfns = dfns
         self.types = {type.name: type.value for type in dfns}
 
@@ -50,25 +63,31 @@ class Module(AST):
         return 'Module({0.name}, {0.dfns})'.format(self)
 
 class Type(AST):
+    __slots__ = ('name', 'value')
+
     def __init__(self, name, value):
-        self.name = name
+        self.name = _intern(name)
         self.value = value
 
     def __repr__(self):
         return 'Type({0.name}, {0.value})'.format(self)
 
 class Constructor(AST):
+    __slots__ = ('name', 'fields')
+
     def __init__(self, name, fields=None):
-        self.name = name
-        self.fields = fields or []
+        self.name = _intern(name)
+        self.fields = fields or _EMPTY
 
     def __repr__(self):
-        return 'Constructor({0.name}, {0.fields})'.format(self)
+        return 'Constructor({0.name}, {1})'.format(self, list(self.fields))
 
 class Field(AST):
+    __slots__ = ('type', 'name', 'seq', 'opt')
+
     def __init__(self, type, name=None, seq=False, opt=False):
-        self.type = type
-        self.name = name
+        self.type = _intern(type)
+        self.name = _intern(name)
         self.seq = seq
         self.opt = opt
 
@@ -85,9 +104,11 @@ class Field(AST):
             return 'Field({0.type}, {0.name}{1})'.format(self, extra)
 
 class Sum(AST):
+    __slots__ = ('types', 'attributes')
+
     def __init__(self, types, attributes=None):
         self.types = types
-        self.attributes = attributes or []
+        self.attributes = attributes or _EMPTY
 
     def __repr__(self):
         if self.attributes:
@@ -96,9 +117,11 @@ class Sum(AST):
             return 'Sum({0.types})'.format(self)
 
 class Product(AST):
+    __slots__ = ('fields', 'attributes')
+
     def __init__(self, fields, attributes=None):
         self.fields = fields
-        self.attributes = attributes or []
+        self.attributes = attributes or _EMPTY
 
     def __repr__(self):
         if self.attributes:
@@ -123,6 +146,10 @@ class VisitorBase:
         if meth is None:
             methname = "visit" + klass.__name__
             meth = getattr(self, methname, None)
+            # Profiling only changes the cached method, so it costs nothing
+            # unless enabled.
+            if meth and VisitorProfile.active is not None:
+                meth = VisitorProfile.active.wrap(self, methname, meth)
             self.cache[klass] = meth
         if meth:
             try:
@@ -131,6 +158,94 @@ class VisitorBase:
                 print("Error visiting %r: %s" % (obj, e))
                 raise
 
+class VisitorProfile:
+    """Call counts and times of visitors, per class and per visit* method.
+
+    While a profile is enabled (between enable() and disable(), or in a with
+    block), the visit* methods visitors look up are wrapped to record their
+    calls. disable() drops the wrapped methods from the caches of their
+    visitors, so methods looked up while no profile is enabled run at full
+    speed.
+
+    methods maps (class name, method name), and classes maps class names, to
+    [calls, cumulative seconds, self seconds] lists. Self time leaves out the
+    visit* calls made from the method; cumulative time counts recursive
+    calls once. runs holds (visitor, seconds) for each visitor run by a
+    driver such as asdl_c.ChainOfVisitors, with visitors that override
+    visit() too.
+    """
+
+    # The enabled profile, if any
+    active = None
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.methods = {}
+        self.classes = {}
+        self.runs = []
+        # Time spent in nested calls, for each call in progress
+        self._nested = []
+        # Calls in progress, per entry of methods and classes
+        self._depth = {}
+        # (visitor cache, wrapped method) for each method wrapped
+        self._wrapped = []
+
+    def enable(self):
+        VisitorProfile.active = self
+
+    def disable(self):
+        if VisitorProfile.active is self:
+            VisitorProfile.active = None
+        for cache, profiled in self._wrapped:
+            for klass, meth in list(cache.items()):
+                if meth is profiled:
+                    del cache[klass]
+        self._wrapped = []
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def wrap(self, visitor, methname, meth):
+        """Return meth, the methname method of visitor, recording its calls."""
+        name = visitor.__class__.__name__
+        method_key = (name, methname)
+        method = self.methods.setdefault(method_key, [0, 0.0, 0.0])
+        total = self.classes.setdefault(name, [0, 0.0, 0.0])
+        depth = self._depth
+        depth.setdefault(method_key, 0)
+        depth.setdefault(name, 0)
+        nested = self._nested
+        clock = self.clock
+
+        def profiled(*args):
+            depth[method_key] += 1
+            depth[name] += 1
+            nested.append(0.0)
+            start = clock()
+            try:
+                return meth(*args)
+            finally:
+                elapsed = clock() - start
+                own = elapsed - nested.pop()
+                if nested:
+                    nested[-1] += elapsed
+                depth[method_key] -= 1
+                depth[name] -= 1
+                for stats, key in ((method, method_key), (total, name)):
+                    stats[0] += 1
+                    stats[2] += own
+                    if not depth[key]:
+                        stats[1] += elapsed
+        self._wrapped.append((visitor.cache, profiled))
+        return profiled
+
+    def add_run(self, visitor, seconds):
+        self.runs.append((visitor, seconds))
+
 class Check(VisitorBase):
     """A visitor that checks a parsed ASDL tree for correctness.
 
@@ -193,11 +308,110 @@ def check(mod):
 # The ASDL parser itself comes next. The only interesting external interface
 # here is the top-level parse function.
 
-def parse(filename):
-    """Parse ASDL from the given file and return a Module node describing it."""
+def parse(filename, use_mmap=False):
+    """Parse ASDL from the given file and return a Module node describing it.
+
+    The file is read and tokenized in chunks rather than slurped whole. If
+    use_mmap is True, the file is memory-mapped and decoded chunk by chunk
+    instead of being read through a file object.
+    """
+    parser = ASDLParser()
+    if use_mmap:
+        return parser.parse_chunks(_mmap_chunks(filename))
     with open(filename) as f:
-        parser = ASDLParser()
-        return parser.parse(f.read())
+        return parser.parse_stream(f)
+
+def parse_stream(fileobj, chunk_size=None):
+    """Parse ASDL from a text file object and return a Module node.
+
+    The file object is read lazily, chunk_size characters at a time.
+    """
+    return ASDLParser().parse_stream(fileobj, chunk_size)
+
+# Number of characters (or bytes, for memory-mapped files) the tokenizer pulls
+# in at a time when parsing a file.
+CHUNK_SIZE = 64 * 1024
+
+def _mmap_chunks(filename, chunk_size=None):
+    """Memory-map filename and yield its decoded contents in chunks.
+
+    The file is decoded with the same default encoding open() would use.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    decoder = codecs.getincrementaldecoder(
+        locale.getpreferredencoding(False))()
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be mapped.
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for pos in range(0, len(m), chunk_size):
+                yield decoder.decode(m[pos:pos + chunk_size])
+    yield decoder.decode(b'', final=True)
+
+# Version of the parser output. Bump it whenever the parser or the node classes
+# change in a way that makes previously cached modules invalid.
+PARSER_VERSION = 1
+
+def parse_cached(filename, cache_dir):
+    """Parse and check ASDL from the given file, caching the result.
+
+    Checked modules are pickled into cache_dir, keyed by a hash of the source
+    contents and PARSER_VERSION, and loaded from there when the source has not
+    changed. Missing, corrupt or stale cache entries fall back to a normal
+    parse. Return the Module, or None if the check fails (the errors are
+    printed by check). Cache entries are trusted, so cache_dir must not be
+    writable by others.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    key = digest.hexdigest()
+    path = os.path.join(cache_dir, '%s-v%d.pickle' % (key, PARSER_VERSION))
+    mod = _load_cache_entry(path, key)
+    if mod is not None:
+        return mod
+
+    mod = parse(filename)
+    if not check(mod):
+        return None
+    _store_cache_entry(path, key, mod)
+    return mod
+
+def _load_cache_entry(path, key):
+    try:
+        with open(path, 'rb') as f:
+            version, entry_key, mod = pickle.load(f)
+    except Exception:
+        # Missing, truncated or otherwise unreadable entry.
+        return None
+    if (version != PARSER_VERSION or entry_key != key or
+        not isinstance(mod, Module)):
+        return None
+    return mod
+
+def _store_cache_entry(path, key, mod):
+    """Atomically write a cache entry; failures leave the cache untouched.
+
+    I/O errors are ignored; other errors, such as pickling errors, propagate.
+    """
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((PARSER_VERSION, key, mod), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        os.remove(tmp)
+    except BaseException:
+        os.remove(tmp)
+        raise
 
 # Types for describing tokens in an ASDL specification.
 class TokenKind:
@@ -219,27 +433,78 @@ class ASDLSyntaxError(Exception):
     def __str__(self):
         return 'Syntax error on line {0.lineno}: {0.msg}'.format(self)
 
+# The lexer runs a single precompiled regex over the whole buffer (or, when
+# streaming, over each run of complete lines). Line boundaries other than '\n'
+# (the same set str.splitlines recognizes) are first normalized to '\n'. Every
+# match is either a newline, a word, a comment or a single non-space character;
+# comments are matched but not captured.
+_line_break_re = re.compile(r'\r\n?|[\v\f\x1c-\x1e\x85\u2028\u2029]')
+_line_break_chars = '\r\v\f\x1c\x1d\x1e\x85\u2028\u2029'
+_token_re = re.compile(r'[^\S\n]*(?:(\n)|(\w+)|--.*|(\S))')
+
+def _normalize_line_breaks(buf):
+    # Substring tests are much faster than a regex search on large buffers.
+    for c in _line_break_chars:
+        if c in buf:
+            return _line_break_re.sub('\n', buf)
+    return buf
+
 def tokenize_asdl(buf):
     """Tokenize the given buffer. Yield Token objects."""
-    for lineno, line in enumerate(buf.splitlines(), 1):
-        for m in re.finditer(r'\s*(\w+|--.*|.)', line.strip()):
-            c = m.group(1)
-            if c[0].isalpha():
+    return _tokenize(_normalize_line_breaks(buf), 1)
+
+def tokenize_asdl_chunks(chunks):
+    """Tokenize a buffer given as an iterable of string chunks.
+
+    Yield the same Token objects tokenize_asdl would for the concatenation of
+    the chunks. Only complete lines are tokenized; the trailing partial line of
+    each chunk is carried over to the next one, so memory use is bounded by
+    the chunk size plus the longest line.
+    """
+    lineno = 1
+    pending = ''
+    for chunk in chunks:
+        buf = pending + chunk
+        # A trailing '\r' may be the first half of a '\r\n' pair that
+        # continues in the next chunk.
+        if buf.endswith('\r'):
+            buf, tail = buf[:-1], '\r'
+        else:
+            tail = ''
+        buf = _normalize_line_breaks(buf)
+        cut = buf.rfind('\n') + 1
+        pending = buf[cut:] + tail
+        if cut:
+            lines = buf[:cut]
+            yield from _tokenize(lines, lineno)
+            lineno += lines.count('\n')
+    yield from _tokenize(_normalize_line_breaks(pending), lineno)
+
+def _tokenize(buf, lineno):
+    """Tokenize buf, whose line breaks are normalized, starting at lineno."""
+    operator_table = TokenKind.operator_table
+    # tuple.__new__ skips the Python-level Token.__new__ call per token.
+    new_token = tuple.__new__
+    for newline, word, op in _token_re.findall(buf):
+        if newline:
+            lineno += 1
+        elif word:
+            if word[0].isalpha():
                 # Some kind of identifier
-                if c[0].isupper():
-                    yield Token(TokenKind.ConstructorId, c, lineno)
+                if word[0].isupper():
+                    kind = TokenKind.ConstructorId
                 else:
-                    yield Token(TokenKind.TypeId, c, lineno)
-            elif c[:2] == '--':
-                # Comment
-                break
+                    kind = TokenKind.TypeId
+                yield new_token(Token, (kind, word, lineno))
             else:
-                # Operators
-                try:
-                    op_kind = TokenKind.operator_table[c]
-                except KeyError:
-                    raise ASDLSyntaxError('Invalid operator %s' % c, lineno)
-                yield Token(op_kind, c, lineno)
+                raise ASDLSyntaxError('Invalid operator %s' % word, lineno)
+        elif op:
+            # Operators
+            try:
+                op_kind = operator_table[op]
+            except KeyError:
+                raise ASDLSyntaxError('Invalid operator %s' % op, lineno)
+            yield new_token(Token, (op_kind, op, lineno))
 
 class ASDLParser:
     """Parser for ASDL files.
@@ -255,7 +520,22 @@ class ASDLParser:
     def parse(self, buf):
         """Parse the ASDL in the buffer and return an AST with a Module root.
         """
-        self._tokenizer = tokenize_asdl(buf)
+        return self._parse_tokens(tokenize_asdl(buf))
+
+    def parse_chunks(self, chunks):
+        """Parse ASDL given as an iterable of string chunks.
+
+        The chunks are consumed lazily as parsing proceeds.
+        """
+        return self._parse_tokens(tokenize_asdl_chunks(chunks))
+
+    def parse_stream(self, fileobj, chunk_size=None):
+        """Parse ASDL read lazily from a text file object."""
+        chunk_size = chunk_size or CHUNK_SIZE
+        return self.parse_chunks(iter(lambda: fileobj.read(chunk_size), ''))
+
+    def _parse_tokens(self, tokens):
+        self._tokenizer = tokens
         self._advance()
         return self._parse_module()
 
@@ -0,0 +1,938 @@
+# Benchmarks for asdl.py and asdl_c.py.
+#
+# Run all benchmarks with:
+#
+#   python3 asdl_bench.py
+#
+# or name the ones to run on the command line. Inputs are Python.asdl and
+# synthetic grammars produced by synthetic_grammar().
+#
+# The suite times each stage of asdl_c.py on its own (tokenize_asdl,
+# ASDLParser.parse, check, reflow_lines and each visitor of the header and
+# source chains) on synthetic grammars of 10 to 100k definitions, and saves
+# the results as JSON:
+#
+#   python3 asdl_bench.py suite --json baseline.json
+#   python3 asdl_bench.py suite --scales 10,1000 --json current.json
+#   python3 asdl_bench.py compare baseline.json current.json
+#
+# compare exits with status 1 if any case got slower by more than the
+# threshold (10% by default). Where the harness of asdl_harness.py builds,
+# the suite also times obj2ast with and without --slab-alloc on num_defs / 10
+# statements, and records the PyArena_Malloc calls and nodes per second.
+
+import argparse, ast, concurrent.futures, gc, io, json, os, pickle, platform
+import re, subprocess, sys, tempfile, time, tracemalloc
+import asdl, asdl_c, asdl_harness, asdl_json, asdl_py
+
+
+def synthetic_grammar(num_defs):
+    """Return the source of a well-formed ASDL module with num_defs types.
+
+    Each definition spans four lines: a sum of two constructors, a comment and
+    an attributes clause, so the result is roughly 4 * num_defs lines long.
+    """
+    lines = ['-- synthetic grammar with %d definitions' % num_defs,
+             'module Synthetic', '{']
+    for i in range(num_defs):
+        prev = 't%d' % (i - 1) if i else 'identifier'
+        lines.append('    t%d = C%da(int x, %s? y, identifier* z)' %
+                     (i, i, prev))
+        lines.append('        | C%db' % i)
+        lines.append('        -- definition %d' % i)
+        lines.append('        attributes (int lineno, int col_offset)')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def best_of(func, repeat=5):
+    """Call func repeat times and return the fastest wall time in seconds.
+
+    Like timeit, the garbage collector is disabled while timing.
+    """
+    best = None
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return best
+
+
+def report(name, seconds, baseline=None):
+    line = '%-48s %10.2f ms' % (name, seconds * 1000)
+    if baseline is not None:
+        line += '   (%.2fx vs. baseline)' % (baseline / seconds)
+    print(line)
+
+
+def peak_memory(func):
+    """Call func and return the peak traced memory in bytes during the call."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def report_memory(name, nbytes):
+    print('%-48s %10.1f MB' % (name, nbytes / 2**20))
+
+
+def read_python_asdl():
+    with open('Python.asdl') as f:
+        return f.read()
+
+
+# The line-oriented tokenizer asdl.tokenize_asdl used to be; kept as the
+# baseline for bench_tokenize.
+def _line_tokenize_asdl(buf):
+    Token, TokenKind = asdl.Token, asdl.TokenKind
+    for lineno, line in enumerate(buf.splitlines(), 1):
+        for m in re.finditer(r'\s*(\w+|--.*|.)', line.strip()):
+            c = m.group(1)
+            if c[0].isalpha():
+                if c[0].isupper():
+                    yield Token(TokenKind.ConstructorId, c, lineno)
+                else:
+                    yield Token(TokenKind.TypeId, c, lineno)
+            elif c[:2] == '--':
+                break
+            else:
+                try:
+                    op_kind = TokenKind.operator_table[c]
+                except KeyError:
+                    raise asdl.ASDLSyntaxError('Invalid operator %s' % c,
+                                               lineno)
+                yield Token(op_kind, c, lineno)
+
+
+def bench_tokenize():
+    inputs = [('Python.asdl', read_python_asdl(), 200),
+              ('synthetic, 100k lines', synthetic_grammar(25000), 3)]
+    for label, buf, repeat in inputs:
+        assert (list(asdl.tokenize_asdl(buf)) ==
+                list(_line_tokenize_asdl(buf)))
+        baseline = best_of(lambda: list(_line_tokenize_asdl(buf)), repeat)
+        report('tokenize %s (line-based)' % label, baseline)
+        report('tokenize %s' % label,
+               best_of(lambda: list(asdl.tokenize_asdl(buf)), repeat),
+               baseline)
+
+
+def bench_parse_memory():
+    fd, filename = tempfile.mkstemp(suffix='.asdl')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(synthetic_grammar(25000))
+
+        def parse_whole():
+            with open(filename) as f:
+                return asdl.ASDLParser().parse(f.read())
+
+        # The AST itself is part of every peak; the difference between the
+        # modes is the source text and tokenizer state held alongside it.
+        report_memory('peak parse, 100k lines (read whole file)',
+                      peak_memory(parse_whole))
+        report_memory('peak parse, 100k lines (streamed)',
+                      peak_memory(lambda: asdl.parse(filename)))
+        report_memory('peak parse, 100k lines (mmap)',
+                      peak_memory(lambda: asdl.parse(filename, use_mmap=True)))
+        report('parse, 100k lines (read whole file)', best_of(parse_whole, 3))
+        report('parse, 100k lines (streamed)',
+               best_of(lambda: asdl.parse(filename), 3))
+    finally:
+        os.remove(filename)
+
+
+# Plain dict-backed versions of the meta-AST node classes, as asdl.py used to
+# define them; kept as the baseline for bench_node_memory.
+class _DictModule:
+    def __init__(self, name, dfns):
+        self.name = name
+        self.dfns = dfns
+        self.types = {type.name: type.value for type in dfns}
+
+class _DictType:
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+class _DictConstructor:
+    def __init__(self, name, fields=None):
+        self.name = name
+        self.fields = fields or []
+
+class _DictField:
+    def __init__(self, type, name=None, seq=False, opt=False):
+        self.type = type
+        self.name = name
+        self.seq = seq
+        self.opt = opt
+
+class _DictSum:
+    def __init__(self, types, attributes=None):
+        self.types = types
+        self.attributes = attributes or []
+
+class _DictProduct:
+    def __init__(self, fields, attributes=None):
+        self.fields = fields
+        self.attributes = attributes or []
+
+
+def retained_memory(func):
+    """Call func and return (result, bytes still allocated by it)."""
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_node_memory():
+    num_defs = 25000
+    buf = synthetic_grammar(num_defs)
+    node_classes = ('Module', 'Type', 'Constructor', 'Field', 'Sum', 'Product')
+    saved = {name: getattr(asdl, name) for name in node_classes}
+    try:
+        for name in node_classes:
+            setattr(asdl, name, globals()['_Dict' + name])
+        mod, baseline = retained_memory(lambda: asdl.ASDLParser().parse(buf))
+    finally:
+        for name, cls in saved.items():
+            setattr(asdl, name, cls)
+    del mod
+    mod, compact = retained_memory(lambda: asdl.ASDLParser().parse(buf))
+    report_memory('module, %d definitions (dict nodes)' % num_defs, baseline)
+    report_memory('module, %d definitions (slots nodes)' % num_defs, compact)
+    print('%-48s %10d bytes' % ('saved per definition',
+                                (baseline - compact) // num_defs))
+
+
+def bench_parse_cached():
+    tmp = tempfile.TemporaryDirectory()
+    try:
+        filename = os.path.join(tmp.name, 'synthetic.asdl')
+        cache_dir = os.path.join(tmp.name, 'cache')
+        with open(filename, 'w') as f:
+            f.write(synthetic_grammar(25000))
+
+        def parse_and_check():
+            assert asdl.check(asdl.parse(filename))
+
+        baseline = best_of(parse_and_check, 3)
+        report('parse + check, 100k lines', baseline)
+        asdl.parse_cached(filename, cache_dir)
+        report('parse_cached hit, 100k lines',
+               best_of(lambda: asdl.parse_cached(filename, cache_dir), 3),
+               baseline)
+    finally:
+        tmp.cleanup()
+
+
+def bench_parallel_codegen():
+    mod = asdl.ASDLParser().parse(synthetic_grammar(2000))
+    slowest = total = 0
+    for cls in asdl_c.SOURCE_VISITORS:
+        elapsed = best_of(lambda: asdl_c.render_visitor(cls, mod), 1)
+        report('%s, 2000 definitions' % cls.__name__, elapsed)
+        slowest = max(slowest, elapsed)
+        total += elapsed
+    report('sum of visitors', total)
+    report('slowest visitor', slowest)
+
+    def generate(executor=None):
+        asdl_c.make_chain(io.StringIO(), asdl_c.SOURCE_VISITORS,
+                          executor).visit(mod)
+
+    report('sequential chain', best_of(generate, 1))
+    workers = len(asdl_c.SOURCE_VISITORS)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        report('parallel chain, %d workers on %d CPUs' %
+               (workers, os.cpu_count()),
+               best_of(lambda: generate(executor), 3), total)
+
+
+class CountingFile(io.StringIO):
+    """A StringIO that counts its write calls."""
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+
+def bench_emit():
+    mod = asdl.parse('Python.asdl')
+    default = asdl_c.EmitVisitor.buffer_lines
+
+    def generate(buffer_lines):
+        f = CountingFile()
+        asdl_c.EmitVisitor.buffer_lines = buffer_lines
+        try:
+            asdl_c.make_chain(f, asdl_c.SOURCE_VISITORS).visit(mod)
+        finally:
+            asdl_c.EmitVisitor.buffer_lines = default
+        return f.writes
+
+    # buffer_lines=1 flushes on every emit call, like the old EmitVisitor.
+    baseline = best_of(lambda: generate(1), 20)
+    report('Python-ast.c unbuffered, %d writes' % generate(1), baseline)
+    report('Python-ast.c buffered, %d writes' % generate(default),
+           best_of(lambda: generate(default), 20), baseline)
+
+
+# The slicing reflow_lines asdl_c.py used to have; kept as the baseline for
+# bench_reflow.
+def _slicing_reflow_lines(s, depth):
+    size = asdl_c.MAX_COL - depth * asdl_c.TABSIZE
+    if len(s) < size:
+        return [s]
+
+    lines = []
+    cur = s
+    padding = ""
+    while len(cur) > size:
+        i = cur.rfind(' ', 0, size)
+        if i == -1 and 'GeneratorExp' in cur:
+            i = size + 3
+        assert i != -1, "Impossible line %d to reflow: %r" % (size, s)
+        lines.append(padding + cur[:i])
+        if len(lines) == 1:
+            j = cur.find('{', 0, i)
+            if j >= 0:
+                j += 2
+                size -= j
+                padding = " " * j
+            else:
+                j = cur.find('(', 0, i)
+                if j >= 0:
+                    j += 1
+                    size -= j
+                    padding = " " * j
+        cur = cur[i+1:]
+    else:
+        lines.append(padding + cur)
+    return lines
+
+
+def bench_reflow():
+    long_line = 'f(' + ', '.join('arg%d' % i for i in range(100000)) + ');'
+    call = 'res = obj2ast_expr(PyList_GET_ITEM(tmp, i), &value, arena);'
+    # Emitted lines are fresh string objects, so give each one its own copy.
+    repeated = [call[:1] + call[1:] for _ in range(100000)]
+    for label, lines, repeat in [('reflow one 1MB line', [long_line], 3),
+                                 ('reflow 100k repeated lines', repeated, 3)]:
+        assert ([_slicing_reflow_lines(s, 2) for s in lines] ==
+                [asdl_c.reflow_lines(s, 2) for s in lines])
+
+        def reflow():
+            asdl_c._reflow_long_line.cache_clear()
+            return [asdl_c.reflow_lines(s, 2) for s in lines]
+
+        baseline = best_of(
+            lambda: [_slicing_reflow_lines(s, 2) for s in lines], repeat)
+        report(label + ' (slicing)', baseline)
+        report(label, best_of(reflow, repeat), baseline)
+
+
+def harness_builds(**options):
+    """Return the harness extension modules built without and with options,
+    or None, after saying why, if they cannot be built here."""
+    reason = asdl_harness.unavailable_reason()
+    if reason is not None:
+        print('skipped: %s' % reason.splitlines()[0])
+        return None
+    return asdl_harness.get_build(), asdl_harness.get_build(**options)
+
+
+def option_label(options):
+    return ' '.join('--' + name.replace('_', '-') for name in sorted(options))
+
+
+def bench_converters(options, make_tree, mode=asdl_harness.MODULE,
+                     calls=5, repeat=10, roundtrip=False):
+    """Report the time PyAST_obj2mod and PyAST_mod2obj take to convert the
+    tree make_tree(classes) returns, in code generated without and with
+    options.
+
+    If roundtrip is true, the tree is first converted both ways, so that it
+    is made of the objects PyAST_mod2obj creates, such as enum singletons.
+    """
+    builds = harness_builds(**options)
+    if builds is None:
+        return
+    cases = []
+    for h in builds:
+        tree = make_tree(h.module())
+        if roundtrip:
+            tree = h.roundtrip(tree, mode)
+        converted = h.mod(tree, mode)
+        cases.append((lambda h=h, tree=tree: h.obj2mod(tree, mode, calls),
+                      lambda h=h, mod=converted: h.mod2obj(mod, calls)))
+    # Alternate between the builds, so that both see the same machine load.
+    times = [[None, None], [None, None]]
+    for _ in range(repeat):
+        for funcs, best in zip(cases, times):
+            for i, func in enumerate(funcs):
+                elapsed = best_of(func, 1) / calls
+                if best[i] is None or elapsed < best[i]:
+                    best[i] = elapsed
+    label = option_label(options)
+    for i, name in enumerate(('obj2ast', 'ast2obj')):
+        report('%s, default' % name, times[0][i])
+        report('%s, %s' % (name, label), times[1][i], times[0][i])
+
+
+def bench_fast_dispatch():
+    # Statements of assorted expressions. Name, the most frequent, is one of
+    # the last constructors of expr, so the default obj2ast_expr makes
+    # nearly all its isinstance checks for it.
+    bench_converters({'fast_dispatch': True},
+                     lambda classes: asdl_harness.sample_module(classes, 2000))
+
+
+def bench_single_lookup():
+    # The same statements: every node has fields and attributes to read, and
+    # Call has two optional fields set to None.
+    bench_converters({'single_lookup': True},
+                     lambda classes: asdl_harness.sample_module(classes, 2000))
+
+
+def bench_slot_layout():
+    bench_converters({'slot_layout': True},
+                     lambda classes: asdl_harness.sample_module(classes, 2000))
+    builds = harness_builds(slot_layout=True)
+    if builds is None:
+        return
+    # Memory held by the objects ast2obj creates.
+    for label, h in zip(('default', '--slot-layout'), builds):
+        converted = h.mod(asdl_harness.sample_module(h.module(), 2000),
+                          asdl_harness.MODULE)
+        tree, nbytes = retained_memory(lambda: h.mod2obj(converted, 1))
+        report_memory('ast2obj result, %s' % label, nbytes)
+
+
+def bench_compact_structs():
+    bench_converters({'compact_structs': True},
+                     lambda classes: asdl_harness.sample_module(classes, 2000))
+    builds = harness_builds(compact_structs=True)
+    if builds is None:
+        return
+    # Python.asdl has no struct that the compact layout shrinks (see
+    # asdl_c.struct_sizes), so both trees should take the same room.
+    for label, h in zip(('default', '--compact-structs'), builds):
+        nbytes = h.arena_bytes(asdl_harness.sample_module(h.module(), 2000),
+                               asdl_harness.MODULE)
+        print('%-48s %10.1f KB' % ('arena, 2000 statements, %s' % label,
+                                   nbytes / 2**10))
+
+
+def compare_module(classes, num_stmts, num_ops):
+    """Return a Module of num_stmts comparisons of num_ops operators each."""
+    def pos(node):
+        node.lineno = 1
+        node.col_offset = 0
+        return node
+
+    ops = [classes.Lt, classes.Eq, classes.In, classes.IsNot]
+    body = []
+    for i in range(num_stmts):
+        compare = pos(classes.Compare(
+            left=pos(classes.Num(n=i)),
+            ops=[ops[j % len(ops)]() for j in range(num_ops)],
+            comparators=[pos(classes.Num(n=j)) for j in range(num_ops)]))
+        body.append(pos(classes.Expr(value=compare)))
+    return classes.Module(body=body)
+
+
+def bench_int_buffers():
+    # Chained comparisons, so that most of the work is in the ops sequences.
+    # The trees hold lists of cmpop singletons in both builds.
+    def make_tree(classes):
+        return compare_module(classes, 2000, 20)
+    bench_converters({'int_buffers': True}, make_tree)
+    builds = harness_builds(int_buffers=True)
+    if builds is None:
+        return
+    # With --int-buffers, obj2ast also reads back the array('i') objects
+    # ast2obj creates.
+    h = builds[1]
+    tree = h.roundtrip(make_tree(h.module()), asdl_harness.MODULE)
+    report('obj2ast, --int-buffers, array ops',
+           best_of(lambda: h.obj2mod(tree, asdl_harness.MODULE, 5), 10) / 5)
+
+
+def bench_singleton_identity():
+    # Trees as ast2obj returns them, whose expression contexts and operators
+    # are the singletons of their types.
+    bench_converters({'singleton_identity': True},
+                     lambda classes: asdl_harness.sample_module(classes, 2000),
+                     roundtrip=True)
+
+
+def bench_table_driven():
+    # Size and generation time of Python-ast.c with unrolled converters and
+    # with --table-driven, then the speed of the converters of each.
+    mod = asdl.parse('Python.asdl')
+    baseline = None
+    for label, options in [('unrolled', asdl_c.Options()),
+                           ('table-driven',
+                            asdl_c.Options(table_driven=True))]:
+        def generate():
+            f = io.StringIO()
+            asdl_c.make_chain(f, asdl_c.SOURCE_VISITORS,
+                              options=options).visit(mod)
+            return f.getvalue()
+
+        source = generate()
+        print('%-48s %7d lines %5d KB' % ('Python-ast.c, ' + label,
+                                          source.count('\n'),
+                                          len(source) // 1024))
+        elapsed = best_of(generate, 5)
+        report('generate Python-ast.c, ' + label, elapsed, baseline)
+        baseline = baseline or elapsed
+    bench_converters({'table_driven': True},
+                     lambda classes: asdl_harness.sample_module(classes, 2000))
+
+
+class _DictNode:
+    """Base of the dict-backed node classes of bench_py_nodes.
+
+    Like ast.AST, it takes fields positionally or as keywords, and any
+    attribute as a keyword.
+    """
+    _fields = ()
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self._fields, args):
+            setattr(self, name, value)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+
+def dict_node_classes(mod):
+    """Return a namespace of dict-backed node classes for mod."""
+    ns = {}
+    for dfn in mod.dfns:
+        ns[dfn.name] = base = type(dfn.name, (_DictNode,), {})
+        if isinstance(dfn.value, asdl.Sum):
+            for t in dfn.value.types:
+                ns[t.name] = type(t.name, (base,), {
+                    '_fields': tuple(asdl_py.field_names(t.fields))})
+        else:
+            base._fields = tuple(asdl_py.field_names(dfn.value.fields))
+    return ns
+
+
+def build_statements(ns, num_stmts):
+    """Build num_stmts "x = a + 1" statements from the classes in ns."""
+    Assign, BinOp, Name, Num = ns['Assign'], ns['BinOp'], ns['Name'], ns['Num']
+    Load, Store, Add = ns['Load'](), ns['Store'](), ns['Add']()
+    return [Assign([Name('x', Store, lineno=i, col_offset=0)],
+                   BinOp(Name('a', Load, lineno=i, col_offset=4), Add,
+                         Num(1, lineno=i, col_offset=8),
+                         lineno=i, col_offset=4),
+                   lineno=i, col_offset=0)
+            for i in range(num_stmts)]
+
+
+def bench_py_nodes():
+    # Node classes generated by asdl_py.py, against dict-backed classes with
+    # a generic constructor, for 6 nodes per statement.
+    mod = asdl.parse('Python.asdl')
+    slots_ns = {}
+    exec(asdl_py.generate(mod), slots_ns)
+    dict_ns = dict_node_classes(mod)
+    num_stmts = 50000
+    stmts, baseline = retained_memory(
+        lambda: build_statements(dict_ns, num_stmts))
+    del stmts
+    stmts, compact = retained_memory(
+        lambda: build_statements(slots_ns, num_stmts))
+    del stmts
+    report_memory('%d statements (dict nodes)' % num_stmts, baseline)
+    report_memory('%d statements (asdl_py slots nodes)' % num_stmts, compact)
+    baseline = best_of(lambda: build_statements(dict_ns, num_stmts), 5)
+    report('build %d statements (dict nodes)' % num_stmts, baseline)
+    report('build %d statements (asdl_py slots nodes)' % num_stmts,
+           best_of(lambda: build_statements(slots_ns, num_stmts), 5),
+           baseline)
+
+
+def bench_py_visitor():
+    # The NodeVisitor and NodeTransformer asdl_py.py generates, on trees of
+    # its node classes, against ast.NodeVisitor and ast.NodeTransformer on
+    # the same statements parsed by the running interpreter.
+    num_stmts = 20000
+    ns = {}
+    exec(asdl_py.generate(asdl.parse('Python.asdl')), ns)
+    tree = ns['Module'](build_statements(ns, num_stmts))
+    ast_tree = ast.parse('x = a + 1\n' * num_stmts)
+
+    def visitors(NodeVisitor, NodeTransformer, num_class, num_field):
+        class CountNames(NodeVisitor):
+            def visit_Name(self, node):
+                self.count += 1
+
+        class Increment(NodeTransformer):
+            pass
+
+        def visit_num(self, node):
+            setattr(node, num_field, getattr(node, num_field) + 1)
+            return node
+
+        setattr(Increment, 'visit_' + num_class, visit_num)
+        return CountNames, Increment
+
+    def count(visitor_class, tree):
+        visitor = visitor_class()
+        visitor.count = 0
+        visitor.visit(tree)
+        return visitor.count
+
+    # Numbers are Constant nodes since Python 3.8.
+    num = ('Constant', 'value') if sys.version_info >= (3, 8) else ('Num', 'n')
+    generic = visitors(ast.NodeVisitor, ast.NodeTransformer, *num)
+    generated = visitors(ns['NodeVisitor'], ns['NodeTransformer'], 'Num', 'n')
+    assert count(generic[0], ast_tree) == count(generated[0], tree)
+    for label, index in [('visit', 0), ('transform', 1)]:
+        if index:
+            func = lambda visitors, tree: visitors[1]().visit(tree)
+        else:
+            func = lambda visitors, tree: count(visitors[0], tree)
+        baseline = best_of(lambda: func(generic, ast_tree), 5)
+        report('%s %d statements (ast.NodeVisitor)' % (label, num_stmts),
+               baseline)
+        report('%s %d statements (asdl_py visitor)' % (label, num_stmts),
+               best_of(lambda: func(generated, tree), 5), baseline)
+
+
+def bench_serialize():
+    # encode() and decode() of the module asdl_py.py generates, against
+    # pickling the same statements parsed by the running interpreter.
+    num_stmts = 20000
+    ns = {}
+    exec(asdl_py.generate(asdl.parse('Python.asdl')), ns)
+    tree = ns['Module'](build_statements(ns, num_stmts))
+    ast_tree = ast.parse('x = a + 1\n' * num_stmts)
+    data = ns['encode'](tree)
+    pickled = pickle.dumps(ast_tree, pickle.HIGHEST_PROTOCOL)
+    print('%-48s %10.1f KB' % ('%d statements (pickle of ast)' % num_stmts,
+                               len(pickled) / 2**10))
+    print('%-48s %10.1f KB' % ('%d statements (asdl_py encode)' % num_stmts,
+                               len(data) / 2**10))
+    baseline = best_of(
+        lambda: pickle.dumps(ast_tree, pickle.HIGHEST_PROTOCOL), 5)
+    report('serialize (pickle of ast)', baseline)
+    report('serialize (asdl_py encode)', best_of(lambda: ns['encode'](tree), 5),
+           baseline)
+    baseline = best_of(lambda: pickle.loads(pickled), 5)
+    report('deserialize (pickle of ast)', baseline)
+    report('deserialize (asdl_py decode)',
+           best_of(lambda: ns['decode'](data), 5), baseline)
+
+
+def bench_json_lines():
+    # asdl_json.py on trees of the node classes asdl_py.py generates: the
+    # peak memory of reading a stream event by event, against building the
+    # tree, and the time of each step.
+    num_stmts = 20000
+    mod = asdl.parse('Python.asdl')
+    ns = {}
+    exec(asdl_py.generate(mod), ns)
+    tree = ns['Module'](build_statements(ns, num_stmts))
+    f = io.StringIO()
+    asdl_json.dump(mod, tree, f)
+    del tree
+    lines = f.getvalue().splitlines()
+
+    def count_names():
+        return sum(1 for event in asdl_json.iter_events(mod, lines)
+                   if event[0] == 'start' and event[2] == 'Name')
+
+    report_memory('read %d statements as events' % num_stmts,
+                  peak_memory(count_names))
+    report_memory('load %d statements' % num_stmts,
+                  peak_memory(lambda: asdl_json.load(mod, lines, ns)))
+    tree = asdl_json.load(mod, lines, ns)
+    report('dump %d statements' % num_stmts,
+           best_of(lambda: asdl_json.dump(mod, tree, io.StringIO()), 3))
+    report('read %d statements as events' % num_stmts,
+           best_of(count_names, 3))
+    report('load %d statements' % num_stmts,
+           best_of(lambda: asdl_json.load(mod, lines, ns), 3))
+
+
+# Run by first_use_times in a fresh interpreter, with the path of a harness
+# build and the directory of asdl_harness.py as arguments.
+_FIRST_USE_SCRIPT = """
+import importlib.util, sys, time
+sys.path.insert(0, sys.argv[2])
+import asdl_harness
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('harness', sys.argv[1])
+h = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(h)
+loaded = time.perf_counter()
+classes = h.module()
+created = time.perf_counter()
+h.roundtrip(asdl_harness.sample_module(classes, 1), asdl_harness.MODULE)
+converted = time.perf_counter()
+print(loaded - start, created - loaded, converted - created)
+"""
+
+
+def first_use_times(h):
+    """Return the seconds a fresh interpreter takes to load the harness
+    build h, to create its _ast module, and to build and convert a first
+    tree with it."""
+    result = subprocess.run(
+        [sys.executable, '-c', _FIRST_USE_SCRIPT, h.__file__,
+         os.path.dirname(os.path.abspath(asdl_harness.__file__))],
+        stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return [float(t) for t in result.stdout.split()]
+
+
+def bench_import_ast():
+    # Each run is a new process, so take the best of several, alternating
+    # between the builds.
+    builds = harness_builds(lazy_types=True)
+    if builds is None:
+        return
+    times = [[None] * 3, [None] * 3]
+    for _ in range(20):
+        for h, best in zip(builds, times):
+            for i, elapsed in enumerate(first_use_times(h)):
+                if best[i] is None or elapsed < best[i]:
+                    best[i] = elapsed
+    times = [best + [sum(best)] for best in times]
+    for i, name in enumerate(('load extension', 'create _ast module',
+                              'first tree and conversion', 'total')):
+        report('%s, default' % name, times[0][i])
+        report('%s, --lazy-types' % name, times[1][i], times[0][i])
+
+
+BENCHMARKS = {
+    'tokenize': bench_tokenize,
+    'parse_memory': bench_parse_memory,
+    'node_memory': bench_node_memory,
+    'parse_cached': bench_parse_cached,
+    'parallel_codegen': bench_parallel_codegen,
+    'emit': bench_emit,
+    'reflow': bench_reflow,
+    'fast_dispatch': bench_fast_dispatch,
+    'single_lookup': bench_single_lookup,
+    'slot_layout': bench_slot_layout,
+    'compact_structs': bench_compact_structs,
+    'int_buffers': bench_int_buffers,
+    'singleton_identity': bench_singleton_identity,
+    'table_driven': bench_table_driven,
+    'py_nodes': bench_py_nodes,
+    'py_visitor': bench_py_visitor,
+    'serialize': bench_serialize,
+    'json_lines': bench_json_lines,
+    'import_ast': bench_import_ast,
+}
+
+
+SUITE_SCALES = (10, 100, 1000, 10000, 100000)
+
+SUITE_VERSION = 1
+
+
+class NullFile:
+    """A write-only file that discards its output and counts the bytes."""
+    def __init__(self):
+        self.size = 0
+
+    def write(self, s):
+        self.size += len(s)
+        return len(s)
+
+
+def time_case(func, budget=0.2, max_repeat=100):
+    """Return the best wall time of func, repeated as often as fits budget.
+
+    A case that takes longer than budget runs once.
+    """
+    best = best_of(func, 1)
+    repeat = min(max_repeat, int(budget / max(best, 1e-9)))
+    if repeat > 0:
+        best = min(best, best_of(func, repeat))
+    return best
+
+
+def reflow_calls(mod):
+    """Return the (s, depth) pairs EmitVisitor reflows when generating the
+    header and source of mod, in order."""
+    calls = []
+    reflow = asdl_c._reflow_long_line
+
+    def record(s, depth):
+        calls.append((s, depth))
+        return reflow(s, depth)
+
+    asdl_c._reflow_long_line = record
+    try:
+        visitors = asdl_c.HEADER_VISITORS + asdl_c.SOURCE_VISITORS
+        asdl_c.make_chain(NullFile(), visitors).visit(mod)
+    finally:
+        asdl_c._reflow_long_line = reflow
+    return calls
+
+
+def suite_cases(num_defs):
+    """Yield (case, seconds) for each stage of asdl_c.py on a synthetic
+    grammar of num_defs definitions, then the cases of slab_alloc_cases."""
+    buf = synthetic_grammar(num_defs)
+    yield 'tokenize_asdl', time_case(lambda: list(asdl.tokenize_asdl(buf)))
+    yield 'ASDLParser.parse', time_case(lambda: asdl.ASDLParser().parse(buf))
+    mod = asdl.ASDLParser().parse(buf)
+    yield 'check', time_case(lambda: asdl.check(mod))
+
+    calls = reflow_calls(mod)
+
+    def reflow():
+        asdl_c._reflow_long_line.cache_clear()
+        for s, depth in calls:
+            asdl_c.reflow_lines(s, depth)
+
+    yield 'reflow_lines', time_case(reflow)
+    del calls
+    # Build the symbol table up front, so that it is not charged to the
+    # first visitor.
+    asdl_c.get_symbol_table(mod)
+    for cls in asdl_c.HEADER_VISITORS + asdl_c.SOURCE_VISITORS:
+        def visit():
+            asdl_c.make_chain(NullFile(), (cls,)).visit(mod)
+        yield cls.__name__, time_case(visit)
+    yield from slab_alloc_cases(max(1, num_defs // 10))
+
+
+def slab_alloc_cases(num_stmts):
+    """Yield (case, seconds, stats) for PyAST_obj2mod of num_stmts statements
+    in harness builds without and with --slab-alloc, where stats holds the
+    PyArena_Malloc calls of one conversion and the nodes converted per
+    second. Yield nothing if the harness cannot be built here."""
+    if asdl_harness.unavailable_reason() is not None:
+        return
+    default = asdl_harness.get_build()
+    slab = asdl_harness.get_build(slab_alloc=True)
+    # The slab allocator counts the nodes it allocates.
+    nodes = slab.slab_stats()[0]
+    slab.obj2mod(asdl_harness.sample_module(slab.module(), num_stmts),
+                 asdl_harness.MODULE, 1)
+    nodes = slab.slab_stats()[0] - nodes
+    for case, h in [('obj2ast', default), ('obj2ast --slab-alloc', slab)]:
+        tree = asdl_harness.sample_module(h.module(), num_stmts)
+        mallocs = h.obj2mod(tree, asdl_harness.MODULE, 1)
+        seconds = time_case(lambda: h.obj2mod(tree, asdl_harness.MODULE, 1))
+        yield case, seconds, {'mallocs': mallocs,
+                              'nodes_per_second': round(nodes / seconds)}
+
+
+def run_suite(scales=SUITE_SCALES, out=sys.stdout):
+    """Run the suite at each scale, printing the results to out, and return
+    them as a dict ready to be saved as JSON."""
+    results = []
+    for num_defs in scales:
+        for case, seconds, *stats in suite_cases(num_defs):
+            line = '%-32s %7d defs %12.3f ms' % (case, num_defs,
+                                                 seconds * 1000)
+            result = {'case': case, 'defs': num_defs, 'seconds': seconds}
+            if stats:
+                line += ('   %(mallocs)d mallocs, %(nodes_per_second)d nodes/s'
+                         % stats[0])
+                result.update(stats[0])
+            print(line, file=out)
+            results.append(result)
+    return {'version': SUITE_VERSION,
+            'python': sys.version.split()[0],
+            'machine': platform.platform(),
+            'results': results}
+
+
+def compare_results(baseline, current, threshold=0.10, out=sys.stdout):
+    """Print the ratio of current to baseline time of each case in both, and
+    return the list of (case, defs) slower by more than threshold."""
+    for results in (baseline, current):
+        if results.get('version') != SUITE_VERSION:
+            raise ValueError('unsupported suite results version %r' %
+                             results.get('version'))
+    before = {(r['case'], r['defs']): r['seconds']
+              for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        key = (r['case'], r['defs'])
+        if key not in before:
+            continue
+        ratio = r['seconds'] / before[key] if before[key] else float('inf')
+        line = '%-32s %7d defs %12.3f ms %12.3f ms %7.2fx' % (
+            key + (before[key] * 1000, r['seconds'] * 1000, ratio))
+        if ratio > 1 + threshold:
+            regressions.append(key)
+            line += '   REGRESSION'
+        print(line, file=out)
+    return regressions
+
+
+def main_suite(args):
+    parser = argparse.ArgumentParser(prog='asdl_bench.py suite')
+    parser.add_argument('--scales', default=','.join(map(str, SUITE_SCALES)),
+                        help='comma-separated numbers of definitions')
+    parser.add_argument('--json', help='file to save the results to')
+    args = parser.parse_args(args)
+    scales = [int(n) for n in args.scales.split(',')]
+    results = run_suite(scales)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+            f.write('\n')
+
+
+def main_compare(args):
+    parser = argparse.ArgumentParser(prog='asdl_bench.py compare')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='flag cases slower by more than this fraction')
+    args = parser.parse_args(args)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare_results(baseline, current, args.threshold)
+    if regressions:
+        print('%d regression(s) above %.0f%%' %
+              (len(regressions), args.threshold * 100))
+        sys.exit(1)
+
+
+def main(names):
+    if names and names[0] == 'suite':
+        return main_suite(names[1:])
+    if names and names[0] == 'compare':
+        return main_compare(names[1:])
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            print('Unknown benchmark %s; choose from: %s' %
+                  (name, ', '.join(BENCHMARKS)))
+            sys.exit(1)
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,45 @@
+# Simple testing / sanity-checking for the suite of asdl_bench.py
+
+import io, unittest
+import asdl_bench, asdl_harness
+
+
+class TestSuite(unittest.TestCase):
+    def test_run_suite(self):
+        out = io.StringIO()
+        results = asdl_bench.run_suite([10], out)
+        cases = [r['case'] for r in results['results']]
+        self.assertEqual(cases[:4], ['tokenize_asdl', 'ASDLParser.parse',
+                                     'check', 'reflow_lines'])
+        self.assertIn('Obj2ModVisitor', cases)
+        self.assertIn('StructVisitor', out.getvalue())
+        self.assertTrue(all(r['defs'] == 10 and r['seconds'] >= 0
+                            for r in results['results']))
+        if asdl_harness.unavailable_reason() is None:
+            slab = [r for r in results['results']
+                    if r['case'].startswith('obj2ast')]
+            self.assertEqual([r['case'] for r in slab],
+                             ['obj2ast', 'obj2ast --slab-alloc'])
+            self.assertLess(slab[1]['mallocs'], slab[0]['mallocs'])
+            self.assertTrue(all(r['nodes_per_second'] > 0 for r in slab))
+            self.assertIn('mallocs', out.getvalue())
+
+    def test_compare(self):
+        def results(*seconds):
+            return {'version': asdl_bench.SUITE_VERSION,
+                    'results': [{'case': case, 'defs': 10, 'seconds': s}
+                                for case, s in zip('abc', seconds)]}
+        out = io.StringIO()
+        regressions = asdl_bench.compare_results(results(1.0, 1.0, 1.0),
+                                                 results(1.05, 1.2, 0.5),
+                                                 out=out)
+        self.assertEqual(regressions, [('b', 10)])
+        self.assertEqual(out.getvalue().count('REGRESSION'), 1)
+        self.assertEqual(asdl_bench.compare_results(
+            results(1.0), results(1.2), threshold=0.5, out=out), [])
+        with self.assertRaises(ValueError):
+            asdl_bench.compare_results({'version': 0}, results(), out=out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 #! /usr/bin/env python
 """Generate C code from an ASDL description."""
 
-import os, sys
+import concurrent.futures, functools, io, locale, os, sys, uuid
 
 import asdl
 
@@ -28,37 +28,48 @@ def reflow_lines(s, depth):
     column as the first character beyond the opening { in the first
     line.
     """
-    size = MAX_COL - depth * TABSIZE
-    if len(s) < size:
+    if len(s) < MAX_COL - depth * TABSIZE:
         return [s]
+    return list(_reflow_long_line(s, depth))
+
+# Generated code repeats many long lines at the same depth (error messages,
+# constructor calls), so reflowed lines are memoized.
+@functools.lru_cache(maxsize=4096)
+def _reflow_long_line(s, depth):
+    """Reflow s, which does not fit at depth; return a tuple of lines.
 
+    Works on offsets into s instead of slicing off the remainder after each
+    break, so it is linear in the length of s.
+    """
+    size = MAX_COL - depth * TABSIZE
     lines = []
-    cur = s
+    start = 0
+    end = len(s)
     padding = ""
-    while len(cur) > size:
-        i = cur.rfind(' ', 0, size)
+    while end - start > size:
+        i = s.rfind(' ', start, start + size)
         # XXX this should be fixed for real
-        if i == -1 and 'GeneratorExp' in cur:
-            i = size + 3
+        if i == -1 and s.find('GeneratorExp', start) != -1:
+            i = start + size + 3
         assert i != -1, "Impossible line %d to reflow: %r" % (size, s)
-        lines.append(padding + cur[:i])
+        lines.append(padding + s[start:i])
         if len(lines) == 1:
             # find new size based on brace
-            j = cur.find('{', 0, i)
+            j = s.find('{', 0, i)
             if j >= 0:
                 j += 2 # account for the brace and the space after it
                 size -= j
                 padding = " " * j
             else:
-                j = cur.find('(', 0, i)
+                j = s.find('(', 0, i)
                 if j >= 0:
                     j += 1 # account for the paren (no space after it)
                     size -= j
                     padding = " " * j
-        cur = cur[i+1:]
+        start = i + 1
     else:
-        lines.append(padding + cur)
-    return lines
+        lines.append(padding + s[start:])
+    return tuple(lines)
 
 def is_simple(sum):
     """Return True if a sum is a simple.
@@ -71,15 +82,173 @@ def is_simple(sum):
             return False
     return True
 
+class SymbolTable:
+    """Facts about the types a module defines, precomputed for the emitters.
+
+    Every definition is classified as a simple sum (an enum), a sum with
+    constructors or a product. Sequences of simple sums are stored unboxed,
+    as asdl_int_seq.
+    """
+
+    def __init__(self, mod):
+        self.simple_sums = set()
+        self.complex_sums = set()
+        self.products = set()
+        # Types whose values are structs allocated in the arena, in
+        # definition order.
+        self.node_types = []
+        # Number of values of each simple sum.
+        self.enum_sizes = {}
+        for dfn in mod.dfns:
+            name = str(dfn.name)
+            if isinstance(dfn.value, asdl.Product):
+                self.products.add(name)
+            elif is_simple(dfn.value):
+                self.simple_sums.add(name)
+                self.enum_sizes[name] = len(dfn.value.types)
+                continue
+            else:
+                self.complex_sums.add(name)
+            self.node_types.append(name)
+
+    def is_simple_sum(self, name):
+        return str(name) in self.simple_sums
+
+    def is_node_type(self, name):
+        return str(name) in self.complex_sums or str(name) in self.products
+
+    def is_enum_seq(self, field):
+        """Return True if field is a sequence of a simple sum."""
+        return field.seq and str(field.type) in self.simple_sums
+
+    def seq_c_type(self, field):
+        """Return the C type of the sequence field."""
+        if self.is_enum_seq(field):
+            return "asdl_int_seq *"
+        return "asdl_seq *"
+
+@functools.lru_cache(maxsize=8)
+def get_symbol_table(mod):
+    """Return the SymbolTable of mod, building it on first use."""
+    return SymbolTable(mod)
+
+class Options:
+    """Options for the generated code.
+
+    Each option is a boolean class attribute. The defaults generate exactly
+    the code upstream CPython has; pass keyword arguments to turn options on.
+    """
+
+    # Dispatch obj2ast conversions of sums on the exact type of the object
+    # through a dict lookup, falling back to isinstance checks for subclasses.
+    fast_dispatch = False
+
+    # Convert the singletons of simple sums in obj2ast by comparing pointers,
+    # before checking the type of the object.
+    singleton_identity = False
+
+    # Look up each field of an object once in obj2ast, instead of checking
+    # for it and then getting it; plain AST objects are read from their dict.
+    single_lookup = False
+
+    # Lay out node structs compactly: the kind of a sum and enum fields are
+    # stored in the smallest fitting unsigned type, and the members of each
+    # struct are ordered by decreasing alignment to avoid padding.
+    compact_structs = False
+
+    # Convert sequences of enums to array('i') objects in ast2obj, and accept
+    # any buffer of C ints for them in obj2ast.
+    int_buffers = False
+
+    # Create node types on first use instead of all of them in init_types;
+    # the _ast module creates them when its attributes are looked up.
+    lazy_types = False
+
+    # Allocate the nodes of each type from their own slab in the arena, and
+    # let obj2ast reserve room for a whole sequence of nodes at once.
+    slab_alloc = False
+
+    # Store the fields and attributes of node objects in fixed slots instead
+    # of the instance dict; ast2obj writes them directly into the slots.
+    slot_layout = False
+
+    # Replace the ast2obj and obj2ast function of each type with descriptor
+    # tables of their fields, read by one generic converter each way.
+    table_driven = False
+
+    # Generate functions serializing trees to a compact binary format and
+    # reading them back, the format of the encode and decode functions of
+    # the modules asdl_py.py generates.
+    marshal = False
+
+    # Options changing the per-type converters, which table_driven replaces.
+    _converter_options = ("fast_dispatch", "singleton_identity",
+                          "single_lookup", "int_buffers", "lazy_types",
+                          "slot_layout")
+
+    def __init__(self, **options):
+        for name, value in options.items():
+            if not isinstance(getattr(Options, name, None), bool):
+                raise TypeError("unknown option %r" % name)
+            setattr(self, name, value)
+        if self.table_driven:
+            for name in self._converter_options:
+                if getattr(self, name):
+                    raise ValueError("option %r cannot be combined with "
+                                     "'table_driven'" % name)
+
+    @classmethod
+    def names(cls):
+        return sorted(name for name, value in vars(cls).items()
+                      if isinstance(value, bool))
+
+
+# Indentation prefix for each depth, extended on demand by get_indent.
+_indents = [""]
+
+def get_indent(depth):
+    while len(_indents) <= depth:
+        _indents.append(" " * TABSIZE * len(_indents))
+    return _indents[depth]
+
 
 class EmitVisitor(asdl.VisitorBase):
-    """Visit that emits lines"""
+    """Visit that emits lines
+
+    Lines are buffered and written to the file in batches of up to
+    buffer_lines lines. Visiting a Module flushes the buffer at the end;
+    call flush() after emitting anything else.
+    """
 
-    def __init__(self, file):
+    buffer_lines = 4096
+
+    def __init__(self, file, options=None):
         self.file = file
+        self.options = options or Options()
         self.identifiers = set()
+        self.symtab = None
+        self._buffer = []
+        # Characters written to file so far
+        self.emitted = 0
         super(EmitVisitor, self).__init__()
 
+    def visit(self, obj, *args):
+        if isinstance(obj, asdl.Module):
+            self.symtab = get_symbol_table(obj)
+            super(EmitVisitor, self).visit(obj, *args)
+            self.flush()
+        else:
+            super(EmitVisitor, self).visit(obj, *args)
+
+    def flush(self):
+        """Write out all buffered lines."""
+        if self._buffer:
+            self._buffer.append("")
+            text = "\n".join(self._buffer)
+            self.file.write(text)
+            self.emitted += len(text)
+            self._buffer = []
+
     def emit_identifier(self, name):
         name = str(name)
         if name in self.identifiers:
@@ -89,13 +258,18 @@ class EmitVisitor(asdl.VisitorBase):
 
     def emit(self, s, depth, reflow=True):
         # XXX reflow long lines?
-        if reflow:
-            lines = reflow_lines(s, depth)
+        if reflow and len(s) >= MAX_COL - depth * TABSIZE:
+            lines = _reflow_long_line(s, depth)
         else:
-            lines = [s]
-        for line in lines:
-            line = (" " * TABSIZE * depth) + line + "\n"
-            self.file.write(line)
+            lines = (s,)
+        buffer = self._buffer
+        indent = get_indent(depth)
+        if indent:
+            buffer.extend([indent + line for line in lines])
+        else:
+            buffer.extend(lines)
+        if len(buffer) >= self.buffer_lines:
+            self.flush()
 
 
 class TypeDefVisitor(EmitVisitor):
@@ -107,7 +281,7 @@ class TypeDefVisitor(EmitVisitor):
         self.visit(type.value, type.name, depth)
 
     def visitSum(self, sum, name, depth):
-        if is_simple(sum):
+        if self.symtab.is_simple_sum(name):
             self.simple_sum(sum, name, depth)
         else:
             self.sum_with_constructors(sum, name, depth)
@@ -136,6 +310,79 @@ class TypeDefVisitor(EmitVisitor):
         self.emit("", depth)
 
 
+# Struct layout for Options.compact_structs. Sizes and alignments are those
+# of LP64 platforms; the layout is only used to order members and report.
+
+def field_layout(symtab, field, compact):
+    """Return the declaration, size and alignment of a struct member."""
+    name = field.name
+    if field.seq:
+        return "%s%s" % (symtab.seq_c_type(field), name), 8, 8
+    if symtab.is_simple_sum(field.type):
+        if compact:
+            return "unsigned char %s" % name, 1, 1
+        return "%s %s" % (get_c_type(field.type), name), 4, 4
+    if str(field.type) == "int":
+        return "int %s" % name, 4, 4
+    return "%s %s" % (get_c_type(field.type), name), 8, 8
+
+def struct_layout(members):
+    """Return the size and alignment of a struct of (size, align) members."""
+    offset = 0
+    align = 1
+    for size, alignment in members:
+        offset = -(-offset // alignment) * alignment + size
+        align = max(align, alignment)
+    return -(-offset // align) * align, align
+
+def kind_layout(sum, compact):
+    """Return the C type, size and alignment of the kind of sum."""
+    if not compact:
+        return None, 4, 4
+    if len(sum.types) < 256:
+        return "unsigned char", 1, 1
+    return "unsigned short", 2, 2
+
+def struct_members(symtab, dfn, compact):
+    """Return the members of the struct of dfn as (decl, size, align).
+
+    The member for the union of a sum has None as declaration. In compact
+    layout, members are ordered by decreasing alignment.
+    """
+    value = dfn.value
+    members = [field_layout(symtab, f, compact)
+               for f in list(getattr(value, "fields", ())) + list(value.attributes)]
+    if isinstance(value, asdl.Sum):
+        union = [struct_layout(m[1:] for m in
+                               constructor_members(symtab, t, compact))
+                 for t in value.types if t.fields]
+        size, align = max(union or [(0, 1)])
+        members.insert(0, (None, -(-size // align) * align, align))
+        ctype, size, align = kind_layout(value, compact)
+        members.insert(0, ("%s kind" % ctype, size, align))
+    if compact:
+        members.sort(key=lambda m: -m[2])
+    return members
+
+def constructor_members(symtab, cons, compact):
+    members = [field_layout(symtab, f, compact) for f in cons.fields]
+    if compact:
+        members.sort(key=lambda m: -m[2])
+    return members
+
+def struct_sizes(mod):
+    """Return a list of (name, size, compact size) for the structs of mod."""
+    symtab = get_symbol_table(mod)
+    sizes = []
+    for dfn in mod.dfns:
+        if symtab.is_node_type(dfn.name):
+            sizes.append((str(dfn.name),) + tuple(
+                struct_layout(m[1:] for m in
+                              struct_members(symtab, dfn, compact))[0]
+                for compact in (False, True)))
+    return sizes
+
+
 class StructVisitor(EmitVisitor):
     """Visitor to generate typedefs for AST."""
 
@@ -144,10 +391,37 @@ class StructVisitor(EmitVisitor):
             self.visit(dfn)
 
     def visitType(self, type, depth=0):
-        self.visit(type.value, type.name, depth)
+        if self.options.compact_structs and self.symtab.is_node_type(type.name):
+            self.compact_struct(type, depth)
+        else:
+            self.visit(type.value, type.name, depth)
+
+    def compact_struct(self, type, depth):
+        name = type.name
+        if isinstance(type.value, asdl.Sum):
+            enum = ", ".join("%s_kind=%d" % (t.name, i + 1)
+                             for i, t in enumerate(type.value.types))
+            self.emit("enum _%s_kind {%s};" % (name, enum), depth)
+        self.emit("struct _%s {" % name, depth)
+        for decl, size, align in struct_members(self.symtab, type, True):
+            if decl is not None:
+                self.emit("%s;" % decl, depth + 1)
+                continue
+            self.emit("union {", depth + 1)
+            for t in type.value.types:
+                if t.fields:
+                    self.emit("struct {", depth + 2)
+                    for decl, size, align in constructor_members(
+                            self.symtab, t, True):
+                        self.emit("%s;" % decl, depth + 3)
+                    self.emit("} %s;" % t.name, depth + 2)
+                    self.emit("", depth + 2)
+            self.emit("} v;", depth + 1)
+        self.emit("};", depth)
+        self.emit("", depth)
 
     def visitSum(self, sum, name, depth):
-        if not is_simple(sum):
+        if not self.symtab.is_simple_sum(name):
             self.sum_with_constructors(sum, name, depth)
 
     def sum_with_constructors(self, sum, name, depth):
@@ -188,10 +462,8 @@ class StructVisitor(EmitVisitor):
         ctype = get_c_type(field.type)
         name = field.name
         if field.seq:
-            if field.type == 'cmpop':
-                self.emit("asdl_int_seq *%(name)s;" % locals(), depth)
-            else:
-                self.emit("asdl_seq *%(name)s;" % locals(), depth)
+            ctype = self.symtab.seq_c_type(field)
+            self.emit("%(ctype)s%(name)s;" % locals(), depth)
         else:
             self.emit("%(ctype)s %(name)s;" % locals(), depth)
 
@@ -217,9 +489,11 @@ class PrototypeVisitor(EmitVisitor):
 
     def visitType(self, type):
         self.visit(type.value, type.name)
+        if self.options.slab_alloc and self.symtab.is_node_type(type.name):
+            self.emit_reserve(type.name)
 
     def visitSum(self, sum, name):
-        if is_simple(sum):
+        if self.symtab.is_simple_sum(name):
             pass # XXX
         else:
             for t in sum.types:
@@ -241,12 +515,8 @@ class PrototypeVisitor(EmitVisitor):
                     name = "name%d" % (c - 1)
             else:
                 name = f.name
-            # XXX should extend get_c_type() to handle this
             if f.seq:
-                if f.type == 'cmpop':
-                    ctype = "asdl_int_seq *"
-                else:
-                    ctype = "asdl_seq *"
+                ctype = self.symtab.seq_c_type(f)
             else:
                 ctype = get_c_type(f.type)
             args.append((ctype, name, f.opt or f.seq))
@@ -277,10 +547,28 @@ class PrototypeVisitor(EmitVisitor):
         self.emit_function(name, get_c_type(name),
                            self.get_args(prod.fields), [], union=False)
 
+    def emit_reserve(self, name):
+        self.emit("int _Py_%s_reserve(Py_ssize_t n, PyArena *arena);" % name, 0)
+
 
 class FunctionVisitor(PrototypeVisitor):
     """Visitor to generate constructor functions for AST."""
 
+    def visitModule(self, mod):
+        if self.options.slab_alloc:
+            self.emit(SLAB_CODE % len(self.symtab.node_types), 0,
+                      reflow=False)
+        super().visitModule(mod)
+
+    def emit_reserve(self, name):
+        self.emit("int", 0)
+        self.emit("_Py_%s_reserve(Py_ssize_t n, PyArena *arena)" % name, 0)
+        self.emit("{", 0)
+        self.emit("return slab_reserve(&ast_slabs[%d], sizeof(struct _%s), n, "
+                  "arena);" % (self.symtab.node_types.index(name), name), 1)
+        self.emit("}", 0)
+        self.emit("", 0)
+
     def emit_function(self, name, ctype, args, attrs, union=True):
         def emit(s, depth=0, reflow=True):
             self.emit(s, depth, reflow)
@@ -304,7 +592,12 @@ class FunctionVisitor(PrototypeVisitor):
                 emit('return NULL;', 2)
                 emit('}', 1)
 
-        emit("p = (%s)PyArena_Malloc(arena, sizeof(*p));" % ctype, 1);
+        if self.options.slab_alloc:
+            slab = self.symtab.node_types.index(ctype[:-len("_ty")])
+            emit("p = (%s)slab_alloc(&ast_slabs[%d], sizeof(*p), arena);" %
+                 (ctype, slab), 1)
+        else:
+            emit("p = (%s)PyArena_Malloc(arena, sizeof(*p));" % ctype, 1);
         emit("if (!p)", 1)
         emit("return NULL;", 2)
         if union:
@@ -332,6 +625,101 @@ class FunctionVisitor(PrototypeVisitor):
         assert not attrs
 
 
+
+# Allocator for Options.slab_alloc. Each node type has a slab, a block of
+# the arena that its nodes are carved from. Slabs belong to the arena they
+# were last used with; a capsule in that arena forgets them when it is freed.
+SLAB_CODE = """
+typedef struct {
+    char *next;
+    char *end;
+    Py_ssize_t grow;    /* number of nodes in the next block */
+} ast_slab;
+
+#define SLAB_MIN_NODES 8
+#define SLAB_MAX_NODES 256
+
+static ast_slab ast_slabs[%d];
+static PyArena *slab_arena;
+
+/* Number of nodes allocated, and of blocks taken from the arena for them */
+static Py_ssize_t slab_nodes, slab_blocks;
+
+void
+_PyAST_SlabStats(Py_ssize_t *nodes, Py_ssize_t *blocks)
+{
+    *nodes = slab_nodes;
+    *blocks = slab_blocks;
+}
+
+static void
+slab_unbind(PyObject *capsule)
+{
+    if (PyCapsule_GetPointer(capsule, NULL) == slab_arena) {
+        memset(ast_slabs, 0, sizeof(ast_slabs));
+        slab_arena = NULL;
+    }
+}
+
+static int
+slab_bind(PyArena *arena)
+{
+    PyObject *capsule = PyCapsule_New(arena, NULL, slab_unbind);
+    if (!capsule)
+        return -1;
+    if (PyArena_AddPyObject(arena, capsule) < 0) {
+        Py_DECREF(capsule);
+        return -1;
+    }
+    memset(ast_slabs, 0, sizeof(ast_slabs));
+    slab_arena = arena;
+    return 0;
+}
+
+/* Make room for at least n nodes of the given size in slab. */
+static int
+slab_reserve(ast_slab *slab, size_t size, Py_ssize_t n, PyArena *arena)
+{
+    if (arena != slab_arena && slab_bind(arena) < 0)
+        return -1;
+    if ((size_t)(slab->end - slab->next) >= n * size)
+        return 0;
+    if (slab->grow < SLAB_MIN_NODES)
+        slab->grow = SLAB_MIN_NODES;
+    if (n < slab->grow)
+        n = slab->grow;
+    if ((size_t)n > PY_SSIZE_T_MAX / size) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    slab->next = (char *)PyArena_Malloc(arena, n * size);
+    if (!slab->next) {
+        slab->end = NULL;
+        return -1;
+    }
+    slab->end = slab->next + n * size;
+    if (slab->grow < SLAB_MAX_NODES)
+        slab->grow *= 2;
+    slab_blocks++;
+    return 0;
+}
+
+static void *
+slab_alloc(ast_slab *slab, size_t size, PyArena *arena)
+{
+    void *p;
+    if (arena != slab_arena || (size_t)(slab->end - slab->next) < size) {
+        if (slab_reserve(slab, size, 1, arena) < 0)
+            return NULL;
+    }
+    p = slab->next;
+    slab->next += size;
+    slab_nodes++;
+    return p;
+}
+
+"""
+
 class PickleVisitor(EmitVisitor):
 
     def visitModule(self, mod):
@@ -355,6 +743,10 @@ class PickleVisitor(EmitVisitor):
 
 
 class Obj2ModPrototypeVisitor(PickleVisitor):
+    def visitModule(self, mod):
+        if not self.options.table_driven:
+            super().visitModule(mod)
+
     def visitProduct(self, prod, name):
         code = "static int obj2ast_%s(PyObject* obj, %s* out, PyArena* arena);"
         self.emit(code % (name, get_c_type(name)), 0)
@@ -363,14 +755,27 @@ class Obj2ModPrototypeVisitor(PickleVisitor):
 
 
 class Obj2ModVisitor(PickleVisitor):
+    def visitModule(self, mod):
+        if self.options.table_driven:
+            self.emit(OBJ2AST_TABLE_CODE, 0, reflow=False)
+        else:
+            super().visitModule(mod)
+
     def funcHeader(self, name):
         ctype = get_c_type(name)
         self.emit("int", 0)
         self.emit("obj2ast_%s(PyObject* obj, %s* out, PyArena* arena)" % (name, ctype), 0)
         self.emit("{", 0)
-        self.emit("int isinstance;", 1)
+        if self.options.fast_dispatch:
+            self.emit("int kind;", 1)
+        else:
+            self.emit("int isinstance;", 1)
         self.emit("", 0)
 
+    def emitLookupKind(self, name):
+        self.emit("kind = lookup_kind(%s_dispatch, %s_kind_types, obj);" %
+                  (name, name), 1)
+
     def sumTrailer(self, name, add_label=False):
         self.emit("", 0)
         # there's really nothing more we can do if this fails ...
@@ -386,10 +791,29 @@ class Obj2ModVisitor(PickleVisitor):
 
     def simpleSum(self, sum, name):
         self.funcHeader(name)
+        if self.options.singleton_identity:
+            # ast2obj always returns the singletons, so they are by far the
+            # most common objects converted back.
+            for t in sum.types:
+                self.emit("if (obj == %s_singleton) {" % t.name, 1)
+                self.emit("*out = %s;" % t.name, 2)
+                self.emit("return 0;", 2)
+                self.emit("}", 1)
+        if self.options.fast_dispatch:
+            self.emitLookupKind(name)
+            self.emit("if (kind == -1) {", 1)
+            self.emit("return 1;", 2)
+            self.emit("}", 1)
+            self.emit("if (kind) {", 1)
+            self.emit("*out = (%s)kind;" % get_c_type(name), 2)
+            self.emit("return 0;", 2)
+            self.emit("}", 1)
+            self.sumTrailer(name)
+            return
         for t in sum.types:
             line = ("isinstance = PyObject_IsInstance(obj, "
                     "(PyObject *)%s_type);")
-            self.emit(line % (t.name,), 1)
+            self.emitIsInstance(line, t.name)
             self.emit("if (isinstance == -1) {", 1)
             self.emit("return 1;", 2)
             self.emit("}", 1)
@@ -399,6 +823,16 @@ class Obj2ModVisitor(PickleVisitor):
             self.emit("}", 1)
         self.sumTrailer(name)
 
+    def emitIsInstance(self, line, name):
+        if self.options.lazy_types:
+            # Types that have not been created yet have no instances.
+            self.emit("if (!%s_type)" % name, 1)
+            self.emit("isinstance = 0;", 2)
+            self.emit("else", 1)
+            self.emit(line % (name,), 2)
+        else:
+            self.emit(line % (name,), 1)
+
     def buildArgs(self, fields):
         return ", ".join(fields + ["arena"])
 
@@ -415,31 +849,46 @@ class Obj2ModVisitor(PickleVisitor):
         self.emit("}", 1)
         for a in sum.attributes:
             self.visitField(a, name, sum=sum, depth=1)
+        if self.options.fast_dispatch:
+            self.emitLookupKind(name)
+            self.emit("switch (kind) {", 1)
+            self.emit("case -1:", 1)
+            self.emit("return 1;", 2)
+            for t in sum.types:
+                self.emit("case %s_kind: {" % t.name, 1)
+                self.emitConstructorBody(t, sum, 2)
+                self.emit("}", 1)
+            self.emit("}", 1)
+            self.sumTrailer(name, True)
+            return
         for t in sum.types:
             line = "isinstance = PyObject_IsInstance(obj, (PyObject*)%s_type);"
-            self.emit(line % (t.name,), 1)
+            self.emitIsInstance(line, t.name)
             self.emit("if (isinstance == -1) {", 1)
             self.emit("return 1;", 2)
             self.emit("}", 1)
             self.emit("if (isinstance) {", 1)
-            for f in t.fields:
-                self.visitFieldDeclaration(f, t.name, sum=sum, depth=2)
-            self.emit("", 0)
-            for f in t.fields:
-                self.visitField(f, t.name, sum=sum, depth=2)
-            args = [f.name for f in t.fields] + [a.name for a in sum.attributes]
-            self.emit("*out = %s(%s);" % (t.name, self.buildArgs(args)), 2)
-            self.emit("if (*out == NULL) goto failed;", 2)
-            self.emit("return 0;", 2)
+            self.emitConstructorBody(t, sum, 2)
             self.emit("}", 1)
         self.sumTrailer(name, True)
 
+    def emitConstructorBody(self, t, sum, depth):
+        for f in t.fields:
+            self.visitFieldDeclaration(f, t.name, sum=sum, depth=depth)
+        self.emit("", 0)
+        for f in t.fields:
+            self.visitField(f, t.name, sum=sum, depth=depth)
+        args = [f.name for f in t.fields] + [a.name for a in sum.attributes]
+        self.emit("*out = %s(%s);" % (t.name, self.buildArgs(args)), depth)
+        self.emit("if (*out == NULL) goto failed;", depth)
+        self.emit("return 0;", depth)
+
     def visitAttributeDeclaration(self, a, name, sum=sum):
         ctype = get_c_type(a.type)
         self.emit("%s %s;" % (ctype, a.name), 1)
 
     def visitSum(self, sum, name):
-        if is_simple(sum):
+        if self.symtab.is_simple_sum(name):
             self.simpleSum(sum, name)
         else:
             self.complexSum(sum, name)
@@ -476,9 +925,7 @@ class Obj2ModVisitor(PickleVisitor):
             self.emit("%s %s;" % (ctype, field.name), depth)
 
     def isSimpleSum(self, field):
-        # XXX can the members of this list be determined automatically?
-        return field.type in ('expr_context', 'boolop', 'operator',
-                              'unaryop', 'cmpop')
+        return self.symtab.is_simple_sum(field.type)
 
     def isNumeric(self, field):
         return get_c_type(field.type) in ("int", "bool")
@@ -488,7 +935,14 @@ class Obj2ModVisitor(PickleVisitor):
 
     def visitField(self, field, name, sum=None, prod=None, depth=0):
         ctype = get_c_type(field.type)
-        if field.opt:
+        single_lookup = self.options.single_lookup
+        if single_lookup:
+            self.emit("tmp = lookup_attr(obj, &PyId_%s);" % field.name, depth)
+            if field.opt:
+                check = "tmp != NULL && tmp != Py_None"
+            else:
+                check = "tmp != NULL"
+        elif field.opt:
             check = "exists_not_none(obj, &PyId_%s)" % (field.name,)
         else:
             check = "_PyObject_HasAttrId(obj, &PyId_%s)" % (field.name,)
@@ -497,29 +951,20 @@ class Obj2ModVisitor(PickleVisitor):
         if field.seq:
             self.emit("Py_ssize_t len;", depth+1)
             self.emit("Py_ssize_t i;", depth+1)
-        self.emit("tmp = _PyObject_GetAttrId(obj, &PyId_%s);" % field.name, depth+1)
-        self.emit("if (tmp == NULL) goto failed;", depth+1)
-        if field.seq:
-            self.emit("if (!PyList_Check(tmp)) {", depth+1)
-            self.emit("PyErr_Format(PyExc_TypeError, \"%s field \\\"%s\\\" must "
-                      "be a list, not a %%.200s\", tmp->ob_type->tp_name);" %
-                      (name, field.name),
-                      depth+2, reflow=False)
-            self.emit("goto failed;", depth+2)
-            self.emit("}", depth+1)
-            self.emit("len = PyList_GET_SIZE(tmp);", depth+1)
-            if self.isSimpleType(field):
-                self.emit("%s = _Py_asdl_int_seq_new(len, arena);" % field.name, depth+1)
-            else:
-                self.emit("%s = _Py_asdl_seq_new(len, arena);" % field.name, depth+1)
-            self.emit("if (%s == NULL) goto failed;" % field.name, depth+1)
-            self.emit("for (i = 0; i < len; i++) {", depth+1)
-            self.emit("%s value;" % ctype, depth+2)
-            self.emit("res = obj2ast_%s(PyList_GET_ITEM(tmp, i), &value, arena);" %
-                      field.type, depth+2, reflow=False)
+        if not single_lookup:
+            self.emit("tmp = _PyObject_GetAttrId(obj, &PyId_%s);" % field.name, depth+1)
+            self.emit("if (tmp == NULL) goto failed;", depth+1)
+        if field.seq and self.options.int_buffers and self.symtab.is_enum_seq(field):
+            self.emit("if (PyObject_CheckBuffer(tmp)) {", depth+1)
+            self.emit('res = obj2ast_int_buffer(tmp, &%s, %d, "%s", arena);' %
+                      (field.name, self.symtab.enum_sizes[field.type],
+                       field.type), depth+2)
             self.emit("if (res != 0) goto failed;", depth+2)
-            self.emit("asdl_seq_SET(%s, i, value);" % field.name, depth+2)
+            self.emit("} else {", depth+1)
+            self.emitSeqFromList(field, name, ctype, depth+2)
             self.emit("}", depth+1)
+        elif field.seq:
+            self.emitSeqFromList(field, name, ctype, depth+1)
         else:
             self.emit("res = obj2ast_%s(tmp, &%s, arena);" %
                       (field.type, field.name), depth+1)
@@ -527,6 +972,9 @@ class Obj2ModVisitor(PickleVisitor):
 
         self.emit("Py_CLEAR(tmp);", depth+1)
         self.emit("} else {", depth)
+        if single_lookup and field.opt:
+            # tmp may hold a reference to None
+            self.emit("Py_CLEAR(tmp);", depth+1)
         if not field.opt:
             message = "required field \\\"%s\\\" missing from %s" % (field.name, name)
             format = "PyErr_SetString(PyExc_TypeError, \"%s\");"
@@ -541,119 +989,850 @@ class Obj2ModVisitor(PickleVisitor):
                 raise TypeError("could not determine the default value for %s" % field.name)
         self.emit("}", depth)
 
+    def emitSeqFromList(self, field, name, ctype, depth):
+        self.emit("if (!PyList_Check(tmp)) {", depth)
+        self.emit("PyErr_Format(PyExc_TypeError, \"%s field \\\"%s\\\" must "
+                  "be a list, not a %%.200s\", tmp->ob_type->tp_name);" %
+                  (name, field.name),
+                  depth+1, reflow=False)
+        self.emit("goto failed;", depth+1)
+        self.emit("}", depth)
+        self.emit("len = PyList_GET_SIZE(tmp);", depth)
+        if self.isSimpleType(field):
+            self.emit("%s = _Py_asdl_int_seq_new(len, arena);" % field.name, depth)
+        else:
+            self.emit("%s = _Py_asdl_seq_new(len, arena);" % field.name, depth)
+        self.emit("if (%s == NULL) goto failed;" % field.name, depth)
+        if self.options.slab_alloc and self.symtab.is_node_type(field.type):
+            self.emit("if (_Py_%s_reserve(len, arena) < 0) goto failed;" %
+                      field.type, depth)
+        self.emit("for (i = 0; i < len; i++) {", depth)
+        self.emit("%s value;" % ctype, depth+1)
+        self.emit("res = obj2ast_%s(PyList_GET_ITEM(tmp, i), &value, arena);" %
+                  field.type, depth+1, reflow=False)
+        self.emit("if (res != 0) goto failed;", depth+1)
+        self.emit("asdl_seq_SET(%s, i, value);" % field.name, depth+1)
+        self.emit("}", depth)
+
 
 class MarshalPrototypeVisitor(PickleVisitor):
 
+    def visitModule(self, mod):
+        self.emit(marshal_types_code(), 0, reflow=False)
+        super().visitModule(mod)
+
     def prototype(self, sum, name):
         ctype = get_c_type(name)
-        self.emit("static int marshal_write_%s(PyObject **, int *, %s);"
+        self.emit("static int marshal_write_%s(ast_writer *, %s);"
+                  % (name, ctype), 0)
+        self.emit("static int marshal_read_%s(ast_reader *, %s *, PyArena *);"
                   % (name, ctype), 0)
 
     visitProduct = visitSum = prototype
 
 
-class PyTypesDeclareVisitor(PickleVisitor):
+class MarshalVisitor(PickleVisitor):
+    """Generate the functions serializing each type, for Options.marshal.
 
-    def visitProduct(self, prod, name):
-        self.emit("static PyTypeObject *%s_type;" % name, 0)
-        self.emit("static PyObject* ast2obj_%s(void*);" % name, 0)
-        if prod.attributes:
-            for a in prod.attributes:
-                self.emit_identifier(a.name)
-            self.emit("static char *%s_attributes[] = {" % name, 0)
-            for a in prod.attributes:
-                self.emit('"%s",' % a.name, 1)
-            self.emit("};", 0)
-        if prod.fields:
-            for f in prod.fields:
-                self.emit_identifier(f.name)
-            self.emit("static char *%s_fields[]={" % name,0)
-            for f in prod.fields:
-                self.emit('"%s",' % f.name, 1)
-            self.emit("};", 0)
+    marshal_write_<type> appends a value to a writer; marshal_read_<type>
+    reads one back, building nodes with the constructor functions.
+    """
+
+    def visitModule(self, mod):
+        self.emit(MARSHAL_CODE, 0, reflow=False)
+        super().visitModule(mod)
 
     def visitSum(self, sum, name):
-        self.emit("static PyTypeObject *%s_type;" % name, 0)
-        if sum.attributes:
-            for a in sum.attributes:
-                self.emit_identifier(a.name)
-            self.emit("static char *%s_attributes[] = {" % name, 0)
-            for a in sum.attributes:
-                self.emit('"%s",' % a.name, 1)
-            self.emit("};", 0)
-        ptype = "void*"
-        if is_simple(sum):
-            ptype = get_c_type(name)
-            tnames = []
-            for t in sum.types:
-                tnames.append(str(t.name)+"_singleton")
-            tnames = ", *".join(tnames)
-            self.emit("static PyObject *%s;" % tnames, 0)
-        self.emit("static PyObject* ast2obj_%s(%s);" % (name, ptype), 0)
+        if self.symtab.is_simple_sum(name):
+            self.simpleSum(sum, name)
+            return
+        self.writeHeader(name)
+        self.emit("if (write_varint(w, o->kind) < 0)", 1)
+        self.emit("return -1;", 2)
+        self.emit("switch (o->kind) {", 1)
         for t in sum.types:
-            self.visitConstructor(t, name)
+            self.emit("case %s_kind:" % t.name, 1)
+            for f in t.fields:
+                self.writeField(f, "o->v.%s.%s" % (t.name, f.name), 2)
+            self.emit("break;", 2)
+        self.emit("}", 1)
+        self.writeTrailer(sum.attributes)
 
-    def visitConstructor(self, cons, name):
-        self.emit("static PyTypeObject *%s_type;" % cons.name, 0)
-        if cons.fields:
-            for t in cons.fields:
-                self.emit_identifier(t.name)
-            self.emit("static char *%s_fields[]={" % cons.name, 0)
-            for t in cons.fields:
-                self.emit('"%s",' % t.name, 1)
-            self.emit("};",0)
+        self.readHeader(name, sum.attributes, len(sum.types))
+        for t in sum.types:
+            self.emit("case %s_kind: {" % t.name, 1)
+            self.readConstructor(t.name, t.fields, sum.attributes, 2)
+            self.emit("break;", 2)
+            self.emit("}", 1)
+        self.readTrailer()
 
-class PyTypesVisitor(PickleVisitor):
+    def visitProduct(self, prod, name):
+        self.writeHeader(name)
+        self.emit("if (write_varint(w, 1) < 0)", 1)
+        self.emit("return -1;", 2)
+        for f in prod.fields:
+            self.writeField(f, "o->%s" % f.name, 1)
+        self.writeTrailer(prod.attributes)
+
+        self.readHeader(name, prod.attributes, 1)
+        self.emit("case 1: {", 1)
+        # The constructor functions of products take no attributes.
+        self.readConstructor(name, prod.fields, prod.attributes, 2,
+                             pass_attributes=False)
+        for a in prod.attributes:
+            self.emit("(*out)->%s = %s;" % (a.name, a.name), 2)
+        self.emit("break;", 2)
+        self.emit("}", 1)
+        self.readTrailer()
 
-    def visitModule(self, mod):
-        self.emit("""
-typedef struct {
-    PyObject_HEAD
-    PyObject *dict;
-} AST_object;
+    def simpleSum(self, sum, name):
+        ctype = get_c_type(name)
+        self.emit("static int", 0)
+        self.emit("marshal_write_%s(ast_writer *w, %s o)" % (name, ctype), 0)
+        self.emit("{", 0)
+        self.emit("return write_varint(w, o);", 1)
+        self.emit("}", 0)
+        self.emit("", 0)
+        self.emit("static int", 0)
+        self.emit("marshal_read_%s(ast_reader *r, %s *out, PyArena *arena)"
+                  % (name, ctype), 0)
+        self.emit("{", 0)
+        self.emit("int kind;", 1)
+        self.emit("", 0)
+        self.emit("if (read_kind(r, &kind, %d) < 0)" % len(sum.types), 1)
+        self.emit("return -1;", 2)
+        self.emit("*out = (%s)kind;" % ctype, 1)
+        self.emit("return 0;", 1)
+        self.emit("}", 0)
+        self.emit("", 0)
 
-static void
-ast_dealloc(AST_object *self)
-{
-    Py_CLEAR(self->dict);
-    Py_TYPE(self)->tp_free(self);
-}
+    def writeHeader(self, name):
+        self.emit("static int", 0)
+        self.emit("marshal_write_%s(ast_writer *w, %s o)"
+                  % (name, get_c_type(name)), 0)
+        self.emit("{", 0)
+        self.emit("if (!o)", 1)
+        self.emit("return write_varint(w, 0);", 2)
 
-static int
-ast_traverse(AST_object *self, visitproc visit, void *arg)
-{
-    Py_VISIT(self->dict);
-    return 0;
-}
+    def writeTrailer(self, attributes):
+        for a in attributes:
+            self.writeField(a, "o->%s" % a.name, 1)
+        self.emit("return 0;", 1)
+        self.emit("}", 0)
+        self.emit("", 0)
 
-static void
-ast_clear(AST_object *self)
-{
-    Py_CLEAR(self->dict);
-}
+    def writeField(self, field, value, depth):
+        if not field.seq:
+            self.emit("if (marshal_write_%s(w, %s) < 0)"
+                      % (marshal_type(field), value), depth)
+            self.emit("return -1;", depth + 1)
+            return
+        self.emit("{", depth)
+        self.emit("Py_ssize_t i, len = asdl_seq_LEN(%s);" % value, depth + 1)
+        self.emit("if (write_varint(w, len) < 0)", depth + 1)
+        self.emit("return -1;", depth + 2)
+        self.emit("for (i = 0; i < len; i++) {", depth + 1)
+        self.emit("if (marshal_write_%s(w, (%s)asdl_seq_GET(%s, i)) < 0)"
+                  % (field.type, get_c_type(field.type), value), depth + 2,
+                  reflow=False)
+        self.emit("return -1;", depth + 3)
+        self.emit("}", depth + 1)
+        self.emit("}", depth)
 
-static int
-ast_type_init(PyObject *self, PyObject *args, PyObject *kw)
-{
-    _Py_IDENTIFIER(_fields);
-    Py_ssize_t i, numfields = 0;
-    int res = -1;
-    PyObject *key, *value, *fields;
-    fields = _PyObject_GetAttrId((PyObject*)Py_TYPE(self), &PyId__fields);
-    if (!fields)
-        PyErr_Clear();
-    if (fields) {
-        numfields = PySequence_Size(fields);
-        if (numfields == -1)
-            goto cleanup;
-    }
-    res = 0; /* if no error occurs, this stays 0 to the end */
-    if (PyTuple_GET_SIZE(args) > 0) {
-        if (numfields != PyTuple_GET_SIZE(args)) {
-            PyErr_Format(PyExc_TypeError, "%.400s constructor takes %s"
-                         "%zd positional argument%s",
-                         Py_TYPE(self)->tp_name,
-                         numfields == 0 ? "" : "either 0 or ",
+    def readHeader(self, name, attributes, num_kinds):
+        self.emit("static int", 0)
+        self.emit("marshal_read_%s(ast_reader *r, %s *out, PyArena *arena)"
+                  % (name, get_c_type(name)), 0)
+        self.emit("{", 0)
+        self.emit("int kind;", 1)
+        for a in attributes:
+            self.emit("%s %s;" % (get_c_type(a.type), a.name), 1)
+        self.emit("", 0)
+        self.emit('if (Py_EnterRecursiveCall(" while reading AST data"))', 1)
+        self.emit("return -1;", 2)
+        self.emit("if (read_kind(r, &kind, %d) < 0)" % num_kinds, 1)
+        self.emit("goto failed;", 2)
+        self.emit("switch (kind) {", 1)
+        self.emit("case 0:", 1)
+        self.emit("*out = NULL;", 2)
+        self.emit("break;", 2)
+
+    def readTrailer(self):
+        self.emit("}", 1)
+        self.emit("Py_LeaveRecursiveCall();", 1)
+        self.emit("return 0;", 1)
+        self.emit("failed:", 0)
+        self.emit("Py_LeaveRecursiveCall();", 1)
+        self.emit("return -1;", 1)
+        self.emit("}", 0)
+        self.emit("", 0)
+
+    def readConstructor(self, name, fields, attributes, depth,
+                        pass_attributes=True):
+        for f in fields:
+            if f.seq:
+                ctype = self.symtab.seq_c_type(f)
+                self.emit("%s%s;" % (ctype, f.name), depth)
+            else:
+                self.emit("%s %s;" % (get_c_type(f.type), f.name), depth)
+        if fields:
+            self.emit("", 0)
+        for f in list(fields) + list(attributes):
+            self.readField(f, depth)
+        args = [str(f.name) for f in fields]
+        if pass_attributes:
+            args += [str(a.name) for a in attributes]
+        self.emit("*out = %s(%s);" % (name, ", ".join(args + ["arena"])),
+                  depth)
+        self.emit("if (*out == NULL)", depth)
+        self.emit("goto failed;", depth + 1)
+
+    def readField(self, field, depth):
+        if not field.seq:
+            self.emit("if (marshal_read_%s(r, &%s, arena) < 0)"
+                      % (marshal_type(field), field.name), depth)
+            self.emit("goto failed;", depth + 1)
+            return
+        if self.symtab.is_enum_seq(field):
+            new = "_Py_asdl_int_seq_new"
+        else:
+            new = "_Py_asdl_seq_new"
+        self.emit("{", depth)
+        self.emit("Py_ssize_t i, len;", depth + 1)
+        self.emit("", 0)
+        self.emit("if (read_size(r, &len) < 0)", depth + 1)
+        self.emit("goto failed;", depth + 2)
+        self.emit("%s = %s(len, arena);" % (field.name, new), depth + 1)
+        self.emit("if (%s == NULL)" % field.name, depth + 1)
+        self.emit("goto failed;", depth + 2)
+        if self.options.slab_alloc and self.symtab.is_node_type(field.type):
+            self.emit("if (_Py_%s_reserve(len, arena) < 0)" % field.type,
+                      depth + 1)
+            self.emit("goto failed;", depth + 2)
+        self.emit("for (i = 0; i < len; i++) {", depth + 1)
+        self.emit("%s value;" % get_c_type(field.type), depth + 2)
+        self.emit("if (marshal_read_%s(r, &value, arena) < 0)" % field.type,
+                  depth + 2)
+        self.emit("goto failed;", depth + 3)
+        self.emit("asdl_seq_SET(%s, i, value);" % field.name, depth + 2)
+        self.emit("}", depth + 1)
+        self.emit("}", depth)
+
+
+def marshal_type(field):
+    """Return the suffix of the marshal functions of a field's values."""
+    if str(field.type) == "int" and field.opt:
+        # Written with a tag, so that the Python serializer can write None
+        return "opt_int"
+    return str(field.type)
+
+
+# The serialized format of Options.marshal, shared with the Python serializer
+# of asdl_py.py. A tree is a version byte and its root node. A node is its
+# kind (the index of its constructor plus one, 1 for products, 0 for NULL),
+# then its fields and attributes in order. A sequence is its length and its
+# items, an enum its kind and an int a zigzag varint. Other builtin values
+# are a tag byte and a payload; each new str is numbered, and written again
+# as a STR_REF to that number.
+MARSHAL_VERSION = 1
+MARSHAL_TAGS = ("NONE", "FALSE", "TRUE", "INT", "BIG_INT", "FLOAT",
+                "COMPLEX", "STR", "STR_REF", "BYTES")
+
+
+def marshal_types_code():
+    defines = ["#define MARSHAL_VERSION %d" % MARSHAL_VERSION]
+    defines += ["#define TAG_%s %d" % (tag, i)
+                for i, tag in enumerate(MARSHAL_TAGS)]
+    return "\n".join(defines) + MARSHAL_TYPES_CODE
+
+
+MARSHAL_TYPES_CODE = """
+
+typedef struct {
+    char *buf;
+    Py_ssize_t len;
+    Py_ssize_t size;
+    PyObject *strs; /* dict of the str values written to their number */
+} ast_writer;
+
+typedef struct {
+    const unsigned char *p;
+    const unsigned char *end;
+    PyObject *strs; /* list of the str values read */
+} ast_reader;
+"""
+
+MARSHAL_CODE = """
+#if PY_VERSION_HEX >= 0x030B0000
+#define pack_double(x, p) PyFloat_Pack8((x), (char *)(p), 1)
+#define unpack_double(p) PyFloat_Unpack8((const char *)(p), 1)
+#else
+#define pack_double(x, p) _PyFloat_Pack8((x), (unsigned char *)(p), 1)
+#define unpack_double(p) _PyFloat_Unpack8((const unsigned char *)(p), 1)
+#endif
+
+static int
+write_bytes(ast_writer *w, const char *p, Py_ssize_t n)
+{
+    if (w->size - w->len < n) {
+        Py_ssize_t size = w->size + (w->size >> 1) + n + 256;
+        char *buf = PyMem_Realloc(w->buf, size);
+        if (!buf) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        w->buf = buf;
+        w->size = size;
+    }
+    memcpy(w->buf + w->len, p, n);
+    w->len += n;
+    return 0;
+}
+
+static int
+write_varint(ast_writer *w, unsigned long long v)
+{
+    char b[10];
+    int n = 0;
+
+    if (v < 0x80 && w->len < w->size) {
+        w->buf[w->len++] = (char)v;
+        return 0;
+    }
+    while (v >= 0x80) {
+        b[n++] = (char)(v | 0x80);
+        v >>= 7;
+    }
+    b[n++] = (char)v;
+    return write_bytes(w, b, n);
+}
+
+static int
+write_int(ast_writer *w, long long v)
+{
+    unsigned long long u = (unsigned long long)v << 1;
+    return write_varint(w, v < 0 ? ~u : u);
+}
+
+static int
+write_sized(ast_writer *w, int tag, const char *p, Py_ssize_t n)
+{
+    if (write_varint(w, tag) < 0 || write_varint(w, n) < 0)
+        return -1;
+    return write_bytes(w, p, n);
+}
+
+static int
+write_encoded(ast_writer *w, int tag, PyObject *str)
+{
+    PyObject *data;
+    int res;
+
+    data = PyUnicode_AsEncodedString(str, "utf-8", "surrogatepass");
+    if (!data)
+        return -1;
+    res = write_sized(w, tag, PyBytes_AS_STRING(data), PyBytes_GET_SIZE(data));
+    Py_DECREF(data);
+    return res;
+}
+
+static int
+write_object(ast_writer *w, PyObject *o)
+{
+    if (o == NULL || o == Py_None)
+        return write_varint(w, TAG_NONE);
+    if (o == Py_False)
+        return write_varint(w, TAG_FALSE);
+    if (o == Py_True)
+        return write_varint(w, TAG_TRUE);
+    if (PyUnicode_Check(o)) {
+        PyObject *index = PyDict_GetItemWithError(w->strs, o);
+        if (index) {
+            if (write_varint(w, TAG_STR_REF) < 0)
+                return -1;
+            return write_varint(w, PyLong_AsSsize_t(index));
+        }
+        if (PyErr_Occurred())
+            return -1;
+        index = PyLong_FromSsize_t(PyDict_Size(w->strs));
+        if (!index || PyDict_SetItem(w->strs, o, index) < 0) {
+            Py_XDECREF(index);
+            return -1;
+        }
+        Py_DECREF(index);
+        return write_encoded(w, TAG_STR, o);
+    }
+    if (PyLong_Check(o)) {
+        int overflow;
+        long long v = PyLong_AsLongLongAndOverflow(o, &overflow);
+        PyObject *digits;
+        int res;
+
+        if (v == -1 && PyErr_Occurred())
+            return -1;
+        if (!overflow) {
+            if (write_varint(w, TAG_INT) < 0)
+                return -1;
+            return write_int(w, v);
+        }
+        digits = PyObject_Str(o);
+        if (!digits)
+            return -1;
+        res = write_encoded(w, TAG_BIG_INT, digits);
+        Py_DECREF(digits);
+        return res;
+    }
+    if (PyFloat_Check(o)) {
+        char b[9];
+        b[0] = TAG_FLOAT;
+        if (pack_double(PyFloat_AS_DOUBLE(o), b + 1) < 0)
+            return -1;
+        return write_bytes(w, b, 9);
+    }
+    if (PyComplex_Check(o)) {
+        char b[17];
+        Py_complex c = PyComplex_AsCComplex(o);
+        b[0] = TAG_COMPLEX;
+        if (pack_double(c.real, b + 1) < 0 || pack_double(c.imag, b + 9) < 0)
+            return -1;
+        return write_bytes(w, b, 17);
+    }
+    if (PyBytes_Check(o))
+        return write_sized(w, TAG_BYTES, PyBytes_AS_STRING(o),
+                           PyBytes_GET_SIZE(o));
+    PyErr_Format(PyExc_TypeError, "cannot serialize %.200s objects",
+                 Py_TYPE(o)->tp_name);
+    return -1;
+}
+
+#define marshal_write_object write_object
+#define marshal_write_singleton write_object
+#define marshal_write_identifier write_object
+#define marshal_write_string write_object
+#define marshal_write_bytes write_object
+
+static int
+marshal_write_int(ast_writer *w, int o)
+{
+    return write_int(w, o);
+}
+
+static int
+marshal_write_opt_int(ast_writer *w, int o)
+{
+    if (write_varint(w, TAG_INT) < 0)
+        return -1;
+    return write_int(w, o);
+}
+
+static int
+read_error(void)
+{
+    PyErr_SetString(PyExc_ValueError, "truncated or malformed AST data");
+    return -1;
+}
+
+static int
+read_varint(ast_reader *r, unsigned long long *out)
+{
+    unsigned long long v = 0;
+    int shift = 0;
+
+    for (;;) {
+        if (r->p == r->end || shift > 63)
+            return read_error();
+        v |= (unsigned long long)(*r->p & 0x7f) << shift;
+        if (!(*r->p++ & 0x80))
+            break;
+        shift += 7;
+    }
+    *out = v;
+    return 0;
+}
+
+/* Read a length, which cannot exceed the number of bytes left */
+static int
+read_size(ast_reader *r, Py_ssize_t *out)
+{
+    unsigned long long v;
+
+    if (read_varint(r, &v) < 0)
+        return -1;
+    if (v > (unsigned long long)(r->end - r->p))
+        return read_error();
+    *out = (Py_ssize_t)v;
+    return 0;
+}
+
+static int
+read_kind(ast_reader *r, int *out, int max)
+{
+    unsigned long long v;
+
+    if (read_varint(r, &v) < 0)
+        return -1;
+    if (v > (unsigned long long)max)
+        return read_error();
+    *out = (int)v;
+    return 0;
+}
+
+static int
+read_int(ast_reader *r, long long *out)
+{
+    unsigned long long v;
+
+    if (read_varint(r, &v) < 0)
+        return -1;
+    *out = v & 1 ? (long long)~(v >> 1) : (long long)(v >> 1);
+    return 0;
+}
+
+static const unsigned char *
+read_raw(ast_reader *r, Py_ssize_t n)
+{
+    const unsigned char *p = r->p;
+
+    if (r->end - p < n) {
+        read_error();
+        return NULL;
+    }
+    r->p += n;
+    return p;
+}
+
+static PyObject *
+read_str(ast_reader *r)
+{
+    Py_ssize_t n;
+    const unsigned char *p;
+
+    if (read_size(r, &n) < 0 || !(p = read_raw(r, n)))
+        return NULL;
+    return PyUnicode_DecodeUTF8((const char *)p, n, "surrogatepass");
+}
+
+/* Read a tagged value into a new reference */
+static int
+read_object(ast_reader *r, PyObject **out)
+{
+    const unsigned char *p;
+    PyObject *str;
+    long long v;
+    unsigned long long index;
+    Py_ssize_t n;
+    double real, imag;
+
+    if (r->p == r->end)
+        return read_error();
+    switch (*r->p++) {
+    case TAG_NONE:
+        Py_INCREF(Py_None);
+        *out = Py_None;
+        return 0;
+    case TAG_FALSE:
+        Py_INCREF(Py_False);
+        *out = Py_False;
+        return 0;
+    case TAG_TRUE:
+        Py_INCREF(Py_True);
+        *out = Py_True;
+        return 0;
+    case TAG_INT:
+        if (read_int(r, &v) < 0)
+            return -1;
+        *out = PyLong_FromLongLong(v);
+        break;
+    case TAG_BIG_INT:
+        str = read_str(r);
+        if (!str)
+            return -1;
+        *out = PyLong_FromUnicodeObject(str, 10);
+        Py_DECREF(str);
+        break;
+    case TAG_FLOAT:
+        if (!(p = read_raw(r, 8)))
+            return -1;
+        real = unpack_double(p);
+        if (real == -1.0 && PyErr_Occurred())
+            return -1;
+        *out = PyFloat_FromDouble(real);
+        break;
+    case TAG_COMPLEX:
+        if (!(p = read_raw(r, 16)))
+            return -1;
+        real = unpack_double(p);
+        if (real == -1.0 && PyErr_Occurred())
+            return -1;
+        imag = unpack_double(p + 8);
+        if (imag == -1.0 && PyErr_Occurred())
+            return -1;
+        *out = PyComplex_FromDoubles(real, imag);
+        break;
+    case TAG_STR:
+        *out = read_str(r);
+        if (*out && PyList_Append(r->strs, *out) < 0)
+            Py_CLEAR(*out);
+        break;
+    case TAG_STR_REF:
+        if (read_varint(r, &index) < 0)
+            return -1;
+        if (index >= (unsigned long long)PyList_GET_SIZE(r->strs))
+            return read_error();
+        *out = PyList_GET_ITEM(r->strs, (Py_ssize_t)index);
+        Py_INCREF(*out);
+        break;
+    case TAG_BYTES:
+        if (read_size(r, &n) < 0 || !(p = read_raw(r, n)))
+            return -1;
+        *out = PyBytes_FromStringAndSize((const char *)p, n);
+        break;
+    default:
+        return read_error();
+    }
+    return *out ? 0 : -1;
+}
+
+#define MARSHAL_READ_OBJECT(type) \\
+static int \\
+marshal_read_##type(ast_reader *r, PyObject **out, PyArena *arena) \\
+{ \\
+    PyObject *obj; \\
+    int res; \\
+\\
+    if (read_object(r, &obj) < 0) \\
+        return -1; \\
+    res = obj2ast_##type(obj, out, arena); \\
+    Py_DECREF(obj); \\
+    return res ? -1 : 0; \\
+}
+
+MARSHAL_READ_OBJECT(object)
+MARSHAL_READ_OBJECT(singleton)
+MARSHAL_READ_OBJECT(identifier)
+MARSHAL_READ_OBJECT(string)
+MARSHAL_READ_OBJECT(bytes)
+
+static int
+marshal_read_int(ast_reader *r, int *out, PyArena *arena)
+{
+    long long v;
+
+    if (read_int(r, &v) < 0)
+        return -1;
+    if (v < INT_MIN || v > INT_MAX)
+        return read_error();
+    *out = (int)v;
+    return 0;
+}
+
+static int
+marshal_read_opt_int(ast_reader *r, int *out, PyArena *arena)
+{
+    PyObject *obj;
+    int res = 0;
+
+    if (read_object(r, &obj) < 0)
+        return -1;
+    if (obj == Py_None)
+        *out = 0;
+    else
+        res = obj2ast_int(obj, out, arena);
+    Py_DECREF(obj);
+    return res ? -1 : 0;
+}
+"""
+
+MARSHAL_ENTRY_CODE = """
+PyObject* PyAST_%(root)s2bytes(%(ctype)s t)
+{
+    ast_writer w;
+    PyObject *result = NULL;
+
+    w.buf = NULL;
+    w.len = w.size = 0;
+    w.strs = PyDict_New();
+    if (!w.strs)
+        return NULL;
+    if (write_varint(&w, MARSHAL_VERSION) == 0 &&
+        marshal_write_%(root)s(&w, t) == 0)
+        result = PyBytes_FromStringAndSize(w.buf, w.len);
+    PyMem_Free(w.buf);
+    Py_DECREF(w.strs);
+    return result;
+}
+
+%(ctype)s PyAST_bytes2%(root)s(const char *data, Py_ssize_t size, PyArena *arena)
+{
+    ast_reader r;
+    unsigned long long version;
+    %(ctype)s result = NULL;
+
+    r.p = (const unsigned char *)data;
+    r.end = r.p + size;
+    r.strs = PyList_New(0);
+    if (!r.strs)
+        return NULL;
+    if (read_varint(&r, &version) < 0)
+        goto done;
+    if (version != MARSHAL_VERSION) {
+        PyErr_Format(PyExc_ValueError, "unsupported AST data version %%llu",
+                     version);
+        goto done;
+    }
+    if (marshal_read_%(root)s(&r, &result, arena) < 0)
+        result = NULL;
+    else if (r.p != r.end) {
+        read_error();
+        result = NULL;
+    }
+done:
+    Py_DECREF(r.strs);
+    return result;
+}
+"""
+
+
+def marshal_prototypes(mod):
+    """Return the prototypes of the public functions of Options.marshal."""
+    root = str(mod.dfns[0].name)
+    ctype = get_c_type(root)
+    return ("PyObject* PyAST_%s2bytes(%s t);\n"
+            "%s PyAST_bytes2%s(const char *data, Py_ssize_t size, "
+            "PyArena *arena);\n" % (root, ctype, ctype, root))
+
+
+class PyTypesDeclareVisitor(PickleVisitor):
+
+    def visitProduct(self, prod, name):
+        self.emit("static PyTypeObject *%s_type;" % name, 0)
+        if not self.options.table_driven:
+            self.emit("static PyObject* ast2obj_%s(void*);" % name, 0)
+        if prod.attributes:
+            for a in prod.attributes:
+                self.emit_identifier(a.name)
+            self.emit("static char *%s_attributes[] = {" % name, 0)
+            for a in prod.attributes:
+                self.emit('"%s",' % a.name, 1)
+            self.emit("};", 0)
+        if prod.fields:
+            for f in prod.fields:
+                self.emit_identifier(f.name)
+            self.emit("static char *%s_fields[]={" % name,0)
+            for f in prod.fields:
+                self.emit('"%s",' % f.name, 1)
+            self.emit("};", 0)
+        self.emitSlotOffsets(name, prod)
+
+    def visitSum(self, sum, name):
+        self.emit("static PyTypeObject *%s_type;" % name, 0)
+        if sum.attributes:
+            for a in sum.attributes:
+                self.emit_identifier(a.name)
+            self.emit("static char *%s_attributes[] = {" % name, 0)
+            for a in sum.attributes:
+                self.emit('"%s",' % a.name, 1)
+            self.emit("};", 0)
+        self.emitSlotOffsets(name, sum)
+        ptype = "void*"
+        if self.symtab.is_simple_sum(name):
+            ptype = get_c_type(name)
+            tnames = []
+            for t in sum.types:
+                tnames.append(str(t.name)+"_singleton")
+            tnames = ", *".join(tnames)
+            self.emit("static PyObject *%s;" % tnames, 0)
+        if not self.options.table_driven:
+            self.emit("static PyObject* ast2obj_%s(%s);" % (name, ptype), 0)
+        for t in sum.types:
+            self.visitConstructor(t, name)
+        if self.options.fast_dispatch:
+            # Maps each constructor type to its kind (its index + 1).
+            self.emit("static PyObject *%s_dispatch;" % name, 0)
+            self.emit("static PyTypeObject **%s_kind_types[] = {" % name, 0)
+            for t in sum.types:
+                self.emit("&%s_type," % t.name, 1)
+            self.emit("NULL", 1)
+            self.emit("};", 0)
+
+    def visitConstructor(self, cons, name):
+        self.emit("static PyTypeObject *%s_type;" % cons.name, 0)
+        if cons.fields:
+            for t in cons.fields:
+                self.emit_identifier(t.name)
+            self.emit("static char *%s_fields[]={" % cons.name, 0)
+            for t in cons.fields:
+                self.emit('"%s",' % t.name, 1)
+            self.emit("};",0)
+        self.emitSlotOffsets(cons.name, cons)
+
+    def emitSlotOffsets(self, name, node):
+        # With Options.slot_layout, the offsets of the slots of each type
+        # are filled in by init_types, and used by ast2obj to store values.
+        if not self.options.slot_layout:
+            return
+        if getattr(node, "fields", None):
+            self.emit("static Py_ssize_t %s_field_offsets[%d];" %
+                      (name, len(node.fields)), 0)
+        if getattr(node, "attributes", None):
+            self.emit("static Py_ssize_t %s_attribute_offsets[%d];" %
+                      (name, len(node.attributes)), 0)
+
+class PyTypesVisitor(PickleVisitor):
+
+    def visitModule(self, mod):
+        if self.options.slot_layout:
+            reduce_code = SLOTS_REDUCE_CODE
+        else:
+            reduce_code = DICT_REDUCE_CODE
+        code = """
+typedef struct {
+    PyObject_HEAD
+    PyObject *dict;
+} AST_object;
+
+static void
+ast_dealloc(AST_object *self)
+{
+    Py_CLEAR(self->dict);
+    Py_TYPE(self)->tp_free(self);
+}
+
+static int
+ast_traverse(AST_object *self, visitproc visit, void *arg)
+{
+    Py_VISIT(self->dict);
+    return 0;
+}
+
+static void
+ast_clear(AST_object *self)
+{
+    Py_CLEAR(self->dict);
+}
+
+static int
+ast_type_init(PyObject *self, PyObject *args, PyObject *kw)
+{
+    _Py_IDENTIFIER(_fields);
+    Py_ssize_t i, numfields = 0;
+    int res = -1;
+    PyObject *key, *value, *fields;
+    fields = _PyObject_GetAttrId((PyObject*)Py_TYPE(self), &PyId__fields);
+    if (!fields)
+        PyErr_Clear();
+    if (fields) {
+        numfields = PySequence_Size(fields);
+        if (numfields == -1)
+            goto cleanup;
+    }
+    res = 0; /* if no error occurs, this stays 0 to the end */
+    if (PyTuple_GET_SIZE(args) > 0) {
+        if (numfields != PyTuple_GET_SIZE(args)) {
+            PyErr_Format(PyExc_TypeError, "%.400s constructor takes %s"
+                         "%zd positional argument%s",
+                         Py_TYPE(self)->tp_name,
+                         numfields == 0 ? "" : "either 0 or ",
                          numfields, numfields == 1 ? "" : "s");
             res = -1;
             goto cleanup;
@@ -669,42 +1848,25 @@ ast_type_init(PyObject *self, PyObject *args, PyObject *kw)
             Py_DECREF(name);
             if (res < 0)
                 goto cleanup;
-        }
-    }
-    if (kw) {
-        i = 0;  /* needed by PyDict_Next */
-        while (PyDict_Next(kw, &i, &key, &value)) {
-            res = PyObject_SetAttr(self, key, value);
-            if (res < 0)
-                goto cleanup;
-        }
-    }
-  cleanup:
-    Py_XDECREF(fields);
-    return res;
-}
-
-/* Pickling support */
-static PyObject *
-ast_type_reduce(PyObject *self, PyObject *unused)
-{
-    PyObject *res;
-    _Py_IDENTIFIER(__dict__);
-    PyObject *dict = _PyObject_GetAttrId(self, &PyId___dict__);
-    if (dict == NULL) {
-        if (PyErr_ExceptionMatches(PyExc_AttributeError))
-            PyErr_Clear();
-        else
-            return NULL;
+        }
     }
-    if (dict) {
-        res = Py_BuildValue("O()O", Py_TYPE(self), dict);
-        Py_DECREF(dict);
-        return res;
+    if (kw) {
+        i = 0;  /* needed by PyDict_Next */
+        while (PyDict_Next(kw, &i, &key, &value)) {
+            res = PyObject_SetAttr(self, key, value);
+            if (res < 0)
+                goto cleanup;
+        }
     }
-    return Py_BuildValue("O()", Py_TYPE(self));
+  cleanup:
+    Py_XDECREF(fields);
+    return res;
 }
 
+/* Pickling support */
+"""
+        code += reduce_code
+        code += """
 static PyMethodDef ast_type_methods[] = {
     {"__reduce__", ast_type_reduce, METH_NOARGS, NULL},
     {NULL}
@@ -800,25 +1962,7 @@ static int add_attributes(PyTypeObject* type, char**attrs, int num_fields)
 
 /* Conversion AST -> Python */
 
-static PyObject* ast2obj_list(asdl_seq *seq, PyObject* (*func)(void*))
-{
-    Py_ssize_t i, n = asdl_seq_LEN(seq);
-    PyObject *result = PyList_New(n);
-    PyObject *value;
-    if (!result)
-        return NULL;
-    for (i = 0; i < n; i++) {
-        value = func(asdl_seq_GET(seq, i));
-        if (!value) {
-            Py_DECREF(result);
-            return NULL;
-        }
-        PyList_SET_ITEM(result, i, value);
-    }
-    return result;
-}
-
-static PyObject* ast2obj_object(void *o)
+""" + ("" if self.options.table_driven else AST2OBJ_LIST_CODE) + """static PyObject* ast2obj_object(void *o)
 {
     if (!o)
         o = Py_None;
@@ -921,8 +2065,17 @@ static int add_ast_fields(void)
     Py_DECREF(empty_tuple);
     return 0;
 }
-
-static int exists_not_none(PyObject *obj, _Py_Identifier *id)
+"""
+        if self.options.slot_layout:
+            code += SLOTS_CODE
+        self.emit(code, 0, reflow=False)
+        if self.options.single_lookup:
+            if self.options.slot_layout:
+                self.emit(LOOKUP_SLOT_ATTR_CODE, 0, reflow=False)
+            else:
+                self.emit(LOOKUP_ATTR_CODE, 0, reflow=False)
+        else:
+            self.emit("""static int exists_not_none(PyObject *obj, _Py_Identifier *id)
 {
     int isnone;
     PyObject *attr = _PyObject_GetAttrId(obj, id);
@@ -930,70 +2083,646 @@ static int exists_not_none(PyObject *obj, _Py_Identifier *id)
         PyErr_Clear();
         return 0;
     }
-    isnone = attr == Py_None;
-    Py_DECREF(attr);
-    return !isnone;
+    isnone = attr == Py_None;
+    Py_DECREF(attr);
+    return !isnone;
+}
+
+""", 0, reflow=False)
+        if self.options.fast_dispatch:
+            self.emit(DISPATCH_CODE, 0, reflow=False)
+        if self.options.int_buffers:
+            self.emit(INT_BUFFER_CODE, 0, reflow=False)
+
+        if self.options.lazy_types:
+            self.emitTypeTable(mod)
+        self.emit("static int init_types(void)",0)
+        self.emit("{", 0)
+        self.emit("static int initialized;", 1)
+        self.emit("if (initialized) return 1;", 1)
+        self.emit("if (add_ast_fields() < 0) return 0;", 1)
+        for dfn in mod.dfns:
+            if not self.options.lazy_types:
+                self.visit(dfn)
+            elif self.options.fast_dispatch and isinstance(dfn.value, asdl.Sum):
+                self.emitDispatch(dfn.name)
+        self.emit("initialized = 1;", 1)
+        self.emit("return 1;", 1);
+        self.emit("}", 0)
+        if self.options.lazy_types:
+            self.emit(lazy_type_code(self.options), 0, reflow=False)
+
+    def emitTypeTable(self, mod):
+        # One descriptor per type, from which lazy_type creates the type.
+        # The index of each descriptor is named <type>_index.
+        names = []
+        entries = []
+        def add(name, base, fields, attributes, singleton=False,
+                sum_name=None, kind=None):
+            names.append(name)
+            entry = ['"%s"' % name, "&%s_type" % name,
+                     "%s_index" % base if base else "-1",
+                     "%s_fields" % name if fields else "NULL", str(len(fields)),
+                     "%s_attributes" % name if attributes else "NULL",
+                     str(len(attributes)) if attributes is not None else "-1",
+                     "&%s_singleton" % name if singleton else "NULL"]
+            if self.options.slot_layout:
+                entry.append("%s_field_offsets" % name if fields else "NULL")
+                entry.append("%s_attribute_offsets" % name
+                             if attributes else "NULL")
+            if self.options.fast_dispatch:
+                entry.append("&%s_dispatch" % sum_name if sum_name else "NULL")
+                entry.append(str(kind or 0))
+            entries.append(entry)
+        for dfn in mod.dfns:
+            name = str(dfn.name)
+            value = dfn.value
+            if isinstance(value, asdl.Product):
+                add(name, None, value.fields, value.attributes)
+                continue
+            add(name, None, (), value.attributes)
+            simple = self.symtab.is_simple_sum(name)
+            for i, t in enumerate(value.types):
+                add(t.name, name, t.fields, None, simple, name, i + 1)
+        self.emit("enum type_index {", 0)
+        for name in names:
+            self.emit("%s_index," % name, 1)
+        self.emit("};", 0)
+        self.emit("", 0)
+        self.emit(type_desc_code(self.options), 0, reflow=False)
+        self.emit("static type_desc type_descs[] = {", 0)
+        for entry in entries:
+            self.emit("{%s}," % ", ".join(entry), 1)
+        self.emit("};", 0)
+        self.emit("", 0)
+
+    def visitProduct(self, prod, name):
+        if prod.fields:
+            fields = name+"_fields"
+        else:
+            fields = "NULL"
+        if self.options.slot_layout:
+            self.emitMakeSlotsType(name, "&AST_type", prod.fields,
+                                   prod.attributes)
+        else:
+            self.emit('%s_type = make_type("%s", &AST_type, %s, %d);' %
+                            (name, name, fields, len(prod.fields)), 1)
+            self.emit("if (!%s_type) return 0;" % name, 1)
+        if prod.attributes:
+            self.emit("if (!add_attributes(%s_type, %s_attributes, %d)) return 0;" %
+                            (name, name, len(prod.attributes)), 1)
+        else:
+            self.emit("if (!add_attributes(%s_type, NULL, 0)) return 0;" % name, 1)
+
+    def visitSum(self, sum, name):
+        if self.options.slot_layout:
+            self.emitMakeSlotsType(name, "&AST_type", (), sum.attributes)
+        else:
+            self.emit('%s_type = make_type("%s", &AST_type, NULL, 0);' %
+                      (name, name), 1)
+            self.emit("if (!%s_type) return 0;" % name, 1)
+        if sum.attributes:
+            self.emit("if (!add_attributes(%s_type, %s_attributes, %d)) return 0;" %
+                            (name, name, len(sum.attributes)), 1)
+        else:
+            self.emit("if (!add_attributes(%s_type, NULL, 0)) return 0;" % name, 1)
+        simple = self.symtab.is_simple_sum(name)
+        for t in sum.types:
+            self.visitConstructor(t, name, simple)
+        if self.options.fast_dispatch:
+            self.emitDispatch(name)
+
+    def emitDispatch(self, name):
+        self.emit("%s_dispatch = make_dispatch(%s_kind_types);" % (name, name), 1)
+        self.emit("if (!%s_dispatch) return 0;" % name, 1)
+
+    def visitConstructor(self, cons, name, simple):
+        if cons.fields:
+            fields = cons.name+"_fields"
+        else:
+            fields = "NULL"
+        if self.options.slot_layout:
+            self.emitMakeSlotsType(cons.name, name + "_type", cons.fields, ())
+        else:
+            self.emit('%s_type = make_type("%s", %s_type, %s, %d);' %
+                                (cons.name, cons.name, name, fields, len(cons.fields)), 1)
+            self.emit("if (!%s_type) return 0;" % cons.name, 1)
+        if simple:
+            self.emit("%s_singleton = PyType_GenericNew(%s_type, NULL, NULL);" %
+                             (cons.name, cons.name), 1)
+            self.emit("if (!%s_singleton) return 0;" % cons.name, 1)
+
+    def emitMakeSlotsType(self, name, base, fields, attributes):
+        fields_array = name + "_fields" if fields else "NULL"
+        attrs_array = name + "_attributes" if attributes else "NULL"
+        self.emit('%s_type = make_slots_type("%s", %s, %s, %d, %s, %d);' %
+                  (name, name, base, fields_array, len(fields),
+                   attrs_array, len(attributes)), 1)
+        self.emit("if (!%s_type) return 0;" % name, 1)
+        if fields:
+            self.emit("if (!slot_offsets(%s_type, %s, %d, %s_field_offsets))" %
+                      (name, fields_array, len(fields), name), 1)
+            self.emit("return 0;", 2)
+        if attributes:
+            self.emit("if (!slot_offsets(%s_type, %s, %d, %s_attribute_offsets))" %
+                      (name, attrs_array, len(attributes), name), 1)
+            self.emit("return 0;", 2)
+
+
+AST2OBJ_LIST_CODE = """static PyObject* ast2obj_list(asdl_seq *seq, PyObject* (*func)(void*))
+{
+    Py_ssize_t i, n = asdl_seq_LEN(seq);
+    PyObject *result = PyList_New(n);
+    PyObject *value;
+    if (!result)
+        return NULL;
+    for (i = 0; i < n; i++) {
+        value = func(asdl_seq_GET(seq, i));
+        if (!value) {
+            Py_DECREF(result);
+            return NULL;
+        }
+        PyList_SET_ITEM(result, i, value);
+    }
+    return result;
+}
+
+"""
+
+DICT_REDUCE_CODE = """static PyObject *
+ast_type_reduce(PyObject *self, PyObject *unused)
+{
+    PyObject *res;
+    _Py_IDENTIFIER(__dict__);
+    PyObject *dict = _PyObject_GetAttrId(self, &PyId___dict__);
+    if (dict == NULL) {
+        if (PyErr_ExceptionMatches(PyExc_AttributeError))
+            PyErr_Clear();
+        else
+            return NULL;
+    }
+    if (dict) {
+        res = Py_BuildValue("O()O", Py_TYPE(self), dict);
+        Py_DECREF(dict);
+        return res;
+    }
+    return Py_BuildValue("O()", Py_TYPE(self));
+}
+"""
+
+
+# With Options.slot_layout, fields and attributes are not in the instance
+# dict, so pickle and copy get them as slot state, restored with setattr.
+SLOTS_REDUCE_CODE = """static PyObject *
+ast_type_reduce(PyObject *self, PyObject *unused)
+{
+    _Py_IDENTIFIER(__dict__);
+    _Py_IDENTIFIER(_fields);
+    _Py_IDENTIFIER(_attributes);
+    _Py_Identifier *kinds[] = {&PyId__fields, &PyId__attributes};
+    PyObject *dict, *state, *names, *name, *value, *res = NULL;
+    Py_ssize_t i;
+    int k;
+    dict = _PyObject_GetAttrId(self, &PyId___dict__);
+    if (dict == NULL) {
+        if (PyErr_ExceptionMatches(PyExc_AttributeError))
+            PyErr_Clear();
+        else
+            return NULL;
+    }
+    state = PyDict_New();
+    if (!state)
+        goto done;
+    for (k = 0; k < 2; k++) {
+        names = _PyObject_GetAttrId((PyObject*)Py_TYPE(self), kinds[k]);
+        if (!names)
+            goto done;
+        for (i = 0; PyTuple_Check(names) && i < PyTuple_GET_SIZE(names); i++) {
+            name = PyTuple_GET_ITEM(names, i);
+            value = PyObject_GetAttr(self, name);
+            if (!value) {
+                if (!PyErr_ExceptionMatches(PyExc_AttributeError))
+                    break;
+                PyErr_Clear();
+                continue;
+            }
+            if (PyDict_SetItem(state, name, value) < 0) {
+                Py_DECREF(value);
+                break;
+            }
+            Py_DECREF(value);
+        }
+        Py_DECREF(names);
+        if (PyErr_Occurred())
+            goto done;
+    }
+    res = Py_BuildValue("O()(OO)", Py_TYPE(self), dict ? dict : Py_None, state);
+  done:
+    Py_XDECREF(dict);
+    Py_XDECREF(state);
+    return res;
+}
+"""
+
+SLOTS_CODE = """
+static PyObject* make_names(char **names, int num_names)
+{
+    PyObject *result = PyTuple_New(num_names);
+    int i;
+    if (!result)
+        return NULL;
+    for (i = 0; i < num_names; i++) {
+        PyObject *name = PyUnicode_InternFromString(names[i]);
+        if (!name) {
+            Py_DECREF(result);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(result, i, name);
+    }
+    return result;
+}
+
+/* Like make_type, but give the type a slot for each of its fields and of
+   the given attributes, so that instances do not need a dict. */
+static PyTypeObject* make_slots_type(char *type, PyTypeObject* base,
+                                     char **fields, int num_fields,
+                                     char **attrs, int num_attrs)
+{
+    PyObject *fnames, *anames, *slots, *result = NULL;
+    fnames = make_names(fields, num_fields);
+    anames = make_names(attrs, num_attrs);
+    if (fnames && anames) {
+        slots = PySequence_Concat(fnames, anames);
+        if (slots) {
+            result = PyObject_CallFunction((PyObject*)&PyType_Type,
+                            "s(O){sOsOss}", type, base, "_fields", fnames,
+                            "__slots__", slots, "__module__", "_ast");
+            Py_DECREF(slots);
+        }
+    }
+    Py_XDECREF(fnames);
+    Py_XDECREF(anames);
+    return (PyTypeObject*)result;
+}
+
+/* Store the offsets of the slots of type for the given names in offsets. */
+static int slot_offsets(PyTypeObject *type, char **names, int num_names,
+                        Py_ssize_t *offsets)
+{
+    PyObject *descr;
+    int i;
+    for (i = 0; i < num_names; i++) {
+        descr = PyDict_GetItemString(type->tp_dict, names[i]);
+        if (!descr || Py_TYPE(descr) != &PyMemberDescr_Type) {
+            PyErr_Format(PyExc_SystemError, "%s has no slot %s",
+                         type->tp_name, names[i]);
+            return 0;
+        }
+        offsets[i] = ((PyMemberDescrObject*)descr)->d_member->offset;
+    }
+    return 1;
+}
+
+/* Store a new reference in an empty slot, stealing it from value. */
+#define STORE_SLOT(obj, offset, value) \\
+    (*(PyObject **)((char *)(obj) + (offset)) = (value), (value) = NULL)
+
+"""
+
+
+# Options.lazy_types: init_types only readies AST, and lazy_type creates each
+# node type, with its bases, the first time it is needed.
+
+def type_desc_code(options):
+    code = """typedef struct {
+    char *name;
+    PyTypeObject **type;
+    int base;               /* index of the base type, or -1 for AST */
+    char **fields;
+    int num_fields;
+    char **attributes;
+    int num_attributes;     /* -1 for constructors, which inherit them */
+    PyObject **singleton;   /* for constructors of simple sums */
+"""
+    if options.slot_layout:
+        code += """    Py_ssize_t *field_offsets;
+    Py_ssize_t *attribute_offsets;
+"""
+    if options.fast_dispatch:
+        code += """    PyObject **dispatch;    /* for constructors of sums */
+    int kind;
+"""
+    return code + "} type_desc;\n"
+
+def lazy_type_code(options):
+    code = """
+/* Return the type with the given index, creating it if needed; return NULL
+   with an exception set on failure. */
+static PyTypeObject* lazy_type(int index)
+{
+    type_desc *desc = &type_descs[index];
+    PyTypeObject *base = &AST_type;
+    if (*desc->type)
+        return *desc->type;
+    if (!init_types())
+        return NULL;
+    if (desc->base >= 0) {
+        base = lazy_type(desc->base);
+        if (!base)
+            return NULL;
+    }
+"""
+    if options.slot_layout:
+        code += """    *desc->type = make_slots_type(desc->name, base,
+                                  desc->fields, desc->num_fields,
+                                  desc->attributes,
+                                  desc->num_attributes < 0 ? 0 : desc->num_attributes);
+    if (!*desc->type)
+        return NULL;
+    if (!slot_offsets(*desc->type, desc->fields, desc->num_fields,
+                      desc->field_offsets))
+        goto failed;
+    if (desc->num_attributes > 0 &&
+        !slot_offsets(*desc->type, desc->attributes, desc->num_attributes,
+                      desc->attribute_offsets))
+        goto failed;
+"""
+    else:
+        code += """    *desc->type = make_type(desc->name, base, desc->fields, desc->num_fields);
+    if (!*desc->type)
+        return NULL;
+"""
+    code += """    if (desc->num_attributes >= 0 &&
+        !add_attributes(*desc->type, desc->attributes, desc->num_attributes))
+        goto failed;
+    if (desc->singleton) {
+        *desc->singleton = PyType_GenericNew(*desc->type, NULL, NULL);
+        if (!*desc->singleton)
+            goto failed;
+    }
+"""
+    if options.fast_dispatch:
+        code += """    if (desc->dispatch) {
+        PyObject *kind = PyLong_FromLong(desc->kind);
+        if (!kind || PyDict_SetItem(*desc->dispatch, (PyObject*)*desc->type,
+                                    kind) < 0) {
+            Py_XDECREF(kind);
+            goto failed;
+        }
+        Py_DECREF(kind);
+    }
+"""
+    return code + """    return *desc->type;
+  failed:
+    Py_CLEAR(*desc->type);
+    if (desc->singleton)
+        Py_CLEAR(*desc->singleton);
+    return NULL;
+}
+
+"""
+
+# Helpers for Options.int_buffers. An asdl_int_seq is copied into or out of
+# a contiguous buffer of C ints; no object is created for its elements.
+INT_BUFFER_CODE = """
+static PyObject *int_array_zero;
+
+static PyObject* ast2obj_int_array(asdl_int_seq *seq)
+{
+    /* Repeat array('i', [0]) to allocate the array, then copy the items */
+    Py_ssize_t n = asdl_seq_LEN(seq);
+    Py_buffer view;
+    PyObject *result;
+    if (!int_array_zero) {
+        PyObject *array = PyImport_ImportModule("array");
+        if (!array)
+            return NULL;
+        int_array_zero = PyObject_CallMethod(array, "array", "s[i]", "i", 0);
+        Py_DECREF(array);
+        if (!int_array_zero)
+            return NULL;
+    }
+    result = PySequence_Repeat(int_array_zero, n);
+    if (!result || !n)
+        return result;
+    if (PyObject_GetBuffer(result, &view, PyBUF_WRITABLE) < 0) {
+        Py_DECREF(result);
+        return NULL;
+    }
+    memcpy(view.buf, seq->elements, n * sizeof(int));
+    PyBuffer_Release(&view);
+    return result;
+}
+
+/* Convert a buffer of C ints, each of them one of the max values of the
+   enum type, to an asdl_int_seq. */
+static int obj2ast_int_buffer(PyObject* obj, asdl_int_seq** out, int max,
+                              const char *type, PyArena* arena)
+{
+    Py_buffer view;
+    Py_ssize_t i, len;
+    int *items;
+    if (PyObject_GetBuffer(obj, &view, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS) < 0)
+        return 1;
+    if (view.itemsize != sizeof(int) || view.ndim > 1 || !view.format ||
+        (strcmp(view.format, "i") && strcmp(view.format, "@i"))) {
+        PyErr_Format(PyExc_TypeError,
+                     "buffer of %s must be a contiguous buffer of C ints, "
+                     "not of format '%s'", type,
+                     view.format ? view.format : "B");
+        PyBuffer_Release(&view);
+        return 1;
+    }
+    len = view.len / sizeof(int);
+    items = (int*)view.buf;
+    *out = _Py_asdl_int_seq_new(len, arena);
+    if (*out == NULL) {
+        PyBuffer_Release(&view);
+        return 1;
+    }
+    for (i = 0; i < len; i++) {
+        if (items[i] < 1 || items[i] > max) {
+            PyErr_Format(PyExc_ValueError, "invalid %s value: %d", type,
+                         items[i]);
+            PyBuffer_Release(&view);
+            return 1;
+        }
+        asdl_seq_SET(*out, i, items[i]);
+    }
+    PyBuffer_Release(&view);
+    return 0;
+}
+
+"""
+
+# Helpers for Options.fast_dispatch. Each sum has a NULL-terminated array of
+# its constructor types, in declaration order, and a dict mapping each of these
+# types to its kind (its index + 1, which is also its enum value). Types that
+# have not been created yet, with Options.lazy_types, are skipped.
+DISPATCH_CODE = """
+static PyObject* make_dispatch(PyTypeObject ***types)
+{
+    PyObject *dispatch, *kind;
+    int i;
+    dispatch = PyDict_New();
+    if (!dispatch)
+        return NULL;
+    for (i = 0; types[i]; i++) {
+        if (!*types[i])
+            continue;
+        kind = PyLong_FromLong(i + 1);
+        if (!kind || PyDict_SetItem(dispatch, (PyObject*)*types[i], kind) < 0) {
+            Py_XDECREF(kind);
+            Py_DECREF(dispatch);
+            return NULL;
+        }
+        Py_DECREF(kind);
+    }
+    return dispatch;
+}
+
+/* Return the kind of obj, 0 if it is not of any of the types, or -1 with an
+   exception set. Exact type matches take one dict lookup; only instances of
+   subclasses go through PyObject_IsInstance, in declaration order. */
+static int lookup_kind(PyObject *dispatch, PyTypeObject ***types, PyObject *obj)
+{
+    PyObject *kind;
+    int i, isinstance;
+    kind = PyDict_GetItemWithError(dispatch, (PyObject*)Py_TYPE(obj));
+    if (kind)
+        return (int)PyLong_AsLong(kind);
+    if (PyErr_Occurred())
+        return -1;
+    for (i = 0; types[i]; i++) {
+        if (!*types[i])
+            continue;
+        isinstance = PyObject_IsInstance(obj, (PyObject*)*types[i]);
+        if (isinstance)
+            return isinstance < 0 ? -1 : i + 1;
+    }
+    return 0;
+}
+"""
+
+
+# Helper for Options.single_lookup, replacing exists_not_none.
+LOOKUP_ATTR_CODE = """static PyObject* lookup_attr(PyObject *obj, _Py_Identifier *id)
+{
+    /* Return a new reference to the attribute id of obj, or NULL if it is
+       missing. Like _PyObject_HasAttrId, any error counts as missing. Plain
+       AST objects, whose types do not define the attribute, are read
+       straight from their instance dict. */
+    PyObject *attr;
+    if (Py_TYPE(obj)->tp_getattro == PyObject_GenericGetAttr &&
+        PyObject_TypeCheck(obj, &AST_type) &&
+        _PyType_LookupId(Py_TYPE(obj), id) == NULL) {
+        PyObject *dict = ((AST_object*)obj)->dict;
+        attr = dict ? _PyDict_GetItemId(dict, id) : NULL;
+        Py_XINCREF(attr);
+        return attr;
+    }
+    attr = _PyObject_GetAttrId(obj, id);
+    if (!attr)
+        PyErr_Clear();
+    return attr;
+}
+
+"""
+
+# Options.single_lookup together with Options.slot_layout: fields stored in
+# slots are read through the offset of their member descriptor.
+LOOKUP_SLOT_ATTR_CODE = """static PyObject* lookup_attr(PyObject *obj, _Py_Identifier *id)
+{
+    /* Return a new reference to the attribute id of obj, or NULL if it is
+       missing. Like _PyObject_HasAttrId, any error counts as missing. For
+       plain AST objects, slots and the instance dict are read directly. */
+    PyObject *attr, *descr;
+    if (Py_TYPE(obj)->tp_getattro == PyObject_GenericGetAttr &&
+        PyObject_TypeCheck(obj, &AST_type)) {
+        descr = _PyType_LookupId(Py_TYPE(obj), id);
+        if (descr == NULL) {
+            PyObject *dict = ((AST_object*)obj)->dict;
+            attr = dict ? _PyDict_GetItemId(dict, id) : NULL;
+            Py_XINCREF(attr);
+            return attr;
+        }
+        if (Py_TYPE(descr) == &PyMemberDescr_Type &&
+            ((PyMemberDescrObject*)descr)->d_member->type == T_OBJECT_EX) {
+            PyMemberDef *member = ((PyMemberDescrObject*)descr)->d_member;
+            attr = *(PyObject **)((char *)obj + member->offset);
+            Py_XINCREF(attr);
+            return attr;
+        }
+    }
+    attr = _PyObject_GetAttrId(obj, id);
+    if (!attr)
+        PyErr_Clear();
+    return attr;
 }
 
-""", 0, reflow=False)
+"""
 
-        self.emit("static int init_types(void)",0)
-        self.emit("{", 0)
-        self.emit("static int initialized;", 1)
-        self.emit("if (initialized) return 1;", 1)
-        self.emit("if (add_ast_fields() < 0) return 0;", 1)
-        for dfn in mod.dfns:
-            self.visit(dfn)
-        self.emit("initialized = 1;", 1)
-        self.emit("return 1;", 1);
-        self.emit("}", 0)
 
-    def visitProduct(self, prod, name):
-        if prod.fields:
-            fields = name+"_fields"
-        else:
-            fields = "NULL"
-        self.emit('%s_type = make_type("%s", &AST_type, %s, %d);' %
-                        (name, name, fields, len(prod.fields)), 1)
-        self.emit("if (!%s_type) return 0;" % name, 1)
-        if prod.attributes:
-            self.emit("if (!add_attributes(%s_type, %s_attributes, %d)) return 0;" %
-                            (name, name, len(prod.attributes)), 1)
-        else:
-            self.emit("if (!add_attributes(%s_type, NULL, 0)) return 0;" % name, 1)
+# With Options.lazy_types, node types are not in the dict of the _ast module
+# until they are looked up through the module __getattr__ (Python 3.7+).
+# __all__ lists them for star imports.
+LAZY_MODULE_CODE = """static PyObject* ast_module_getattr(PyObject *module, PyObject *name)
+{
+    PyTypeObject *type;
+    int i;
+    for (i = 0; i < (int)(sizeof(type_descs) / sizeof(type_descs[0])); i++) {
+        if (PyUnicode_CompareWithASCIIString(name, type_descs[i].name) == 0) {
+            type = lazy_type(i);
+            if (!type || PyObject_SetAttr(module, name, (PyObject*)type) < 0)
+                return NULL;
+            Py_INCREF(type);
+            return (PyObject*)type;
+        }
+    }
+    PyErr_Format(PyExc_AttributeError, "module '_ast' has no attribute '%U'",
+                 name);
+    return NULL;
+}
 
-    def visitSum(self, sum, name):
-        self.emit('%s_type = make_type("%s", &AST_type, NULL, 0);' %
-                  (name, name), 1)
-        self.emit("if (!%s_type) return 0;" % name, 1)
-        if sum.attributes:
-            self.emit("if (!add_attributes(%s_type, %s_attributes, %d)) return 0;" %
-                            (name, name, len(sum.attributes)), 1)
-        else:
-            self.emit("if (!add_attributes(%s_type, NULL, 0)) return 0;" % name, 1)
-        simple = is_simple(sum)
-        for t in sum.types:
-            self.visitConstructor(t, name, simple)
+static PyMethodDef ast_module_methods[] = {
+    {"__getattr__", ast_module_getattr, METH_O, NULL},
+    {NULL}
+};
 
-    def visitConstructor(self, cons, name, simple):
-        if cons.fields:
-            fields = cons.name+"_fields"
-        else:
-            fields = "NULL"
-        self.emit('%s_type = make_type("%s", %s_type, %s, %d);' %
-                            (cons.name, cons.name, name, fields, len(cons.fields)), 1)
-        self.emit("if (!%s_type) return 0;" % cons.name, 1)
-        if simple:
-            self.emit("%s_singleton = PyType_GenericNew(%s_type, NULL, NULL);" %
-                             (cons.name, cons.name), 1)
-            self.emit("if (!%s_singleton) return 0;" % cons.name, 1)
+static int add_all(PyObject *d)
+{
+    PyObject *all, *name;
+    int i, res;
+    all = Py_BuildValue("[ss]", "AST", "PyCF_ONLY_AST");
+    if (!all)
+        return -1;
+    for (i = 0; i < (int)(sizeof(type_descs) / sizeof(type_descs[0])); i++) {
+        name = PyUnicode_InternFromString(type_descs[i].name);
+        if (!name || PyList_Append(all, name) < 0) {
+            Py_XDECREF(name);
+            Py_DECREF(all);
+            return -1;
+        }
+        Py_DECREF(name);
+    }
+    res = PyDict_SetItemString(d, "__all__", all);
+    Py_DECREF(all);
+    return res;
+}
 
+"""
 
 class ASTModuleVisitor(PickleVisitor):
 
     def visitModule(self, mod):
+        lazy = self.options.lazy_types
+        if lazy:
+            self.emit(LAZY_MODULE_CODE, 0, reflow=False)
         self.emit("static struct PyModuleDef _astmodule = {", 0)
-        self.emit('  PyModuleDef_HEAD_INIT, "_ast"', 0)
+        if lazy:
+            self.emit('  PyModuleDef_HEAD_INIT, "_ast", NULL, -1, ast_module_methods', 0)
+        else:
+            self.emit('  PyModuleDef_HEAD_INIT, "_ast"', 0)
         self.emit("};", 0)
         self.emit("PyMODINIT_FUNC", 0)
         self.emit("PyInit__ast(void)", 0)
@@ -1006,8 +2735,11 @@ class ASTModuleVisitor(PickleVisitor):
         self.emit('if (PyDict_SetItemString(d, "AST", (PyObject*)&AST_type) < 0) return NULL;', 1)
         self.emit('if (PyModule_AddIntMacro(m, PyCF_ONLY_AST) < 0)', 1)
         self.emit("return NULL;", 2)
-        for dfn in mod.dfns:
-            self.visit(dfn)
+        if lazy:
+            self.emit("if (add_all(d) < 0) return NULL;", 1)
+        else:
+            for dfn in mod.dfns:
+                self.visit(dfn)
         self.emit("return m;", 1)
         self.emit("}", 0)
 
@@ -1050,10 +2782,88 @@ class StaticVisitor(PickleVisitor):
 
     def visit(self, object):
         self.emit(self.CODE, 0, reflow=False)
+        self.flush()
 
 
 class ObjVisitor(PickleVisitor):
 
+    def visitModule(self, mod):
+        if self.options.table_driven:
+            self.emitDescTables(mod)
+            self.emit(AST2OBJ_TABLE_CODE, 0, reflow=False)
+        else:
+            super().visitModule(mod)
+
+    def emitDescTables(self, mod):
+        self.emit(DESC_TABLE_CODE, 0, reflow=False)
+        self.emit("enum node_desc_index {", 0)
+        for dfn in mod.dfns:
+            self.emit("%s_desc," % dfn.name, 1)
+        self.emit("};", 0)
+        self.emit("", 0)
+        descs = []
+        for dfn in mod.dfns:
+            name, node = str(dfn.name), dfn.value
+            attributes = self.emitFieldDescs(name + "_attribute_descs", name,
+                                             "", node.attributes)
+            if isinstance(node, asdl.Product):
+                cons = [(name, "", node.fields)]
+                layout = "PRODUCT_LAYOUT(%s)" % name
+            else:
+                cons = [(str(t.name), "v.%s." % t.name, t.fields)
+                        for t in node.types]
+                if self.symtab.is_simple_sum(name):
+                    layout = "ENUM_LAYOUT"
+                else:
+                    layout = "SUM_LAYOUT(%s)" % name
+            rows = []
+            for cons_name, prefix, fields in cons:
+                table = self.emitFieldDescs(cons_name + "_field_descs", name,
+                                            prefix, fields)
+                if self.symtab.is_simple_sum(name):
+                    singleton = "&%s_singleton" % cons_name
+                else:
+                    singleton = "NULL"
+                rows.append('{"%s", &%s_type, %s, %s, %d},' %
+                            (cons_name, cons_name, singleton, table,
+                             len(fields)))
+            self.emitTable("static const cons_desc %s_cons[]" % name, rows)
+            descs.append('{"%s", %s_cons, %d, %s, %d, %s},' %
+                         (name, name, len(cons), attributes,
+                          len(node.attributes), layout))
+        self.emitTable("static const node_desc node_descs[]", descs)
+
+    def emitFieldDescs(self, table, type, prefix, fields):
+        """Emit the field_desc table of fields and return its name.
+
+        prefix leads to the fields in the struct of type.
+        """
+        if not fields:
+            return "NULL"
+        rows = []
+        for f in fields:
+            kind = field_kind(self.symtab, f)
+            if f.seq:
+                flags = "SEQ_FIELD"
+            elif f.opt:
+                flags = "OPT_FIELD"
+            else:
+                flags = "0"
+            if kind in ("ENUM_FIELD", "NODE_FIELD"):
+                desc = "%s_desc" % f.type
+            else:
+                desc = "0"
+            rows.append("FIELD(%s, %s%s, %s, %s, %s, %s)," %
+                        (type, prefix, f.name, f.name, kind, flags, desc))
+        self.emitTable("static const field_desc %s[]" % table, rows)
+        return table
+
+    def emitTable(self, declaration, rows):
+        self.emit("%s = {" % declaration, 0)
+        for row in rows:
+            self.emit(row, 1)
+        self.emit("};", 0)
+
     def func_begin(self, name):
         ctype = get_c_type(name)
         self.emit("PyObject*", 0)
@@ -1077,7 +2887,7 @@ class ObjVisitor(PickleVisitor):
         self.emit("", 0)
 
     def visitSum(self, sum, name):
-        if is_simple(sum):
+        if self.symtab.is_simple_sum(name):
             self.simpleSum(sum, name)
             return
         self.func_begin(name)
@@ -1086,13 +2896,20 @@ class ObjVisitor(PickleVisitor):
             t = sum.types[i]
             self.visitConstructor(t, i + 1, name)
         self.emit("}", 1)
-        for a in sum.attributes:
+        self.emitAttributes(sum, name)
+        self.func_end()
+
+    def emitAttributes(self, node, name):
+        for i, a in enumerate(node.attributes):
             self.emit("value = ast2obj_%s(o->%s);" % (a.type, a.name), 1)
             self.emit("if (!value) goto failed;", 1)
+            if self.options.slot_layout:
+                self.emit("STORE_SLOT(result, %s_attribute_offsets[%d], value);"
+                          % (name, i), 1)
+                continue
             self.emit('if (_PyObject_SetAttrId(result, &PyId_%s, value) < 0)' % a.name, 1)
             self.emit('goto failed;', 2)
             self.emit('Py_DECREF(value);', 1)
-        self.func_end()
 
     def simpleSum(self, sum, name):
         self.emit("PyObject* ast2obj_%s(%s_ty o)" % (name, name), 0)
@@ -1100,6 +2917,7 @@ class ObjVisitor(PickleVisitor):
         self.emit("switch(o) {", 1)
         for t in sum.types:
             self.emit("case %s:" % t.name, 2)
+            self.emitLazyType(t.name, "return NULL;", 3)
             self.emit("Py_INCREF(%s_singleton);" % t.name, 3)
             self.emit("return %s_singleton;" % t.name, 3)
         self.emit("default:", 2)
@@ -1112,27 +2930,30 @@ class ObjVisitor(PickleVisitor):
 
     def visitProduct(self, prod, name):
         self.func_begin(name)
+        self.emitLazyType(name, "return NULL;", 1)
         self.emit("result = PyType_GenericNew(%s_type, NULL, NULL);" % name, 1);
         self.emit("if (!result) return NULL;", 1)
-        for field in prod.fields:
-            self.visitField(field, name, 1, True)
-        for a in prod.attributes:
-            self.emit("value = ast2obj_%s(o->%s);" % (a.type, a.name), 1)
-            self.emit("if (!value) goto failed;", 1)
-            self.emit('if (_PyObject_SetAttrId(result, &PyId_%s, value) < 0)' % a.name, 1)
-            self.emit('goto failed;', 2)
-            self.emit('Py_DECREF(value);', 1)
+        for i, field in enumerate(prod.fields):
+            self.visitField(field, name, 1, True, i)
+        self.emitAttributes(prod, name)
         self.func_end()
 
     def visitConstructor(self, cons, enum, name):
         self.emit("case %s_kind:" % cons.name, 1)
+        self.emitLazyType(cons.name, "goto failed;", 2)
         self.emit("result = PyType_GenericNew(%s_type, NULL, NULL);" % cons.name, 2);
         self.emit("if (!result) goto failed;", 2)
-        for f in cons.fields:
-            self.visitField(f, cons.name, 2, False)
+        for i, f in enumerate(cons.fields):
+            self.visitField(f, cons.name, 2, False, i)
         self.emit("break;", 2)
 
-    def visitField(self, field, name, depth, product):
+    def emitLazyType(self, name, error, depth):
+        if self.options.lazy_types:
+            self.emit("if (!%s_type && !lazy_type(%s_index))" % (name, name),
+                      depth)
+            self.emit(error, depth + 1)
+
+    def visitField(self, field, name, depth, product, index):
         def emit(s, d):
             self.emit(s, depth + d)
         if product:
@@ -1141,6 +2962,10 @@ class ObjVisitor(PickleVisitor):
             value = "o->v.%s.%s" % (name, field.name)
         self.set(field, value, depth)
         emit("if (!value) goto failed;", 0)
+        if self.options.slot_layout:
+            emit("STORE_SLOT(result, %s_field_offsets[%d], value);" %
+                 (name, index), 0)
+            return
         emit('if (_PyObject_SetAttrId(result, &PyId_%s, value) == -1)' % field.name, 0)
         emit("goto failed;", 1)
         emit("Py_DECREF(value);", 0)
@@ -1159,17 +2984,19 @@ class ObjVisitor(PickleVisitor):
 
     def set(self, field, value, depth):
         if field.seq:
-            # XXX should really check for is_simple, but that requires a symbol table
-            if field.type == "cmpop":
+            if self.options.int_buffers and self.symtab.is_enum_seq(field):
+                self.emit("value = ast2obj_int_array(%s);" % value, depth)
+            elif self.symtab.is_enum_seq(field):
                 # While the sequence elements are stored as void*,
-                # ast2obj_cmpop expects an enum
+                # ast2obj_<simple sum> expects an enum
                 self.emit("{", depth)
                 self.emit("Py_ssize_t i, n = asdl_seq_LEN(%s);" % value, depth+1)
                 self.emit("value = PyList_New(n);", depth+1)
                 self.emit("if (!value) goto failed;", depth+1)
                 self.emit("for(i = 0; i < n; i++)", depth+1)
                 # This cannot fail, so no need for error handling
-                self.emit("PyList_SET_ITEM(value, i, ast2obj_cmpop((cmpop_ty)asdl_seq_GET(%s, i)));" % value,
+                self.emit("PyList_SET_ITEM(value, i, ast2obj_%s((%s)asdl_seq_GET(%s, i)));" %
+                          (field.type, get_c_type(field.type), value),
                           depth+2, reflow=False)
                 self.emit("}", depth)
             else:
@@ -1179,8 +3006,415 @@ class ObjVisitor(PickleVisitor):
             self.emit("value = ast2obj_%s(%s);" % (field.type, value), depth, reflow=False)
 
 
+def field_kind(symtab, field):
+    """Return the enum field_kind constant of field, for table_driven."""
+    if field.type in asdl.builtin_types:
+        return "%s_FIELD" % field.type.upper()
+    if symtab.is_simple_sum(field.type):
+        return "ENUM_FIELD"
+    return "NODE_FIELD"
+
+
+# Descriptor tables for Options.table_driven. Each type is described by
+# node_descs[<type>_desc]: its constructors (one named after the type for
+# products), and the fields of each and the attributes of the type. Ints and
+# enums are read and written with the size of their struct member, so the
+# tables also describe the structs of Options.compact_structs.
+DESC_TABLE_CODE = """
+enum field_kind {
+    OBJECT_FIELD, IDENTIFIER_FIELD, STRING_FIELD, BYTES_FIELD,
+    SINGLETON_FIELD, INT_FIELD, ENUM_FIELD, NODE_FIELD
+};
+
+#define OPT_FIELD 1
+#define SEQ_FIELD 2
+
+typedef struct {
+    _Py_Identifier *id;
+    unsigned short offset;
+    unsigned char size;
+    unsigned char kind;
+    unsigned char flags;
+    unsigned char desc; /* index of the node_desc of enums and nodes */
+} field_desc;
+
+typedef struct {
+    const char *name;
+    PyTypeObject **type;
+    PyObject **singleton;
+    const field_desc *fields;
+    int num_fields;
+} cons_desc;
+
+typedef struct {
+    const char *name;
+    const cons_desc *cons;
+    int num_cons;
+    const field_desc *attributes;
+    int num_attributes;
+    unsigned short size; /* 0 for enums */
+    unsigned short kind_offset;
+    unsigned char kind_size; /* 0 for products and enums */
+} node_desc;
+
+#define MEMBER_SIZE(type, member) sizeof(((struct _##type *)0)->member)
+#define FIELD(type, member, id, kind, flags, desc) \\
+    {&PyId_##id, offsetof(struct _##type, member), \\
+     MEMBER_SIZE(type, member), kind, flags, desc}
+#define SUM_LAYOUT(type) \\
+    sizeof(struct _##type), offsetof(struct _##type, kind), \\
+    MEMBER_SIZE(type, kind)
+#define PRODUCT_LAYOUT(type) sizeof(struct _##type), 0, 0
+#define ENUM_LAYOUT 0, 0, 0
+
+static int
+is_int_field(const field_desc *f)
+{
+    return f->kind == INT_FIELD || f->kind == ENUM_FIELD;
+}
+
+static int
+get_int(const char *p, int size)
+{
+    switch (size) {
+    case 1: return *(const unsigned char *)p;
+    case 2: return *(const unsigned short *)p;
+    default: return *(const int *)p;
+    }
+}
+
+static void
+set_int(char *p, int size, int value)
+{
+    switch (size) {
+    case 1: *(unsigned char *)p = (unsigned char)value; break;
+    case 2: *(unsigned short *)p = (unsigned short)value; break;
+    default: *(int *)p = value;
+    }
+}
+"""
+
+AST2OBJ_TABLE_CODE = """
+static PyObject* ast2obj_node(const node_desc *d, void *o);
+
+static PyObject* ast2obj_enum(const node_desc *d, int value)
+{
+    if (value < 1 || value > d->num_cons) {
+        /* should never happen, but just in case ... */
+        PyErr_Format(PyExc_SystemError, "unknown %s found", d->name);
+        return NULL;
+    }
+    Py_INCREF(*d->cons[value - 1].singleton);
+    return *d->cons[value - 1].singleton;
+}
+
+/* Convert one value of field f: ptr for objects and nodes, value for ints
+   and enums. */
+static PyObject* ast2obj_value(const field_desc *f, void *ptr, int value)
+{
+    switch (f->kind) {
+    case INT_FIELD:
+        return ast2obj_int(value);
+    case ENUM_FIELD:
+        return ast2obj_enum(&node_descs[f->desc], value);
+    case NODE_FIELD:
+        return ast2obj_node(&node_descs[f->desc], ptr);
+    default:
+        return ast2obj_object(ptr);
+    }
+}
+
+static PyObject* ast2obj_field(const field_desc *f, const char *p)
+{
+    asdl_seq *seq;
+    Py_ssize_t i, n;
+    PyObject *result, *value;
+
+    p += f->offset;
+    if (!(f->flags & SEQ_FIELD)) {
+        if (is_int_field(f))
+            return ast2obj_value(f, NULL, get_int(p, f->size));
+        return ast2obj_value(f, *(void **)p, 0);
+    }
+    seq = *(asdl_seq **)p;
+    n = asdl_seq_LEN(seq);
+    result = PyList_New(n);
+    if (!result)
+        return NULL;
+    for (i = 0; i < n; i++) {
+        if (is_int_field(f))
+            value = ast2obj_value(f, NULL, ((asdl_int_seq *)seq)->elements[i]);
+        else
+            value = ast2obj_value(f, asdl_seq_GET(seq, i), 0);
+        if (!value) {
+            Py_DECREF(result);
+            return NULL;
+        }
+        PyList_SET_ITEM(result, i, value);
+    }
+    return result;
+}
+
+static int ast2obj_fields(PyObject *result, const field_desc *f, int n,
+                          const char *p)
+{
+    PyObject *value;
+    int res;
+    for (; n > 0; n--, f++) {
+        value = ast2obj_field(f, p);
+        if (!value)
+            return -1;
+        res = _PyObject_SetAttrId(result, f->id, value);
+        Py_DECREF(value);
+        if (res == -1)
+            return -1;
+    }
+    return 0;
+}
+
+static PyObject* ast2obj_node(const node_desc *d, void *o)
+{
+    const cons_desc *c = d->cons;
+    PyObject *result;
+
+    if (!o) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    if (d->kind_size)
+        c += get_int((char *)o + d->kind_offset, d->kind_size) - 1;
+    result = PyType_GenericNew(*c->type, NULL, NULL);
+    if (!result)
+        return NULL;
+    if (ast2obj_fields(result, c->fields, c->num_fields, o) < 0 ||
+        ast2obj_fields(result, d->attributes, d->num_attributes, o) < 0) {
+        Py_DECREF(result);
+        return NULL;
+    }
+    return result;
+}
+"""
+
+OBJ2AST_TABLE_CODE = """
+static int obj2ast_node(const node_desc *d, PyObject *obj, void *out,
+                        PyArena *arena);
+
+static int obj2ast_enum(const node_desc *d, PyObject *obj, int *out)
+{
+    int i, isinstance;
+    for (i = 0; i < d->num_cons; i++) {
+        isinstance = PyObject_IsInstance(obj, (PyObject *)*d->cons[i].type);
+        if (isinstance == -1) {
+            return 1;
+        }
+        if (isinstance) {
+            *out = i + 1;
+            return 0;
+        }
+    }
+    PyErr_Format(PyExc_TypeError, "expected some sort of %s, but got %R",
+                 d->name, obj);
+    return 1;
+}
+
+/* Convert obj to one value of field f. out points to an int for ints and
+   enums, and to a pointer otherwise. */
+static int obj2ast_value(const field_desc *f, PyObject *obj, void *out,
+                         PyArena *arena)
+{
+    switch (f->kind) {
+    case OBJECT_FIELD:
+        return obj2ast_object(obj, (PyObject **)out, arena);
+    case IDENTIFIER_FIELD:
+        return obj2ast_identifier(obj, (PyObject **)out, arena);
+    case STRING_FIELD:
+        return obj2ast_string(obj, (PyObject **)out, arena);
+    case BYTES_FIELD:
+        return obj2ast_bytes(obj, (PyObject **)out, arena);
+    case SINGLETON_FIELD:
+        return obj2ast_singleton(obj, (PyObject **)out, arena);
+    case INT_FIELD:
+        return obj2ast_int(obj, (int *)out, arena);
+    case ENUM_FIELD:
+        return obj2ast_enum(&node_descs[f->desc], obj, (int *)out);
+    default:
+        return obj2ast_node(&node_descs[f->desc], obj, out, arena);
+    }
+}
+
+static int obj2ast_seq(const field_desc *f, const char *name, PyObject *tmp,
+                       char *p, PyArena *arena)
+{
+    Py_ssize_t i, len;
+    int res;
+
+    if (!PyList_Check(tmp)) {
+        PyErr_Format(PyExc_TypeError, "%s field \\"%s\\" must be a list, not "
+                     "a %.200s", name, f->id->string, tmp->ob_type->tp_name);
+        return 1;
+    }
+    len = PyList_GET_SIZE(tmp);
+    if (is_int_field(f)) {
+        asdl_int_seq *seq = _Py_asdl_int_seq_new(len, arena);
+        if (seq == NULL)
+            return 1;
+        *(asdl_int_seq **)p = seq;
+        for (i = 0; i < len; i++) {
+            res = obj2ast_value(f, PyList_GET_ITEM(tmp, i), &seq->elements[i],
+                                arena);
+            if (res != 0)
+                return res;
+        }
+    }
+    else {
+        asdl_seq *seq = _Py_asdl_seq_new(len, arena);
+        if (seq == NULL)
+            return 1;
+        *(asdl_seq **)p = seq;
+        for (i = 0; i < len; i++) {
+            res = obj2ast_value(f, PyList_GET_ITEM(tmp, i), &seq->elements[i],
+                                arena);
+            if (res != 0)
+                return res;
+        }
+    }
+    return 0;
+}
+
+/* Convert field f of obj into the struct at p. name is the constructor or
+   product the field belongs to, for error messages. */
+static int obj2ast_field(const field_desc *f, const char *name, PyObject *obj,
+                         char *p, PyArena *arena)
+{
+    PyObject *tmp;
+    int res, value;
+
+    if (f->flags & OPT_FIELD ? !exists_not_none(obj, f->id)
+                             : !_PyObject_HasAttrId(obj, f->id)) {
+        if (f->flags & OPT_FIELD)
+            return 0; /* the struct is zeroed */
+        PyErr_Format(PyExc_TypeError, "required field \\"%s\\" missing from %s",
+                     f->id->string, name);
+        return 1;
+    }
+    tmp = _PyObject_GetAttrId(obj, f->id);
+    if (tmp == NULL)
+        return 1;
+    p += f->offset;
+    if (f->flags & SEQ_FIELD)
+        res = obj2ast_seq(f, name, tmp, p, arena);
+    else if (is_int_field(f)) {
+        res = obj2ast_value(f, tmp, &value, arena);
+        if (res == 0)
+            set_int(p, f->size, value);
+    }
+    else
+        res = obj2ast_value(f, tmp, p, arena);
+    Py_DECREF(tmp);
+    return res;
+}
+
+/* Check the fields the constructor functions require to be set. */
+static int check_required(const cons_desc *c, const char *p)
+{
+    const field_desc *f;
+    int missing;
+    for (f = c->fields; f < c->fields + c->num_fields; f++) {
+        if (f->flags || f->kind == INT_FIELD)
+            continue;
+        if (f->kind == ENUM_FIELD)
+            missing = !get_int(p + f->offset, f->size);
+        else
+            missing = !*(void **)(p + f->offset);
+        if (missing) {
+            PyErr_Format(PyExc_ValueError, "field %s is required for %s",
+                         f->id->string, c->name);
+            return 1;
+        }
+    }
+    return 0;
+}
+
+static int obj2ast_node(const node_desc *d, PyObject *obj, void *out,
+                        PyArena *arena)
+{
+    const cons_desc *c = d->cons;
+    char *p;
+    int i, isinstance;
+
+    if (d->kind_size && obj == Py_None) {
+        *(void **)out = NULL;
+        return 0;
+    }
+    p = (char *)PyArena_Malloc(arena, d->size);
+    if (!p)
+        return 1;
+    memset(p, 0, d->size);
+    if (d->kind_size) {
+        for (i = 0; i < d->num_attributes; i++) {
+            if (obj2ast_field(&d->attributes[i], d->name, obj, p, arena))
+                return 1;
+        }
+        for (;; c++) {
+            if (c == d->cons + d->num_cons) {
+                PyErr_Format(PyExc_TypeError,
+                             "expected some sort of %s, but got %R",
+                             d->name, obj);
+                return 1;
+            }
+            isinstance = PyObject_IsInstance(obj, (PyObject *)*c->type);
+            if (isinstance == -1)
+                return 1;
+            if (isinstance)
+                break;
+        }
+        set_int(p + d->kind_offset, d->kind_size, (int)(c - d->cons) + 1);
+    }
+    for (i = 0; i < c->num_fields; i++) {
+        if (obj2ast_field(&c->fields[i], c->name, obj, p, arena))
+            return 1;
+    }
+    if (check_required(c, p))
+        return 1;
+    *(void **)out = p;
+    return 0;
+}
+"""
+
+
 class PartingShots(StaticVisitor):
 
+    def visit(self, object):
+        code = self.CODE
+        if self.options.lazy_types:
+            code = code.replace(self.REQ_TYPES, self.LAZY_REQ_TYPES)
+        if self.options.table_driven:
+            code = code.replace("ast2obj_mod(t)",
+                                "ast2obj_node(&node_descs[mod_desc], t)")
+            code = code.replace("obj2ast_mod(ast, &res, arena)",
+                                "obj2ast_node(&node_descs[mod_desc], ast, "
+                                "&res, arena)")
+        if self.options.marshal:
+            root = str(object.dfns[0].name)
+            code += MARSHAL_ENTRY_CODE % {"root": root,
+                                          "ctype": get_c_type(root)}
+        self.emit(code, 0, reflow=False)
+        self.flush()
+
+    REQ_TYPES = """
+    req_type[0] = (PyObject*)Module_type;
+    req_type[1] = (PyObject*)Expression_type;
+    req_type[2] = (PyObject*)Interactive_type;
+"""
+
+    LAZY_REQ_TYPES = """
+    req_type[0] = (PyObject*)lazy_type(Module_index);
+    req_type[1] = (PyObject*)lazy_type(Expression_index);
+    req_type[2] = (PyObject*)lazy_type(Interactive_index);
+    if (!req_type[0] || !req_type[1] || !req_type[2])
+        return NULL;
+"""
+
     CODE = """
 PyObject* PyAST_mod2obj(mod_ty t)
 {
@@ -1233,60 +3467,265 @@ class ChainOfVisitors:
         self.visitors = visitors
 
     def visit(self, object):
+        profile = asdl.VisitorProfile.active
         for v in self.visitors:
+            if profile is not None:
+                start = profile.clock()
             v.visit(object)
             v.emit("", 0)
+            v.flush()
+            if profile is not None:
+                profile.add_run(v, profile.clock() - start)
+
+class ParallelChainOfVisitors:
+    """Like ChainOfVisitors, but each visitor runs in a worker process.
+
+    Visitors are given as classes. Each one renders into its own buffer in a
+    worker of executor (a concurrent.futures executor); the buffers are then
+    written to file in the original order, so the output is identical to that
+    of ChainOfVisitors.
+    """
+    def __init__(self, executor, file, *visitor_classes, options=None):
+        self.executor = executor
+        self.file = file
+        self.visitor_classes = visitor_classes
+        self.options = options
+
+    def visit(self, object):
+        futures = [self.executor.submit(render_visitor, cls, object,
+                                        self.options)
+                   for cls in self.visitor_classes]
+        for future in futures:
+            self.file.write(future.result())
+
+def render_visitor(visitor_class, object, options=None):
+    """Run a visitor of the given class on object and return its output."""
+    f = io.StringIO()
+    ChainOfVisitors(visitor_class(f, options)).visit(object)
+    return f.getvalue()
+
+def make_chain(f, visitor_classes, executor=None, options=None):
+    if executor is None:
+        return ChainOfVisitors(*[cls(f, options) for cls in visitor_classes])
+    return ParallelChainOfVisitors(executor, f, *visitor_classes,
+                                   options=options)
+
+HEADER_VISITORS = (
+    TypeDefVisitor,
+    StructVisitor,
+    PrototypeVisitor,
+    )
+
+SOURCE_VISITORS = (
+    PyTypesDeclareVisitor,
+    PyTypesVisitor,
+    Obj2ModPrototypeVisitor,
+    FunctionVisitor,
+    ObjVisitor,
+    Obj2ModVisitor,
+    ASTModuleVisitor,
+    PartingShots,
+    )
+
+# The marshal functions are declared after the obj2ast prototypes, which
+# MARSHAL_CODE uses, and defined after all the conversion functions.
+MARSHAL_SOURCE_VISITORS = (
+    SOURCE_VISITORS[:3] + (MarshalPrototypeVisitor,) + SOURCE_VISITORS[3:-1]
+    + (MarshalVisitor,) + SOURCE_VISITORS[-1:])
+
+def source_visitors(options):
+    """Return the visitor classes generating the source for options."""
+    if options and options.marshal:
+        return MARSHAL_SOURCE_VISITORS
+    return SOURCE_VISITORS
 
 common_msg = "/* File automatically generated by %s. */\n\n"
 
-def main(srcfile, dump_module=False):
+def main(srcfile, dump_module=False, cache_dir=None, workers=1, options=None,
+         profile=False):
     argv0 = sys.argv[0]
     components = argv0.split(os.sep)
     argv0 = os.sep.join(components[-2:])
     auto_gen_msg = common_msg % argv0
-    mod = asdl.parse(srcfile)
-    if dump_module:
-        print('Parsed Module:')
-        print(mod)
-    if not asdl.check(mod):
-        sys.exit(1)
+    if cache_dir:
+        mod = asdl.parse_cached(srcfile, cache_dir)
+        if mod is None:
+            sys.exit(1)
+        if dump_module:
+            print('Parsed Module:')
+            print(mod)
+    else:
+        mod = asdl.parse(srcfile)
+        if dump_module:
+            print('Parsed Module:')
+            print(mod)
+        if not asdl.check(mod):
+            sys.exit(1)
+    jobs = []
     if INC_DIR:
         p = "%s/%s-ast.h" % (INC_DIR, mod.name)
-        f = open(p, "w")
-        f.write(auto_gen_msg)
-        f.write('#include "asdl.h"\n\n')
-        c = ChainOfVisitors(TypeDefVisitor(f),
-                            StructVisitor(f),
-                            PrototypeVisitor(f),
-                            )
-        c.visit(mod)
-        f.write("PyObject* PyAST_mod2obj(mod_ty t);\n")
-        f.write("mod_ty PyAST_obj2mod(PyObject* ast, PyArena* arena, int mode);\n")
-        f.write("int PyAST_Check(PyObject* obj);\n")
-        f.close()
-
+        jobs.append((write_header, p))
     if SRC_DIR:
         p = os.path.join(SRC_DIR, str(mod.name) + "-ast.c")
-        f = open(p, "w")
-        f.write(auto_gen_msg)
-        f.write('#include <stddef.h>\n')
-        f.write('\n')
-        f.write('#include "Python.h"\n')
-        f.write('#include "%s-ast.h"\n' % mod.name)
-        f.write('\n')
-        f.write("static PyTypeObject AST_type;\n")
-        v = ChainOfVisitors(
-            PyTypesDeclareVisitor(f),
-            PyTypesVisitor(f),
-            Obj2ModPrototypeVisitor(f),
-            FunctionVisitor(f),
-            ObjVisitor(f),
-            Obj2ModVisitor(f),
-            ASTModuleVisitor(f),
-            PartingShots(f),
-            )
-        v.visit(mod)
-        f.close()
+        jobs.append((write_source, p))
+    visitor_profile = asdl.VisitorProfile() if profile else None
+    if not jobs:
+        updated = []
+    elif profile:
+        # Visitors are profiled in this process, so run the chains here.
+        with visitor_profile:
+            updated = [write(mod, p, auto_gen_msg, options=options)
+                       for write, p in jobs]
+    elif workers > 1:
+        # Every visitor renders in a worker process. The chains are driven
+        # from threads so that the visitors of both files are queued at once.
+        threads = min(workers, len(jobs))
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor, \
+             concurrent.futures.ThreadPoolExecutor(threads) as threads:
+            futures = [threads.submit(write, mod, p, auto_gen_msg, executor,
+                                      options)
+                       for write, p in jobs]
+            updated = [future.result() for future in futures]
+    elif len(jobs) > 1:
+        # The header and source chains share nothing but the (read-only)
+        # module, so they can be generated concurrently.
+        with concurrent.futures.ProcessPoolExecutor(len(jobs)) as executor:
+            futures = [executor.submit(write, mod, p, auto_gen_msg,
+                                       options=options)
+                       for write, p in jobs]
+            updated = [future.result() for future in futures]
+    else:
+        updated = [write(mod, p, auto_gen_msg, options=options)
+                   for write, p in jobs]
+    for (write, p), was_updated in zip(jobs, updated):
+        if was_updated:
+            print('Updated %s' % p)
+        else:
+            print('Unchanged %s' % p)
+    if options and options.compact_structs and INC_DIR:
+        print_struct_sizes(mod)
+    if profile:
+        print_profile(visitor_profile)
+
+def print_profile(profile, limit=10):
+    """Print the visitors of the chains run under profile, slowest first.
+
+    Each visitor comes with the characters it emitted and its limit visit*
+    methods with the most self time.
+    """
+    print("Visitor profile:")
+    for v, seconds in sorted(profile.runs, key=lambda run: -run[1]):
+        name = v.__class__.__name__
+        print("  %-28s %10.1f ms %10d chars" %
+              (name, seconds * 1000, getattr(v, "emitted", 0)))
+        methods = [(key[1], stats) for key, stats in profile.methods.items()
+                   if key[0] == name]
+        methods.sort(key=lambda item: -item[1][2])
+        for methname, (calls, cumulative, own) in methods[:limit]:
+            print("    %-26s %8d calls %10.1f ms %10.1f ms self" %
+                  (methname, calls, cumulative * 1000, own * 1000))
+
+def print_struct_sizes(mod):
+    """Print the bytes saved by the compact layout of each struct."""
+    print("Compact struct layout (LP64):")
+    total = 0
+    for name, size, compact_size in struct_sizes(mod):
+        print("  %-16s %4d -> %4d bytes, %d saved" %
+              (name, size, compact_size, size - compact_size))
+        total += size - compact_size
+    print("  %d bytes saved in total" % total)
+
+def write_header(mod, p, auto_gen_msg, executor=None, options=None):
+    f = io.StringIO()
+    f.write(auto_gen_msg)
+    f.write('#include "asdl.h"\n\n')
+    c = make_chain(f, HEADER_VISITORS, executor, options)
+    c.visit(mod)
+    f.write("PyObject* PyAST_mod2obj(mod_ty t);\n")
+    f.write("mod_ty PyAST_obj2mod(PyObject* ast, PyArena* arena, int mode);\n")
+    f.write("int PyAST_Check(PyObject* obj);\n")
+    if options and options.slab_alloc:
+        f.write("void _PyAST_SlabStats(Py_ssize_t *nodes, Py_ssize_t *blocks);\n")
+    if options and options.marshal:
+        f.write(marshal_prototypes(mod))
+    return update_file(p, f.getvalue())
+
+def write_source(mod, p, auto_gen_msg, executor=None, options=None):
+    f = io.StringIO()
+    f.write(auto_gen_msg)
+    f.write('#include <stddef.h>\n')
+    f.write('\n')
+    f.write('#include "Python.h"\n')
+    if options and options.slot_layout:
+        f.write('#include "structmember.h"\n')
+    f.write('#include "%s-ast.h"\n' % mod.name)
+    f.write('\n')
+    f.write("static PyTypeObject AST_type;\n")
+    v = make_chain(f, source_visitors(options), executor, options)
+    v.visit(mod)
+    return update_file(p, f.getvalue())
+
+def update_file(p, text):
+    """Write text to the file p, unless p already has exactly that content.
+
+    The text is encoded the way open(p, "w") would encode it. A changed file
+    is replaced by atomic rename, so an unchanged output keeps its mtime and
+    readers never see a partially written file. Return True if p was written.
+    """
+    data = text.replace("\n", os.linesep).encode(
+        locale.getpreferredencoding(False))
+    if same_contents(p, data):
+        return False
+    dirname, basename = os.path.split(p)
+    fd, tmp = create_temp_file(dirname or ".", basename)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            os.chmod(tmp, os.stat(p).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp, p)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return True
+
+def create_temp_file(dirname, basename):
+    """Create a new hidden file for basename in dirname; return (fd, path).
+
+    Unlike tempfile.mkstemp, which always uses mode 0o600, the file gets the
+    mode open(p, "w") would give a new file: 0o666 less the umask.
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    while True:
+        tmp = os.path.join(dirname, ".%s.%s.tmp" % (basename,
+                                                    uuid.uuid4().hex[:12]))
+        try:
+            return os.open(tmp, flags, 0o666), tmp
+        except FileExistsError:
+            continue
+
+def same_contents(p, data, chunk_size=1 << 16):
+    """Return True if the file p holds exactly the bytes data.
+
+    The file is compared chunk by chunk and the comparison stops at the first
+    difference.
+    """
+    try:
+        f = open(p, "rb")
+    except FileNotFoundError:
+        return False
+    with f:
+        if os.fstat(f.fileno()).st_size != len(data):
+            return False
+        view = memoryview(data)
+        pos = 0
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            if view[pos:pos + len(chunk)] != chunk:
+                return False
+            pos += len(chunk)
+        return pos == len(data)
 
 if __name__ == "__main__":
     import sys
@@ -1295,7 +3734,20 @@ if __name__ == "__main__":
     INC_DIR = ''
     SRC_DIR = ''
     dump_module = False
-    opts, args = getopt.getopt(sys.argv[1:], "dh:c:")
+    cache_dir = None
+    workers = 1
+    profile = False
+    options = {}
+    # Every code generation option is a --flag with dashes for underscores.
+    option_flags = {"--" + name.replace("_", "-"): name
+                    for name in Options.names()}
+    long_opts = (["cache-dir=", "profile"] +
+                 [flag[2:] for flag in option_flags])
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "dh:c:j:", long_opts)
+    except getopt.GetoptError as e:
+        print(e)
+        sys.exit(1)
     for o, v in opts:
         if o == '-h':
             INC_DIR = v
@@ -1303,10 +3755,23 @@ if __name__ == "__main__":
             SRC_DIR = v
         if o == '-d':
             dump_module = True
-    if INC_DIR and SRC_DIR:
-        print('Must specify exactly one output file')
-        sys.exit(1)
-    elif len(args) != 1:
+        if o == '--cache-dir':
+            cache_dir = v
+        if o == '-j':
+            workers = int(v) if v.isdigit() else 0
+            if workers < 1:
+                print('-j expects a positive number of workers, not %r' % v)
+                sys.exit(1)
+        if o == '--profile':
+            profile = True
+        if o in option_flags:
+            options[option_flags[o]] = True
+    if len(args) != 1:
         print('Must specify single input file')
         sys.exit(1)
-    main(args[0], dump_module)
+    try:
+        options = Options(**options)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    main(args[0], dump_module, cache_dir, workers, options, profile)
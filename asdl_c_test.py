@@ -0,0 +1,638 @@
+# Simple testing / sanity-checking for asdl_c.py
+# Assumes some things about the current Python.asdl, which is used as input.
+
+import array, contextlib, copy, io, os, random, subprocess, sys, tempfile, unittest
+import asdl, asdl_c, asdl_harness, asdl_py
+
+
+class TestReflowLines(unittest.TestCase):
+    def test_fits(self):
+        line = 'static char *xxxxxxxxxx'
+        self.assertEqual(asdl_c.reflow_lines(line, 1), [line])
+
+    def test_paren(self):
+        self.assertEqual(
+            asdl_c.reflow_lines('PyErr_SetString(PyExc_ValueError, "field body '
+                                'is required for FunctionDef and some more '
+                                'words here");', 2),
+            ['PyErr_SetString(PyExc_ValueError, "field body is required for',
+             '                FunctionDef and some more words here");'])
+
+    def test_brace(self):
+        self.assertEqual(
+            asdl_c.reflow_lines('typedef enum _operator { Add=1, Sub=2, '
+                                'Mult=3, MatMult=4, Div=5, Mod=6, Pow=7, '
+                                'LShift=8, RShift=9, BitOr=10, BitXor=11, '
+                                'BitAnd=12, FloorDiv=13 } operator_ty;', 0),
+            ['typedef enum _operator { Add=1, Sub=2, Mult=3, MatMult=4, '
+             'Div=5, Mod=6, Pow=7,',
+             '                         LShift=8, RShift=9, BitOr=10, '
+             'BitXor=11, BitAnd=12,',
+             '                         FloorDiv=13 } operator_ty;'])
+
+    def test_generator_exp(self):
+        x = 'x' * 42
+        self.assertEqual(
+            asdl_c.reflow_lines('*out = GeneratorExp(elt,generators,lineno,'
+                                'col_offset,arena,%s);' % x, 3),
+            ['*out =',
+             'GeneratorExp(elt,generators,lineno,col_offset,arena,' + x[:19],
+             x[20:] + ');'])
+
+    def test_result_is_fresh_list(self):
+        # Reflowed lines are memoized; callers still get their own list.
+        line = 'f(' + ', '.join(['argument'] * 20) + ');'
+        lines = asdl_c.reflow_lines(line, 0)
+        lines.append('')
+        self.assertNotEqual(asdl_c.reflow_lines(line, 0), lines)
+
+
+class TestSymbolTable(unittest.TestCase):
+    def test_python_asdl(self):
+        symtab = asdl_c.SymbolTable(asdl.parse('./Python.asdl'))
+        self.assertEqual(symtab.simple_sums, {'expr_context', 'boolop',
+                                              'operator', 'unaryop', 'cmpop'})
+        self.assertIn('expr', symtab.complex_sums)
+        self.assertIn('arguments', symtab.products)
+        self.assertEqual(symtab.node_types[:3], ['mod', 'stmt', 'expr'])
+        self.assertNotIn('operator', symtab.node_types)
+
+    def test_enum_seq(self):
+        mod = asdl.ASDLParser().parse("""
+            module M {
+                color = Red | Green
+                shape = Dot(color* colors, shape* parts)
+            }""")
+        symtab = asdl_c.get_symbol_table(mod)
+        colors, parts = mod.types['shape'].types[0].fields
+        self.assertTrue(symtab.is_enum_seq(colors))
+        self.assertFalse(symtab.is_enum_seq(parts))
+
+        header = asdl_c.render_visitor(asdl_c.StructVisitor, mod)
+        self.assertIn('asdl_int_seq *colors;', header)
+        self.assertIn('asdl_seq *parts;', header)
+        source = asdl_c.render_visitor(asdl_c.ObjVisitor, mod)
+        self.assertIn('ast2obj_color((color_ty)asdl_seq_GET(', source)
+        source = asdl_c.render_visitor(asdl_c.Obj2ModVisitor, mod)
+        self.assertIn('colors = _Py_asdl_int_seq_new(len, arena);', source)
+
+
+class TestOptions(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mod = asdl.parse('./Python.asdl')
+
+    def render(self, visitor_class, **options):
+        return asdl_c.render_visitor(visitor_class, self.mod,
+                                     asdl_c.Options(**options))
+
+    def test_unknown_option(self):
+        with self.assertRaises(TypeError):
+            asdl_c.Options(no_such_option=True)
+
+    def test_fast_dispatch(self):
+        default = self.render(asdl_c.Obj2ModVisitor)
+        self.assertIn('PyObject_IsInstance(obj, (PyObject*)BinOp_type)',
+                      default)
+        self.assertNotIn('lookup_kind', default)
+
+        code = self.render(asdl_c.Obj2ModVisitor, fast_dispatch=True)
+        self.assertNotIn('PyObject_IsInstance', code)
+        self.assertIn('kind = lookup_kind(expr_dispatch, expr_kind_types, obj);',
+                      code)
+        self.assertIn('case BinOp_kind: {', code)
+        self.assertIn('*out = (operator_ty)kind;', code)
+        code = self.render(asdl_c.PyTypesVisitor, fast_dispatch=True)
+        self.assertIn('expr_dispatch = make_dispatch(expr_kind_types);', code)
+
+    def test_single_lookup(self):
+        default = self.render(asdl_c.Obj2ModVisitor)
+        self.assertIn('if (exists_not_none(obj, &PyId_annotation)) {', default)
+
+        code = self.render(asdl_c.Obj2ModVisitor, single_lookup=True)
+        self.assertNotIn('_PyObject_HasAttrId', code)
+        self.assertNotIn('exists_not_none', code)
+        self.assertEqual(code.count('lookup_attr(obj, &PyId_annotation)'),
+                         default.count('&PyId_annotation)) {'))
+        # Error messages for missing fields are the same.
+        self.assertIn('"required field \\"arg\\" missing from arg"', code)
+        self.assertIn('"required field \\"arg\\" missing from arg"', default)
+
+    def test_slot_layout(self):
+        default = self.render(asdl_c.ObjVisitor)
+        self.assertIn('_PyObject_SetAttrId(result, &PyId_left, value)', default)
+
+        code = self.render(asdl_c.ObjVisitor, slot_layout=True)
+        self.assertNotIn('_PyObject_SetAttrId', code)
+        self.assertIn('STORE_SLOT(result, BinOp_field_offsets[0], value);', code)
+        self.assertIn('STORE_SLOT(result, expr_attribute_offsets[1], value);',
+                      code)
+        code = self.render(asdl_c.PyTypesVisitor, slot_layout=True)
+        self.assertIn('BinOp_type = make_slots_type("BinOp", expr_type, '
+                      'BinOp_fields, 3, NULL, 0);', code)
+        self.assertIn('slot_offsets(expr_type, expr_attributes, 2, '
+                      'expr_attribute_offsets)', code)
+        code = self.render(asdl_c.PyTypesDeclareVisitor, slot_layout=True)
+        self.assertIn('static Py_ssize_t BinOp_field_offsets[3];', code)
+
+    def test_slab_alloc(self):
+        default = self.render(asdl_c.FunctionVisitor)
+        self.assertNotIn('slab', default)
+
+        code = self.render(asdl_c.FunctionVisitor, slab_alloc=True)
+        self.assertNotIn('PyArena_Malloc(arena, sizeof(*p))', code)
+        self.assertIn('p = (expr_ty)slab_alloc(&ast_slabs[2], sizeof(*p), '
+                      'arena);', code)
+        self.assertIn('return slab_reserve(&ast_slabs[2], sizeof(struct _expr), '
+                      'n, arena);', code)
+        code = self.render(asdl_c.PrototypeVisitor, slab_alloc=True)
+        self.assertIn('int _Py_keyword_reserve(Py_ssize_t n, PyArena *arena);',
+                      code)
+        self.assertNotIn('_Py_operator_reserve', code)
+        code = self.render(asdl_c.Obj2ModVisitor, slab_alloc=True)
+        self.assertIn('if (_Py_keyword_reserve(len, arena) < 0) goto failed;',
+                      code)
+        self.assertNotIn('_Py_identifier_reserve', code)
+
+    def test_compact_structs(self):
+        mod = asdl.ASDLParser().parse("""
+            module M {
+                node = Leaf(color c, int depth, color d, node? next)
+                     | Pair(node left, node right)
+                     attributes (int lineno)
+                color = Red | Green
+            }""")
+        options = asdl_c.Options(compact_structs=True)
+        header = asdl_c.render_visitor(asdl_c.StructVisitor, mod, options)
+        self.assertIn('struct {\n'
+                      '            node_ty next;\n'
+                      '            int depth;\n'
+                      '            unsigned char c;\n'
+                      '            unsigned char d;\n'
+                      '        } Leaf;', header)
+        self.assertIn('    int lineno;\n    unsigned char kind;\n};', header)
+        self.assertEqual(asdl_c.struct_sizes(mod), [('node', 40, 24)])
+        # The constructor functions keep the declaration order.
+        header = asdl_c.render_visitor(asdl_c.PrototypeVisitor, mod, options)
+        self.assertIn('node_ty _Py_Leaf(color_ty c, int depth, color_ty d, '
+                      'node_ty next, int lineno,', header)
+
+    def test_compact_structs_python_asdl(self):
+        # Python.asdl has no padding to remove; the layout model agrees with
+        # the structs a C compiler lays out on LP64 platforms.
+        self.assertIn(('expr', 56, 56), asdl_c.struct_sizes(self.mod))
+        self.assertIn(('stmt', 72, 72), asdl_c.struct_sizes(self.mod))
+
+    def test_int_buffers(self):
+        code = self.render(asdl_c.ObjVisitor, int_buffers=True)
+        self.assertIn('value = ast2obj_int_array(o->v.Compare.ops);', code)
+        self.assertNotIn('ast2obj_cmpop((cmpop_ty)', code)
+        code = self.render(asdl_c.Obj2ModVisitor, int_buffers=True)
+        self.assertIn('if (PyObject_CheckBuffer(tmp)) {\n'
+                      '                res = obj2ast_int_buffer(tmp, &ops, 10, '
+                      '"cmpop", arena);', code)
+        # Lists are still accepted.
+        self.assertIn('ops = _Py_asdl_int_seq_new(len, arena);', code)
+
+    def test_singleton_identity(self):
+        code = self.render(asdl_c.Obj2ModVisitor, singleton_identity=True)
+        self.assertIn('if (obj == Load_singleton) {\n'
+                      '        *out = Load;\n'
+                      '        return 0;\n', code)
+        # Other instances still go through isinstance.
+        self.assertIn('PyObject_IsInstance(obj, (PyObject *)Load_type)', code)
+        code = self.render(asdl_c.Obj2ModVisitor, singleton_identity=True,
+                           fast_dispatch=True)
+        self.assertLess(code.index('obj == NotIn_singleton'),
+                        code.index('lookup_kind(cmpop_dispatch'))
+
+    def test_lazy_types(self):
+        default = self.render(asdl_c.PyTypesVisitor)
+        self.assertIn('BinOp_type = make_type("BinOp", expr_type, BinOp_fields, '
+                      '3);', default)
+
+        code = self.render(asdl_c.PyTypesVisitor, lazy_types=True)
+        self.assertNotIn('BinOp_type = make_type(', code)
+        self.assertIn('enum type_index {', code)
+        self.assertIn('static type_desc type_descs[] = {', code)
+        code = self.render(asdl_c.ObjVisitor, lazy_types=True)
+        self.assertIn('if (!BinOp_type && !lazy_type(BinOp_index))', code)
+        code = self.render(asdl_c.ASTModuleVisitor, lazy_types=True)
+        self.assertIn('if (add_all(d) < 0) return NULL;', code)
+        self.assertNotIn('"BinOp", (PyObject*)BinOp_type', code)
+
+    def test_table_driven(self):
+        code = self.render(asdl_c.ObjVisitor, table_driven=True)
+        self.assertNotIn('ast2obj_expr(', code)
+        self.assertIn('FIELD(expr, v.BinOp.op, op, ENUM_FIELD, 0, '
+                      'operator_desc),', code)
+        self.assertIn('FIELD(arg, annotation, annotation, NODE_FIELD, '
+                      'OPT_FIELD, expr_desc),', code)
+        self.assertIn('{"Load", &Load_type, &Load_singleton, NULL, 0},', code)
+        self.assertIn('{"arguments", arguments_cons, 1, NULL, 0, '
+                      'PRODUCT_LAYOUT(arguments)},', code)
+        code = self.render(asdl_c.Obj2ModVisitor, table_driven=True)
+        self.assertNotIn('obj2ast_expr(', code)
+        code = self.render(asdl_c.PartingShots, table_driven=True)
+        self.assertIn('obj2ast_node(&node_descs[mod_desc], ast, &res, arena)',
+                      code)
+        with self.assertRaises(ValueError):
+            asdl_c.Options(table_driven=True, fast_dispatch=True)
+
+    def test_marshal(self):
+        code = self.render(asdl_c.MarshalVisitor, marshal=True)
+        self.assertIn('if (marshal_write_operator(w, o->v.BinOp.op) < 0)', code)
+        self.assertIn('*out = BinOp(left, op, right, lineno, col_offset, arena);',
+                      code)
+        self.assertIn('if (marshal_read_opt_int(r, &level, arena) < 0)', code)
+        self.assertIn('(*out)->lineno = lineno;', code)
+        code = self.render(asdl_c.PartingShots, marshal=True)
+        self.assertIn('PyObject* PyAST_mod2bytes(mod_ty t)', code)
+        self.assertNotIn('PyAST_mod2bytes', self.render(asdl_c.PartingShots))
+        self.assertIn(asdl_c.MarshalVisitor,
+                      asdl_c.source_visitors(asdl_c.Options(marshal=True)))
+        self.assertNotIn(asdl_c.MarshalVisitor,
+                         asdl_c.source_visitors(asdl_c.Options()))
+
+
+class TestCompiled(unittest.TestCase):
+    """Compile the generated code with each option and convert trees with
+    it, through asdl_harness."""
+
+    @classmethod
+    def setUpClass(cls):
+        reason = asdl_harness.unavailable_reason()
+        if reason is not None:
+            raise unittest.SkipTest(reason)
+        cls.mod = asdl_harness.python_asdl()
+
+    def dump(self, tree):
+        return asdl_harness.dump(self.mod, tree)
+
+    def check_roundtrip(self, **options):
+        """Convert random trees both ways with code generated with options;
+        return the harness and _ast modules."""
+        h = asdl_harness.get_build('-O0', **options)
+        ast = h.module()
+        for seed in range(50):
+            rnd = random.Random(seed)
+            tree = ast.Module([asdl_harness.random_tree(self.mod, ast, rnd,
+                                                        'stmt')
+                               for _ in range(3)])
+            self.assertEqual(self.dump(h.roundtrip(tree, asdl_harness.MODULE)),
+                             self.dump(tree))
+        tree = asdl_harness.sample_module(ast, 3)
+        self.assertEqual(self.dump(h.roundtrip(tree, asdl_harness.MODULE)),
+                         self.dump(tree))
+        del tree.body[0].test.ctx
+        with self.assertRaisesRegex(TypeError,
+                                    'required field "ctx" missing from Name'):
+            h.roundtrip(tree, asdl_harness.MODULE)
+        with self.assertRaisesRegex(TypeError, 'expected some sort of expr'):
+            h.roundtrip(ast.Expression(ast.Pass(lineno=1, col_offset=0)),
+                        asdl_harness.EXPRESSION)
+        return h, ast
+
+    def test_default(self):
+        self.check_roundtrip()
+
+    def test_fast_dispatch(self):
+        h, ast = self.check_roundtrip(fast_dispatch=True)
+        # Instances of subclasses fall back to isinstance checks
+        class MyName(ast.Name):
+            pass
+        tree = ast.Expression(MyName('x', ast.Load(), lineno=1, col_offset=0))
+        result = h.roundtrip(tree, asdl_harness.EXPRESSION)
+        self.assertIs(result.body.__class__, ast.Name)
+
+    def test_single_lookup(self):
+        h, ast = self.check_roundtrip(single_lookup=True)
+        # Fields defined on the type are read with getattr, and a missing
+        # optional field is None.
+        class Named(ast.Name):
+            id = property(lambda self: 'p')
+        name = Named()
+        name.ctx, name.lineno, name.col_offset = ast.Load(), 1, 0
+        call = ast.Call(func=name, args=[], keywords=[], lineno=1,
+                        col_offset=0)
+        result = h.roundtrip(ast.Expression(call), asdl_harness.EXPRESSION)
+        self.assertEqual(result.body.func.id, 'p')
+        self.assertIsNone(result.body.starargs)
+
+    def test_slot_layout(self):
+        h, ast = self.check_roundtrip(slot_layout=True)
+        tree = h.roundtrip(asdl_harness.sample_module(ast, 1),
+                           asdl_harness.MODULE)
+        name = tree.body[0].test
+        self.assertEqual(type(name).__slots__, ('id', 'ctx'))
+        self.assertEqual(vars(name), {})
+        name.other = 1
+        self.assertEqual(vars(name), {'other': 1})
+        copied = copy.copy(name)
+        self.assertEqual((copied.id, copied.ctx, copied.other),
+                         (name.id, name.ctx, 1))
+        # Subclasses can still convert with the slots of their base.
+        class MyName(ast.Name):
+            pass
+        tree.body[0].test = MyName('m', ast.Load(), lineno=1, col_offset=0)
+        result = h.roundtrip(tree, asdl_harness.MODULE)
+        self.assertEqual(result.body[0].test.id, 'm')
+
+    def test_slab_alloc(self):
+        h, ast = self.check_roundtrip(slab_alloc=True)
+        default = asdl_harness.get_build('-O0')
+        # Nodes come from a few blocks, each one arena allocation, and
+        # every node allocated is counted.
+        self.assertEqual(default.alloc(100, 1), 300)
+        nodes, blocks = h.slab_stats()
+        mallocs = h.alloc(100, 1)
+        self.assertLess(mallocs, 20)
+        self.assertEqual(h.slab_stats(), (nodes + 300, blocks + mallocs))
+        tree = asdl_harness.sample_module(ast, 10)
+        self.assertLess(h.obj2mod(tree, asdl_harness.MODULE, 1),
+                        default.obj2mod(asdl_harness.sample_module(
+                            default.module(), 10), asdl_harness.MODULE, 1))
+        # Module, and 17 nodes per statement
+        self.assertEqual(h.slab_stats()[0], nodes + 300 + 1 + 10 * 17)
+
+    def test_compact_structs(self):
+        h, ast = self.check_roundtrip(compact_structs=True)
+        # The layout model finds nothing to save on Python.asdl, and the
+        # compiled structs agree.
+        self.assertEqual([size - compact for name, size, compact
+                          in asdl_c.struct_sizes(self.mod) if size != compact],
+                         [])
+        default = asdl_harness.get_build('-O0')
+        self.assertEqual(
+            h.arena_bytes(asdl_harness.sample_module(ast, 10),
+                          asdl_harness.MODULE),
+            default.arena_bytes(asdl_harness.sample_module(default.module(),
+                                                           10),
+                                asdl_harness.MODULE))
+
+    def test_int_buffers(self):
+        h, ast = self.check_roundtrip(int_buffers=True)
+        compare = ast.Compare(
+            left=ast.Name('a', ast.Load(), lineno=1, col_offset=0),
+            ops=[ast.Lt(), ast.Eq()],
+            comparators=[ast.Num(1, lineno=1, col_offset=0),
+                         ast.Num(2, lineno=1, col_offset=0)],
+            lineno=1, col_offset=0)
+        tree = ast.Expression(compare)
+        ops = h.roundtrip(tree, asdl_harness.EXPRESSION).body.ops
+        # cmpop values count from 1 in the order of Python.asdl.
+        self.assertEqual(ops, array.array('i', [3, 1]))
+        compare.ops = array.array('i', [1, 3])
+        ops = h.roundtrip(tree, asdl_harness.EXPRESSION).body.ops
+        self.assertEqual(ops, array.array('i', [1, 3]))
+        compare.ops = array.array('i', [99, 1])
+        with self.assertRaisesRegex(ValueError, 'invalid cmpop value: 99'):
+            h.roundtrip(tree, asdl_harness.EXPRESSION)
+        compare.ops = [1, 3]
+        with self.assertRaisesRegex(TypeError, 'expected some sort of cmpop'):
+            h.roundtrip(tree, asdl_harness.EXPRESSION)
+
+    def test_singleton_identity(self):
+        h, ast = self.check_roundtrip(singleton_identity=True)
+        tree = h.roundtrip(asdl_harness.sample_module(ast, 2),
+                           asdl_harness.MODULE)
+        load = tree.body[0].test.ctx
+        self.assertIs(tree.body[1].test.ctx, load)
+        # Fresh instances and instances of subclasses are not the singletons,
+        # and still convert.
+        class MyLoad(ast.Load):
+            pass
+        tree.body[0].test.ctx = ast.Load()
+        tree.body[1].test.ctx = MyLoad()
+        tree.body[1].orelse = [ast.Assign(
+            [ast.Name('x', ast.Store(), lineno=1, col_offset=0)],
+            tree.body[1].test, lineno=1, col_offset=0)]
+        result = h.roundtrip(tree, asdl_harness.MODULE)
+        self.assertIs(result.body[0].test.ctx, load)
+        self.assertIs(result.body[1].test.ctx, load)
+        self.assertIs(result.body[1].orelse[0].targets[0].ctx.__class__,
+                      ast.Store)
+
+    def test_lazy_types(self):
+        h, ast = self.check_roundtrip(lazy_types=True)
+        # Node types already created in this process stay created, so look
+        # at a fresh one.
+        script = """if 1:
+            import importlib.util, sys
+            spec = importlib.util.spec_from_file_location('harness',
+                                                          sys.argv[1])
+            h = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(h)
+            ast = h.module()
+            print('Name' in vars(ast), 'Name' in ast.__all__)
+            ast.Name
+            print('Name' in vars(ast), 'Load' in vars(ast))
+            """
+        result = subprocess.run([sys.executable, '-c', script, h.__file__],
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True, check=True)
+        self.assertEqual(result.stdout.split(),
+                         ['False', 'True', 'True', 'False'])
+
+    def test_table_driven(self):
+        h, ast = self.check_roundtrip(table_driven=True)
+        # The generic converters report bad trees like the unrolled ones.
+        default = asdl_harness.get_build('-O0')
+
+        def error(h, change):
+            tree = asdl_harness.sample_module(h.module(), 1)
+            change(tree, h.module())
+            with self.assertRaises(Exception) as cm:
+                h.roundtrip(tree, asdl_harness.MODULE)
+            return cm.exception.__class__, str(cm.exception)
+
+        def set_targets(tree, ast):
+            tree.body[0].body[0].targets = ast.Name('x', ast.Store(),
+                                                    lineno=1, col_offset=0)
+
+        def set_lineno(tree, ast):
+            tree.body[0].lineno = 'one'
+
+        def del_ctx(tree, ast):
+            del tree.body[0].test.ctx
+
+        for change in (set_targets, set_lineno, del_ctx):
+            self.assertEqual(error(h, change), error(default, change))
+
+    def test_marshal(self):
+        h, ast = self.check_roundtrip(marshal=True)
+        ns = {}
+        exec(asdl_py.generate(self.mod), ns)
+
+        def to_py(node):
+            # The same tree, made of the classes asdl_py.py generates
+            if isinstance(node, list):
+                return [to_py(item) for item in node]
+            if not isinstance(node, ast.AST):
+                return node
+            cls = ns[node.__class__.__name__]
+            copy = cls.__new__(cls)
+            for name in node._fields + node._attributes:
+                setattr(copy, name, to_py(getattr(node, name, None)))
+            return copy
+
+        for seed in range(50):
+            rnd = random.Random(seed)
+            tree = ast.Module([asdl_harness.random_tree(self.mod, ast, rnd,
+                                                        'stmt')
+                               for _ in range(3)])
+            data = h.mod2bytes(h.mod(tree, asdl_harness.MODULE))
+            copy = h.bytes2obj(data)
+            self.assertEqual(self.dump(copy), self.dump(tree))
+            # obj2ast leaves the attributes of products unset, so compare
+            # the Python encoding of the tree read back, which has the
+            # values written.
+            self.assertEqual(ns['encode'](to_py(copy)), data)
+            self.assertEqual(ns['encode'](ns['decode'](data)), data)
+        # Damaged data raises rather than crashes.
+        for i in range(len(data)):
+            with self.assertRaises(ValueError):
+                h.bytes2obj(data[:i])
+            with self.assertRaises(ValueError):
+                ns['decode'](data[:i])
+            flipped = data[:i] + bytes([data[i] ^ 0xff]) + data[i + 1:]
+            try:
+                h.bytes2obj(flipped)
+            except (ValueError, TypeError):
+                pass
+
+
+class TestEmitVisitor(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mod = asdl.parse('./Python.asdl')
+
+    def test_buffering(self):
+        f = io.StringIO()
+        v = asdl_c.TypeDefVisitor(f)
+        v.buffer_lines = 10
+        v.emit('typedef int a_ty;', 0)
+        self.assertEqual(f.getvalue(), '')
+        v.flush()
+        self.assertEqual(f.getvalue(), 'typedef int a_ty;\n')
+
+    def test_visit_module_flushes(self):
+        # Without a ChainOfVisitors, which adds a blank line per visitor
+        for cls in (asdl_c.TypeDefVisitor, asdl_c.ObjVisitor,
+                    asdl_c.ASTModuleVisitor, asdl_c.PartingShots):
+            f = io.StringIO()
+            cls(f).visit(self.mod)
+            self.assertEqual(f.getvalue() + '\n',
+                             asdl_c.render_visitor(cls, self.mod))
+
+
+class TestProfile(unittest.TestCase):
+    def test_chain(self):
+        mod = asdl.parse('./Python.asdl')
+        f = io.StringIO()
+        with asdl.VisitorProfile() as profile:
+            asdl_c.make_chain(f, asdl_c.HEADER_VISITORS).visit(mod)
+        self.assertEqual([v.__class__ for v, seconds in profile.runs],
+                         list(asdl_c.HEADER_VISITORS))
+        self.assertEqual(sum(v.emitted for v, seconds in profile.runs),
+                         len(f.getvalue()))
+        self.assertEqual(profile.methods[('StructVisitor', 'visitModule')][0],
+                         1)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            asdl_c.print_profile(profile)
+        self.assertIn('StructVisitor', out.getvalue())
+        self.assertIn('visitConstructor', out.getvalue())
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def run_main(self, *args):
+        return subprocess.run([sys.executable, 'asdl_c.py'] + list(args),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+
+    def generate(self, name, *args):
+        """Run asdl_c.py with args on Python.asdl into a new directory; return
+        the contents of the files written there."""
+        out = os.path.join(self.tmp, name)
+        os.mkdir(out)
+        args = [arg.format(out=out) for arg in args]
+        result = self.run_main(*args + ['./Python.asdl'])
+        self.assertEqual(result.returncode, 0, result.stderr)
+        files = {}
+        for filename in os.listdir(out):
+            with open(os.path.join(out, filename), 'rb') as f:
+                files[filename] = f.read()
+        return files
+
+    def serial(self):
+        # One file per run, each generated by a single chain in-process
+        files = self.generate('header', '-h', '{out}')
+        files.update(self.generate('source', '-c', '{out}'))
+        return files
+
+    def test_header_and_source(self):
+        files = self.generate('both', '-h', '{out}', '-c', '{out}')
+        self.assertEqual(sorted(files), ['Python-ast.c', 'Python-ast.h'])
+        self.assertEqual(files, self.serial())
+
+    def test_workers(self):
+        files = self.generate('parallel', '-j', '2', '-h', '{out}',
+                              '-c', '{out}')
+        self.assertEqual(files, self.serial())
+        self.assertEqual(self.generate('nothing', '-j', '2'), {})
+
+    def test_bad_workers(self):
+        for value in ('x', '0', '-1'):
+            result = self.run_main('-j', value, './Python.asdl')
+            self.assertEqual(result.returncode, 1)
+            self.assertIn('-j expects a positive number of workers',
+                          result.stdout)
+            self.assertEqual(result.stderr, '')
+        result = self.run_main('-j')
+        self.assertEqual(result.returncode, 1)
+        self.assertIn('requires argument', result.stdout)
+
+
+class TestUpdateFile(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'out.c')
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_update(self):
+        self.assertTrue(asdl_c.update_file(self.path, 'int x;\n'))
+        self.assertEqual(self.read(), 'int x;\n')
+        os.utime(self.path, (0, 0))
+
+        self.assertFalse(asdl_c.update_file(self.path, 'int x;\n'))
+        self.assertEqual(os.stat(self.path).st_mtime, 0)
+
+        self.assertTrue(asdl_c.update_file(self.path, 'int y;\n'))
+        self.assertEqual(self.read(), 'int y;\n')
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['out.c'])
+
+    @unittest.skipUnless(os.name == 'posix', 'needs POSIX file modes')
+    def test_mode(self):
+        umask = os.umask(0o027)
+        try:
+            asdl_c.update_file(self.path, 'int x;\n')
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+        # A rewritten file keeps its mode.
+        os.chmod(self.path, 0o604)
+        asdl_c.update_file(self.path, 'int y;\n')
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o604)
+
+
+if __name__ == '__main__':
+    unittest.main()
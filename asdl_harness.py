@@ -0,0 +1,279 @@
+"""Build the Python-ast.c asdl_c.py generates as an extension module.
+
+CPython builds Python-ast.c into the interpreter, against its private
+headers. harness/ holds what it takes to build the file against the public
+headers of the running interpreter instead: a stand-in asdl.h, and
+harness.c, which implements the arena and includes Python-ast.c. The
+resulting extension module, harness, has these functions:
+
+    module()                    the _ast module (PyInit__ast)
+    roundtrip(tree, mode[, n])  PyAST_mod2obj(PyAST_obj2mod(tree)), n times
+    obj2mod(tree, mode, n)      PyAST_obj2mod(tree) n times, each into a new
+                                arena; return the PyArena_Malloc calls of one
+    arena_bytes(tree, mode)     the bytes PyAST_obj2mod(tree) takes from
+                                the arena
+    mod(tree, mode)             PyAST_obj2mod(tree), as an opaque object
+    mod2obj(mod, n)             PyAST_mod2obj of a mod() result, n times;
+                                return the last one
+    alloc(n, rounds)            build n Name, Num and keyword nodes with the
+                                constructor functions, rounds times; return
+                                the PyArena_Malloc calls of one round
+    slab_stats()                _PyAST_SlabStats(), with --slab-alloc
+    mod2bytes(mod[, n])         PyAST_mod2bytes of a mod() result, n times,
+                                with --marshal
+    bytes2obj(data[, n])        PyAST_mod2obj(PyAST_bytes2mod(data)), n
+                                times, with --marshal
+
+where tree must be made of the classes of module(), and mode is MODULE,
+EXPRESSION or INTERACTIVE. The tests of asdl_c.py and the benchmarks of
+asdl_bench.py use it to compare the code generated with and without options.
+"""
+
+import atexit, functools, importlib.util, os, shlex, shutil, subprocess
+import sys, sysconfig, tempfile
+
+import asdl
+import asdl_c
+
+HARNESS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'harness')
+PYTHON_ASDL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'Python.asdl')
+
+# The modes of PyAST_obj2mod
+MODULE, EXPRESSION, INTERACTIVE = range(3)
+
+
+class BuildError(Exception):
+    """The compiler failed; the message is its output."""
+
+
+@functools.lru_cache()
+def python_asdl():
+    return asdl.parse(PYTHON_ASDL)
+
+
+def compiler():
+    """Return the compiler command as a list, or None if there is no
+    compiler or no Python.h for the running interpreter."""
+    if not sys.platform.startswith('linux'):
+        return None
+    cc = shlex.split(os.environ.get('CC') or
+                     sysconfig.get_config_var('CC') or 'cc')
+    include = sysconfig.get_paths()['include']
+    if (not cc or shutil.which(cc[0]) is None or
+            not os.path.exists(os.path.join(include, 'Python.h'))):
+        return None
+    return cc
+
+
+def build(directory, optimize='-O2', **options):
+    """Generate Python-ast.[hc] from Python.asdl with options into directory
+    and compile the extension module there; return its path.
+
+    Raise BuildError if the compiler fails.
+    """
+    cc = compiler()
+    if cc is None:
+        raise BuildError('no C compiler or Python headers available')
+    options = asdl_c.Options(**options)
+    mod = python_asdl()
+    msg = asdl_c.common_msg % 'asdl_harness.py'
+    asdl_c.write_header(mod, os.path.join(directory, 'Python-ast.h'), msg,
+                        options=options)
+    asdl_c.write_source(mod, os.path.join(directory, 'Python-ast.c'), msg,
+                        options=options)
+    path = os.path.join(directory,
+                        'harness' + sysconfig.get_config_var('EXT_SUFFIX'))
+    defines = []
+    if options.slab_alloc:
+        defines.append('-DSLAB')
+    if options.marshal:
+        defines.append('-DMARSHAL')
+    # The generated code defines symbols (PyAST_mod2obj, ...) that the
+    # interpreter may export as well, so keep them private to the module.
+    cmd = cc + [optimize, '-w', '-fPIC', '-shared', '-fvisibility=hidden',
+                '-Wl,-Bsymbolic'] + defines + [
+        '-I' + HARNESS_DIR, '-I' + directory,
+        '-I' + sysconfig.get_paths()['include'],
+        '-I' + sysconfig.get_paths()['platinclude'],
+        os.path.join(HARNESS_DIR, 'harness.c'), '-o', path]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, universal_newlines=True)
+    if result.returncode:
+        raise BuildError(result.stdout)
+    return path
+
+
+def load(path):
+    """Import the extension module built at path."""
+    spec = importlib.util.spec_from_file_location('harness', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+_build_dir = None
+
+@functools.lru_cache(maxsize=None)
+def _load_build(optimize, options):
+    global _build_dir
+    if _build_dir is None:
+        _build_dir = tempfile.TemporaryDirectory(prefix='asdl_harness')
+        atexit.register(_build_dir.cleanup)
+    directory = tempfile.mkdtemp(dir=_build_dir.name)
+    return load(build(directory, optimize, **dict(options)))
+
+
+def get_build(optimize='-O2', **options):
+    """Return the extension module built with options, building it on first
+    use; builds last until the process exits."""
+    return _load_build(optimize, tuple(sorted(options.items())))
+
+
+@functools.lru_cache()
+def unavailable_reason():
+    """Return why the harness cannot be built here, or None if it can.
+
+    A build without options is attempted once, so that the headers of
+    Python versions the generated code does not support count as
+    unavailable rather than as failures.
+    """
+    if compiler() is None:
+        return 'no C compiler or Python headers available'
+    try:
+        get_build('-O0')
+    except BuildError as e:
+        return 'the harness does not build here:\n%s' % e
+    return None
+
+
+def random_tree(mod, classes, rnd, type=None, max_depth=5):
+    """Return a random tree of type (by default, the first type of mod),
+    made of the node classes of the module classes, such as module().
+
+    Sequences and optional fields are empty past max_depth. Optional int
+    fields always get a value, since ast2obj turns None into 0.
+    """
+    if type is None:
+        type = str(mod.dfns[0].name)
+    return _random_node(mod, classes, rnd, type, 0, max_depth)
+
+
+_random_values = {
+    'identifier': ('x', 'yy'),
+    'string': ('s', 'string'),
+    'bytes': (b'b', b''),
+    'object': (1, 2.5, 'o', -2**70),
+    'singleton': (True, False, None),
+}
+
+def _random_node(mod, classes, rnd, type, depth, max_depth):
+    value = mod.types[type]
+    if isinstance(value, asdl.Product):
+        name, fields = type, value.fields
+    else:
+        cons = rnd.choice(value.types)
+        name, fields = str(cons.name), cons.fields
+    node = getattr(classes, name)()
+    for f in fields:
+        if f.seq:
+            count = 0 if depth >= max_depth else rnd.randrange(3)
+            items = [_random_value(mod, classes, rnd, str(f.type), depth,
+                                   max_depth)
+                     for _ in range(count)]
+            setattr(node, str(f.name), items)
+        elif (f.opt and str(f.type) != 'int' and
+              (depth >= max_depth or rnd.random() < 0.3)):
+            setattr(node, str(f.name), None)
+        else:
+            setattr(node, str(f.name),
+                    _random_value(mod, classes, rnd, str(f.type), depth,
+                                  max_depth))
+    for a in value.attributes:
+        setattr(node, str(a.name), rnd.randrange(1000))
+    return node
+
+def _random_value(mod, classes, rnd, type, depth, max_depth):
+    if type == 'int':
+        return rnd.randrange(-5, 1000)
+    if type in _random_values:
+        return rnd.choice(_random_values[type])
+    if asdl_c.get_symbol_table(mod).is_simple_sum(type):
+        cons = rnd.choice(mod.types[type].types)
+        return getattr(classes, str(cons.name))()
+    return _random_node(mod, classes, rnd, type, depth + 1, max_depth)
+
+
+def dump(mod, tree, type=None):
+    """Return a form of tree, of type (by default, the first type of mod),
+    that compares equal for equal trees.
+
+    Enum values are the names of their constructors, whether singletons or
+    ints (with --int-buffers). Attributes of products are left out, since
+    obj2ast does not read them.
+    """
+    if type is None:
+        type = str(mod.dfns[0].name)
+    if tree is None:
+        return None
+    value = mod.types[type]
+    name = tree.__class__.__name__
+    if isinstance(value, asdl.Product):
+        fields = value.fields
+    else:
+        [cons] = [t for t in value.types if t.name == name]
+        fields = list(cons.fields) + list(value.attributes)
+    result = [name]
+    for f in fields:
+        field_value = getattr(tree, str(f.name), None)
+        if f.seq:
+            field_value = [_dump_value(mod, str(f.type), item)
+                           for item in field_value]
+        else:
+            field_value = _dump_value(mod, str(f.type), field_value)
+        result.append((str(f.name), field_value))
+    return tuple(result)
+
+def _dump_value(mod, type, value):
+    if type in asdl.builtin_types:
+        return value
+    if asdl_c.get_symbol_table(mod).is_simple_sum(type):
+        if isinstance(value, int):
+            return str(mod.types[type].types[value - 1].name)
+        return value.__class__.__name__
+    return dump(mod, value, type)
+
+
+def sample_module(classes, num_stmts):
+    """Return a Module of num_stmts if statements, each holding an assignment
+    of a comparison, arithmetic and a call, made of the classes of the
+    Python.asdl module classes."""
+    def pos(node):
+        node.lineno = 1
+        node.col_offset = 0
+        return node
+
+    def name(id):
+        return pos(classes.Name(id=id, ctx=classes.Load()))
+
+    body = []
+    for i in range(num_stmts):
+        call = pos(classes.Call(
+            func=name('f'), args=[name('c'), pos(classes.Num(n=i))],
+            keywords=[classes.keyword(arg='k',
+                                      value=pos(classes.Str(s='v')))],
+            starargs=None, kwargs=None))
+        expr = pos(classes.BinOp(
+            left=name('a'), op=classes.Add(),
+            right=pos(classes.BinOp(left=name('b'), op=classes.Mult(),
+                                    right=call))))
+        compare = pos(classes.Compare(left=expr,
+                                      ops=[classes.Lt(), classes.NotIn()],
+                                      comparators=[name('x'), name('y')]))
+        assign = pos(classes.Assign(
+            targets=[pos(classes.Name(id='x', ctx=classes.Store()))],
+            value=compare))
+        body.append(pos(classes.If(test=name('t'), body=[assign],
+                                   orelse=[])))
+    return classes.Module(body=body)
@@ -0,0 +1,340 @@
+"""Stream trees of any ASDL module as JSON lines.
+
+A tree is written in preorder, one line per node. The line of a node is a
+JSON object holding the name of its constructor (or product) under "_type",
+and each of its fields and attributes of a builtin type or an enum; the
+nodes of its other fields follow on the next lines, field by field. For
+those, the object holds the length of each sequence field, so that the
+layout of the stream is known from the module alone. A None node is the line
+null. For example, the Python expression a + 1 is:
+
+    {"_type": "Expression"}
+    {"_type": "BinOp", "op": "Add", "lineno": 1, "col_offset": 0}
+    {"_type": "Name", "id": "a", "ctx": "Load", "lineno": 1, "col_offset": 0}
+    {"_type": "Num", "n": 1, "lineno": 1, "col_offset": 4}
+
+Enums are the names of their constructors. Builtin values are JSON values,
+except for bytes, complex numbers and non-finite floats, which are objects
+with a single "$bytes" (base64), "$complex" or "$float" (repr) key.
+
+Neither side needs the whole tree: iter_lines() walks a tree without
+recursion, and iter_events() parses a stream one line at a time into start
+and end events, like xml.etree.ElementTree.iterparse(). lines_from_events()
+turns events back into lines, so a pipeline can filter a stream without
+building the tree; load() builds the tree from node classes.
+"""
+
+import base64, functools, json, math
+
+import asdl
+import asdl_c
+import asdl_py
+
+_encoder = json.JSONEncoder(check_circular=False, allow_nan=False)
+
+# Marks the end of a node in the pending stack of iter_events
+_END = object()
+
+
+class _Constructor:
+    """The fields and attributes of a constructor or product.
+
+    values holds (name, enum, seq) for the fields written in the line of the
+    node, where enum is the set of constructor names of an enum field and
+    None for builtin fields; nodes holds (name, type, seq) for the fields
+    whose nodes follow, in order.
+    """
+
+    __slots__ = ('name', 'values', 'nodes', 'sequences')
+
+    def __init__(self, name, fields, enums):
+        self.name = name
+        self.values = []
+        self.nodes = []
+        for field_name, f in zip(asdl_py.field_names(fields), fields):
+            type = str(f.type)
+            if type in asdl.builtin_types or type in enums:
+                self.values.append((field_name, enums.get(type), f.seq))
+            else:
+                self.nodes.append((field_name, type, f.seq))
+        self.sequences = frozenset(name for name, type, seq in self.nodes
+                                   if seq)
+
+
+class _Schema:
+    """The constructors of the node types of a module."""
+
+    def __init__(self, mod):
+        symtab = asdl_c.get_symbol_table(mod)
+        self.root = str(mod.dfns[0].name)
+        enums = {}
+        for dfn in mod.dfns:
+            if symtab.is_simple_sum(dfn.name):
+                enums[str(dfn.name)] = frozenset(str(t.name)
+                                                 for t in dfn.value.types)
+        # Constructors of each node type, and every constructor, by name
+        self.types = {}
+        self.constructors = {}
+        for dfn in mod.dfns:
+            name, value = str(dfn.name), dfn.value
+            if name in enums:
+                continue
+            if isinstance(value, asdl.Product):
+                cons = [_Constructor(name, list(value.fields) +
+                                     list(value.attributes), enums)]
+            else:
+                cons = [_Constructor(str(t.name), list(t.fields) +
+                                     list(value.attributes), enums)
+                        for t in value.types]
+            self.types[name] = {c.name: c for c in cons}
+            self.constructors.update(self.types[name])
+        # Constructor of each (type, class) of the nodes exported so far
+        self._classes = {}
+
+    def node_type(self, type):
+        if type is None:
+            return self.root
+        if type not in self.types:
+            raise ValueError("%r is not a node type of the module" % type)
+        return type
+
+    def constructor(self, type, node):
+        """Return the _Constructor of type that node is an instance of."""
+        key = (type, node.__class__)
+        cons = self._classes.get(key)
+        if cons is None:
+            constructors = self.types[type]
+            cons = constructors[_class_name(constructors, type, node)]
+            self._classes[key] = cons
+        return cons
+
+
+@functools.lru_cache(maxsize=8)
+def _get_schema(mod):
+    return _Schema(mod)
+
+
+def _class_name(names, type, node):
+    """Return the name in names of the class of node or of a base class."""
+    for cls in node.__class__.__mro__:
+        if cls.__name__ in names:
+            return cls.__name__
+    raise TypeError("expected some sort of %s, but got %r" % (type, node))
+
+
+def _export_value(value):
+    if isinstance(value, float):
+        return value if math.isfinite(value) else {"$float": repr(value)}
+    if value is None or isinstance(value, (str, int)):
+        return value
+    if isinstance(value, bytes):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, complex):
+        return {"$complex": repr(value)}
+    raise TypeError("cannot export %s objects" % type(value).__name__)
+
+
+def _import_value(value):
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        (tag, payload), = value.items()
+        if tag == "$bytes":
+            return base64.b64decode(payload)
+        if tag == "$complex":
+            return complex(payload)
+        if tag == "$float":
+            return float(payload)
+    raise ValueError("invalid value %r" % (value,))
+
+
+def iter_lines(mod, tree, type=None):
+    """Yield the JSON lines of tree, a node of type (by default, the first
+    type of mod), without line endings.
+
+    Fields are read with getattr; missing fields are written as None, or as
+    empty sequences.
+    """
+    schema = _get_schema(mod)
+    pending = [(schema.node_type(type), tree)]
+    while pending:
+        type, node = pending.pop()
+        if node is None:
+            yield "null"
+            continue
+        cons = schema.constructor(type, node)
+        record = {"_type": cons.name}
+        for name, enum, seq in cons.values:
+            value = getattr(node, name, None)
+            if enum is not None:
+                if seq:
+                    value = [_class_name(enum, name, item)
+                             for item in value or ()]
+                elif value is not None:
+                    value = _class_name(enum, name, value)
+            elif seq:
+                value = [_export_value(item) for item in value or ()]
+            else:
+                value = _export_value(value)
+            record[name] = value
+        children = []
+        for name, child_type, seq in cons.nodes:
+            value = getattr(node, name, None)
+            if seq:
+                value = value or ()
+                record[name] = len(value)
+                children.extend((child_type, item) for item in value)
+            else:
+                children.append((child_type, value))
+        yield _encoder.encode(record)
+        pending.extend(reversed(children))
+
+
+def dump(mod, tree, file, type=None):
+    """Write the JSON lines of tree to the text file file."""
+    for line in iter_lines(mod, tree, type):
+        file.write(line)
+        file.write("\n")
+
+
+def iter_events(mod, lines, type=None):
+    """Parse the JSON lines of a tree of type from the iterable lines.
+
+    Yield (event, field, name, values) tuples: ("start", field, name, values)
+    when a node starts, where name is its constructor and values maps its
+    builtin and enum fields to their values and its node sequence fields to
+    their lengths; ("end", field, name, None) after its children; and
+    ("null", field, None, None) for a None node. field is the field of the
+    parent node that holds the node, None for the root.
+
+    Only the lines of the tree are consumed, so lines may go on with more
+    data. Raise ValueError if the lines do not match the module.
+    """
+    schema = _get_schema(mod)
+    lines = iter(lines)
+    # Subtrees left to read, as (field, type, count) for the next count
+    # nodes of a field, and nodes left to end, as (_END, field, name); the
+    # next one last
+    pending = [(None, schema.node_type(type), 1)]
+    while pending:
+        item = pending.pop()
+        if item[0] is _END:
+            yield ("end", item[1], item[2], None)
+            continue
+        field, type, count = item
+        if count > 1:
+            pending.append((field, type, count - 1))
+        for line in lines:
+            if line.strip():
+                break
+        else:
+            raise ValueError("unexpected end of data, expected %s" % type)
+        record = json.loads(line)
+        if record is None:
+            yield ("null", field, None, None)
+            continue
+        try:
+            cons = schema.types[type][record["_type"]]
+        except (KeyError, TypeError):
+            raise ValueError("expected some sort of %s, but got %s"
+                             % (type, line.strip())) from None
+        values = {}
+        for name, enum, seq in cons.values:
+            value = record.get(name)
+            if enum is not None:
+                for item in (value or () if seq else (value,)):
+                    if item is not None and item not in enum:
+                        raise ValueError("invalid %s in %s: %r"
+                                         % (name, cons.name, item))
+            elif seq:
+                value = [_import_value(item) for item in value or ()]
+            else:
+                value = _import_value(value)
+            values[name] = value
+        children = []
+        for name, child_type, seq in cons.nodes:
+            if seq:
+                count = record.get(name, 0)
+                if not isinstance(count, int) or count < 0:
+                    raise ValueError("invalid length of %s in %s: %r"
+                                     % (name, cons.name, count))
+                values[name] = count
+                if count:
+                    children.append((name, child_type, count))
+            else:
+                children.append((name, child_type, 1))
+        yield ("start", field, cons.name, values)
+        pending.append((_END, field, cons.name))
+        pending.extend(reversed(children))
+
+
+def lines_from_events(events):
+    """Yield the JSON lines of the events iter_events() yields.
+
+    The lengths of sequences in start events must match the number of nodes
+    that follow for them.
+    """
+    for event, field, name, values in events:
+        if event == "start":
+            record = {"_type": name}
+            for key, value in values.items():
+                if isinstance(value, list):
+                    value = [_export_value(item) for item in value]
+                else:
+                    value = _export_value(value)
+                record[key] = value
+            yield _encoder.encode(record)
+        elif event == "null":
+            yield "null"
+
+
+def load(mod, lines, classes, type=None):
+    """Build the tree of type read from lines out of the node classes.
+
+    classes maps the names of constructors and products to classes, as a
+    mapping or as the attributes of an object such as a module generated by
+    asdl_py.py or the ast module. Nodes are made by calling their class
+    without arguments, then setting their fields; each enum constructor is
+    instantiated once.
+    """
+    if not hasattr(classes, "__getitem__"):
+        classes = vars(classes)
+    schema = _get_schema(mod)
+    enum_values = {}
+
+    def enum_value(name):
+        value = enum_values.get(name)
+        if value is None:
+            value = enum_values[name] = classes[name]()
+        return value
+
+    # The nodes being built, with their constructor
+    stack = []
+    root = None
+    for event, field, name, values in iter_events(mod, lines, type):
+        if event == "end":
+            value = stack.pop()[0]
+        elif event == "null":
+            value = None
+        else:
+            node = classes[name]()
+            cons = schema.constructors[name]
+            for key, enum, seq in cons.values:
+                value = values[key]
+                if enum is not None and value is not None:
+                    if seq:
+                        value = [enum_value(item) for item in value]
+                    else:
+                        value = enum_value(value)
+                setattr(node, key, value)
+            for key in cons.sequences:
+                setattr(node, key, [])
+            stack.append((node, cons))
+            continue
+        if not stack:
+            root = value
+        elif field in stack[-1][1].sequences:
+            getattr(stack[-1][0], field).append(value)
+        else:
+            setattr(stack[-1][0], field, value)
+    return root
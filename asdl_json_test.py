@@ -0,0 +1,131 @@
+# Simple testing / sanity-checking for asdl_json.py
+# Assumes some things about the current Python.asdl, which is used as input.
+
+import io, unittest
+import asdl, asdl_json, asdl_py
+
+
+class TestJsonLines(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mod = asdl.parse('./Python.asdl')
+        cls.ns = {}
+        exec(asdl_py.generate(cls.mod), cls.ns)
+
+    def tree(self):
+        ns = self.ns
+        values = [1, -2**70, 1.5, float('inf'), 2j, 'x', '\ud800', b'\0',
+                  None, True]
+        body = [ns['Expr'](ns['Num'](v, lineno=i, col_offset=0), lineno=i,
+                           col_offset=0)
+                for i, v in enumerate(values)]
+        body.append(ns['ImportFrom']('m', [ns['alias']('a')], 1, lineno=1,
+                                     col_offset=0))
+        body.append(ns['Expr'](
+            ns['Compare'](ns['Name']('a', ns['Load'](), lineno=1,
+                                     col_offset=0),
+                          [ns['Lt'](), ns['In']()],
+                          [ns['Num'](1, lineno=1, col_offset=4)] * 2,
+                          lineno=1, col_offset=0),
+            lineno=1, col_offset=0))
+        body.append(ns['FunctionDef'](
+            'f', ns['arguments']([ns['arg']('a', lineno=1, col_offset=2)],
+                                 kw_defaults=[None]),
+            [ns['Pass'](lineno=2, col_offset=4)], lineno=1, col_offset=0))
+        return ns['Module'](body)
+
+    def test_round_trip(self):
+        tree = self.tree()
+        f = io.StringIO()
+        asdl_json.dump(self.mod, tree, f)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(lines[0], '{"_type": "Module", "body": 13}')
+        self.assertIn('{"_type": "Compare", "ops": ["Lt", "In"], '
+                      '"lineno": 1, "col_offset": 0, "comparators": 2}', lines)
+        f.seek(0)
+        copy = asdl_json.load(self.mod, f, self.ns)
+        self.assertEqual(repr(copy), repr(tree))
+        self.assertEqual(list(asdl_json.iter_lines(self.mod, copy)), lines)
+        self.assertIs(copy.body[-2].value.left.ctx.__class__, self.ns['Load'])
+        self.assertEqual(copy.body[-1].args.args[0].col_offset, 2)
+
+    def test_events(self):
+        ns = self.ns
+        tree = ns['Expression'](ns['Name']('a', ns['Load'](), lineno=1,
+                                           col_offset=0))
+        lines = list(asdl_json.iter_lines(self.mod, tree))
+        events = list(asdl_json.iter_events(self.mod, lines))
+        self.assertEqual(events, [
+            ('start', None, 'Expression', {}),
+            ('start', 'body', 'Name',
+             {'id': 'a', 'ctx': 'Load', 'lineno': 1, 'col_offset': 0}),
+            ('end', 'body', 'Name', None),
+            ('end', None, 'Expression', None)])
+        self.assertEqual(list(asdl_json.lines_from_events(events)), lines)
+
+    def test_filter_stream(self):
+        # Rename every identifier without building the tree
+        lines = asdl_json.iter_lines(self.mod, self.tree())
+        events = []
+        for event in asdl_json.iter_events(self.mod, lines):
+            if event[0] == 'start' and event[2] == 'Name':
+                event[3]['id'] = event[3]['id'].upper()
+            events.append(event)
+        copy = asdl_json.load(self.mod, asdl_json.lines_from_events(events),
+                              self.ns)
+        self.assertEqual(copy.body[-2].value.left.id, 'A')
+
+    def test_stream_of_trees(self):
+        ns = self.ns
+        f = io.StringIO()
+        for name in 'ab':
+            tree = ns['Expression'](ns['Name'](name, ns['Load'](), lineno=1,
+                                               col_offset=0))
+            asdl_json.dump(self.mod, tree, f)
+        f.seek(0)
+        self.assertEqual(asdl_json.load(self.mod, f, ns).body.id, 'a')
+        self.assertEqual(asdl_json.load(self.mod, f, ns).body.id, 'b')
+
+    def test_deep_tree(self):
+        ns = self.ns
+        node = ns['Num'](1, lineno=1, col_offset=0)
+        for _ in range(20000):
+            node = ns['UnaryOp'](ns['Not'](), node, lineno=1, col_offset=0)
+        lines = asdl_json.iter_lines(self.mod, ns['Expression'](node))
+        copy = asdl_json.load(self.mod, lines, ns)
+        self.assertEqual(copy.body.operand.operand.op.__class__, ns['Not'])
+
+    def test_long_sequence(self):
+        # A sequence is read one node at a time, whatever its length claims.
+        pass_line = '{"_type": "Pass", "lineno": 1, "col_offset": 0}'
+        lines = ['{"_type": "Module", "body": %d}' % 10**13] + [pass_line] * 3
+        events = asdl_json.iter_events(self.mod, lines)
+        self.assertEqual(next(events), ("start", None, "Module",
+                                        {"body": 10**13}))
+        self.assertEqual([next(events)[0] for _ in range(6)],
+                         ["start", "end"] * 3)
+        with self.assertRaisesRegex(ValueError, "unexpected end of data"):
+            next(events)
+        for length in ('"3"', '1.5', 'null', '[]', '-1'):
+            with self.assertRaisesRegex(ValueError, "invalid length of body"):
+                list(asdl_json.iter_events(
+                    self.mod, ['{"_type": "Module", "body": %s}' % length,
+                               pass_line]))
+
+    def test_errors(self):
+        ns = self.ns
+        with self.assertRaises(TypeError):
+            list(asdl_json.iter_lines(self.mod, ns['Expression'](ns['Pass']())))
+        with self.assertRaises(ValueError):
+            list(asdl_json.iter_lines(self.mod, None, 'nothing'))
+        for lines in (['{"_type": "Module", "body": 1}'],
+                      ['{"_type": "Pass"}'], ['[]'],
+                      ['{"_type": "Expression"}',
+                       '{"_type": "Name", "ctx": "Add"}'],
+                      ['{"_type": "Module", "body": -1}']):
+            with self.assertRaises(ValueError):
+                list(asdl_json.iter_events(self.mod, lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
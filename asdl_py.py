@@ -0,0 +1,744 @@
+#! /usr/bin/env python
+"""Generate a Python module of node classes from an ASDL description.
+
+Every type and constructor becomes a class with __slots__. A sum is a base
+class holding the attributes of its constructors; each constructor (and each
+product) takes its fields as positional or keyword arguments, and its
+attributes as keyword arguments. The classes carry precomputed metadata:
+
+_fields, _attributes
+    names of the fields and attributes, like the classes of the ast module;
+_field_types
+    (name, type, quantifier) of each field and then each attribute, where
+    quantifier is '', '?' or '*';
+_kind
+    of constructors: the index of the constructor in its sum, plus one (as
+    the C enums generated by asdl_c.py number them);
+_constructors
+    of sums: the constructor classes, in order.
+
+The module also has NodeVisitor and NodeTransformer classes, and encode()
+and decode() functions serializing trees in the binary format of the marshal
+option of asdl_c.py.
+"""
+
+import argparse, io, keyword, os
+
+import asdl
+import asdl_c
+
+auto_gen_msg = "# File automatically generated by %s.\n"
+
+
+def field_names(fields):
+    """Return the Python names of fields.
+
+    Unnamed fields are named after their type, numbered from the second one
+    on, as the arguments of the C constructor functions are.
+    """
+    names = []
+    unnamed = {}
+    for f in fields:
+        if f.name is None:
+            name = str(f.type)
+            c = unnamed[name] = unnamed.get(name, 0) + 1
+            if c > 1:
+                name = "name%d" % (c - 1)
+        else:
+            name = str(f.name)
+        names.append(name)
+    return names
+
+
+def quantifier(field):
+    if field.seq:
+        return "*"
+    if field.opt:
+        return "?"
+    return ""
+
+
+class EmitVisitor(asdl.VisitorBase):
+    """Visitor that emits indented lines of Python source to a file."""
+
+    def __init__(self, file):
+        self.file = file
+        super().__init__()
+
+    def emit(self, s, depth):
+        if s:
+            self.file.write("    " * depth + s + "\n")
+        else:
+            self.file.write("\n")
+
+    def emit_wrapped(self, prefix, items, suffix, depth):
+        """Emit prefix, items separated by commas and suffix.
+
+        Lines longer than 79 columns are wrapped after a comma, continuing
+        under the first item.
+        """
+        indent = "    " * depth
+        line = indent + prefix
+        for i, item in enumerate(items):
+            item += "," if i < len(items) - 1 else suffix
+            if len(line) + len(item) + 1 > 79 and line.strip() != prefix:
+                self.file.write(line + "\n")
+                line = indent + " " * len(prefix) + item
+            elif i:
+                line += " " + item
+            else:
+                line += item
+        if not items:
+            line += suffix
+        self.file.write(line + "\n")
+
+    def emit_tuple(self, name, items, depth):
+        items = [repr(item) for item in items]
+        self.emit_wrapped("%s = (" % name, items,
+                          ",)" if len(items) == 1 else ")", depth)
+
+
+class ClassVisitor(EmitVisitor):
+    """Emit a class for each type and constructor of a module."""
+
+    def visitModule(self, mod):
+        self.emit('"""Node classes for the %s ASDL module."""' % mod.name, 0)
+        self.emit("", 0)
+        self.emit("import struct", 0)
+        self.emit("", 0)
+        names = ["AST"]
+        for dfn in mod.dfns:
+            names.append(str(dfn.name))
+            if isinstance(dfn.value, asdl.Sum):
+                names.extend(str(t.name) for t in dfn.value.types)
+        self.emit("__all__ = [", 0)
+        for name in names:
+            self.emit("%r," % name, 1)
+        self.emit("]", 0)
+        self.emit(AST_CODE, 0)
+        for dfn in mod.dfns:
+            self.visit(dfn)
+
+    def visitType(self, type):
+        self.visit(type.value, str(type.name))
+
+    def visitSum(self, sum, name):
+        attributes = field_names(sum.attributes)
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("class %s(AST):" % name, 0)
+        self.emit_tuple("__slots__", attributes, 1)
+        if attributes:
+            self.emit_tuple("_attributes", attributes, 1)
+            self.emit_tuple("_field_types", self.field_types(sum.attributes),
+                            1)
+        for kind, t in enumerate(sum.types, 1):
+            self.visit(t, name, sum.attributes, kind)
+        self.emit("", 0)
+        self.emit_wrapped("%s._constructors = (" % name,
+                          [str(t.name) for t in sum.types],
+                          ",)" if len(sum.types) == 1 else ")", 0)
+
+    def visitConstructor(self, cons, base, attributes, kind):
+        self.emit_class(str(cons.name), base, cons.fields, attributes, kind)
+
+    def visitProduct(self, product, name):
+        self.emit_class(name, "AST", product.fields, product.attributes)
+
+    def emit_class(self, name, base, fields, attributes, kind=None):
+        names = field_names(fields)
+        attribute_names = field_names(attributes)
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("class %s(%s):" % (name, base), 0)
+        if base == "AST":
+            # Products hold their attributes themselves; constructors inherit
+            # the slots of their sum.
+            self.emit_tuple("__slots__", names + attribute_names, 1)
+        else:
+            self.emit_tuple("__slots__", names, 1)
+        if names:
+            self.emit_tuple("_fields", names, 1)
+        if attribute_names and base == "AST":
+            self.emit_tuple("_attributes", attribute_names, 1)
+        if fields or attributes:
+            self.emit_tuple("_field_types",
+                            self.field_types(list(fields) + list(attributes)),
+                            1)
+        if kind is not None:
+            self.emit("_kind = %d" % kind, 1)
+        if fields or attributes:
+            self.emit_init(fields, attributes)
+
+    def field_types(self, fields):
+        return [(name, str(f.type), quantifier(f))
+                for name, f in zip(field_names(fields), fields)]
+
+    def emit_init(self, fields, attributes):
+        fields = list(zip(field_names(fields), fields))
+        attributes = list(zip(field_names(attributes), attributes))
+        params = ["self"]
+        params += ["%s=None" % self.param(name) for name, f in fields]
+        if attributes:
+            params.append("*")
+            params += ["%s=None" % self.param(name) for name, f in attributes]
+        self.emit("", 0)
+        self.emit_wrapped("def __init__(", params, "):", 1)
+        for name, f in fields + attributes:
+            param = self.param(name)
+            if f.seq:
+                value = "[] if %s is None else %s" % (param, param)
+            else:
+                value = param
+            if keyword.iskeyword(name):
+                self.emit("setattr(self, %r, %s)" % (name, value), 2)
+            else:
+                self.emit("self.%s = %s" % (name, value), 2)
+
+    @staticmethod
+    def param(name):
+        if keyword.iskeyword(name) or name == "self":
+            return name + "_"
+        return name
+
+
+class VisitorClassVisitor(EmitVisitor):
+    """Emit NodeVisitor and NodeTransformer classes for the node classes.
+
+    Each has a visit_<class> method per constructor and product, visiting
+    the children of the node field by field.
+    """
+
+    def visitModule(self, mod):
+        self.nodes = []
+        for dfn in mod.dfns:
+            self.visit(dfn)
+        self.emit(VISITOR_CODE, 0)
+        self.emit_wrapped("_node_classes = (", [n for n, f in self.nodes],
+                          ",)" if len(self.nodes) == 1 else ")", 0)
+        self.emit_visitor("NodeVisitor", "", NODE_VISITOR_CODE)
+        self.emit_visitor("NodeTransformer", "(NodeVisitor)",
+                          NODE_TRANSFORMER_CODE)
+
+    def visitType(self, type):
+        self.visit(type.value, str(type.name))
+
+    def visitSum(self, sum, name):
+        for t in sum.types:
+            self.nodes.append((str(t.name), t.fields))
+
+    def visitProduct(self, product, name):
+        self.nodes.append((name, product.fields))
+
+    def emit_visitor(self, name, bases, code):
+        transform = name == "NodeTransformer"
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("class %s%s:" % (name, bases), 0)
+        self.emit(code, 0)
+        leaves = []
+        for node, fields in self.nodes:
+            children = [(field_name, f) for field_name, f
+                        in zip(field_names(fields), fields)
+                        if str(f.type) not in asdl.builtin_types]
+            if not children:
+                leaves.append(node)
+                continue
+            self.emit("", 0)
+            self.emit("def visit_%s(self, node):" % node, 1)
+            for field_name, f in children:
+                self.emit_child(field_name, f, transform)
+            if transform:
+                self.emit("return node", 2)
+        for node in leaves:
+            self.emit("visit_%s = _visit_leaf" % node, 1)
+        if not bases:
+            # __init_subclass__ makes the tables of subclasses.
+            self.emit("", 0)
+            self.emit("", 0)
+            self.emit("%s._dispatch = _dispatch_table(%s)" % (name, name), 0)
+
+    def emit_child(self, name, field, transform):
+        if keyword.iskeyword(name):
+            value = "getattr(node, %r)" % name
+        else:
+            value = "node.%s" % name
+        if field.seq:
+            if transform:
+                self.emit("self._visit_list(%s)" % value, 2)
+            else:
+                self.emit("for item in %s:" % value, 2)
+                self.emit("if item is not None:", 3)
+                self.emit("self.visit(item)", 4)
+            return
+        self.emit("if %s is not None:" % value, 2)
+        if not transform:
+            self.emit("self.visit(%s)" % value, 3)
+        elif keyword.iskeyword(name):
+            self.emit("setattr(node, %r, self.visit(%s))" % (name, value), 3)
+        else:
+            self.emit("%s = self.visit(%s)" % (value, value), 3)
+
+
+# Shared by the visitor classes. Their dispatch tables map each node class to
+# the visit_<class> method of the visitor class, looked up when the visitor
+# class is defined; subclasses of node classes map to the method of their
+# nearest node class base.
+VISITOR_CODE = '''
+
+class _DispatchTable(dict):
+    __slots__ = ()
+
+    def __missing__(self, cls):
+        for base in cls.__mro__[1:]:
+            if base in self:
+                method = self[cls] = self[base]
+                return method
+        raise TypeError("%s is not a node class" % cls.__name__)
+
+
+def _dispatch_table(visitor_class):
+    return _DispatchTable(
+        (node_class, getattr(visitor_class, "visit_" + node_class.__name__))
+        for node_class in _node_classes)
+
+'''
+
+NODE_VISITOR_CODE = '''    """Base class for visitors of trees of nodes.
+
+    visit(node) calls the visit_<class> method for the class of node. By
+    default, these visit the children of the node in field order, skipping
+    None; override them for the nodes of interest, and call
+    generic_visit(node) from them to continue with the children.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch = _dispatch_table(cls)
+
+    def visit(self, node):
+        return self._dispatch[node.__class__](self, node)
+
+    def generic_visit(self, node):
+        return NodeVisitor._dispatch[node.__class__](self, node)
+
+    def _visit_leaf(self, node):
+        pass'''
+
+NODE_TRANSFORMER_CODE = '''    """Base class for visitors that replace nodes of a tree.
+
+    The value visit(node) returns replaces node: None removes it, and in a
+    sequence, a list is spliced in its place (None items of sequences are
+    kept as they are). By default, visit_<class> methods transform the
+    children of the node and return it.
+    """
+
+    def generic_visit(self, node):
+        return NodeTransformer._dispatch[node.__class__](self, node)
+
+    def _visit_leaf(self, node):
+        return node
+
+    def _visit_list(self, nodes):
+        new_nodes = []
+        for node in nodes:
+            if node is not None:
+                node = self.visit(node)
+                if node is None:
+                    continue
+                if isinstance(node, list):
+                    new_nodes.extend(node)
+                    continue
+            new_nodes.append(node)
+        nodes[:] = new_nodes'''
+
+AST_CODE = '''
+
+class AST:
+    __slots__ = ()
+    _fields = ()
+    _attributes = ()
+    _field_types = ()
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(
+            "%s=%r" % (name, getattr(self, name, None))
+            for name in self._fields))'''
+
+
+class SerializerVisitor(EmitVisitor):
+    """Emit encode() and decode() functions for trees of the node classes.
+
+    They use the binary format of the marshal option of asdl_c.py, through a
+    _write_<name> and a _read_<name> function per type and constructor.
+    """
+
+    def visitModule(self, mod):
+        self.symtab = asdl_c.get_symbol_table(mod)
+        tags = ["_" + tag for tag in asdl_c.MARSHAL_TAGS]
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("_VERSION = %d" % asdl_c.MARSHAL_VERSION, 0)
+        self.emit_wrapped("(", tags, ") = range(%d)" % len(tags), 0)
+        self.emit(SERIALIZER_CODE, 0)
+        for dfn in mod.dfns:
+            self.visit(dfn)
+        root = str(mod.dfns[0].name)
+        self.emit(ENCODE_CODE % {"root": root}, 0)
+
+    def visitType(self, type):
+        self.visit(type.value, str(type.name))
+
+    def visitSum(self, sum, name):
+        if self.symtab.is_simple_sum(name):
+            self.emit_enum(sum, name)
+            return
+        for kind, t in enumerate(sum.types, 1):
+            self.emit_writer(str(t.name), kind, t.fields, sum.attributes)
+            self.emit_reader(str(t.name), t.fields, sum.attributes)
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("def _write_%s(w, node):" % name, 0)
+        self.emit("if node is None:", 1)
+        self.emit("w.out.append(0)", 2)
+        self.emit("else:", 1)
+        self.emit("_%s_writers[node.__class__](w, node)" % name, 2)
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("def _read_%s(r):" % name, 0)
+        self.emit("return _%s_readers[r.varint()](r)" % name, 1)
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("_%s_writers = _writer_table(%s)" % (name, name), 0)
+        self.emit("_%s_readers = _reader_table(%s)" % (name, name), 0)
+
+    def visitProduct(self, product, name):
+        self.emit_writer(name, 1, product.fields, product.attributes,
+                         optional=True)
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("def _read_%s(r):" % name, 0)
+        self.emit("kind = r.varint()", 1)
+        self.emit("if kind == 1:", 1)
+        self.emit_return(name, product.fields, product.attributes, 2)
+        self.emit("if kind:", 1)
+        self.emit("raise ValueError(_MALFORMED)", 2)
+        self.emit("return None", 1)
+
+    def emit_enum(self, sum, name):
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("def _write_%s(w, node):" % name, 0)
+        kind = "0 if node is None else _%s_kinds[node.__class__]" % name
+        self.emit(self.write_kind(kind, len(sum.types)), 1)
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("def _read_%s(r):" % name, 0)
+        self.emit("return _%s_values[r.varint()]" % name, 1)
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("_%s_kinds = _kind_table(%s)" % (name, name), 0)
+        # Decoded enums share one instance per constructor.
+        self.emit_wrapped("_%s_values = (" % name,
+                          ["None"] + ["%s()" % t.name for t in sum.types], ")",
+                          0)
+
+    @staticmethod
+    def write_kind(kind, max_kind):
+        if max_kind < 0x80:
+            return "w.out.append(%s)" % kind
+        return "w.varint(%s)" % kind
+
+    def emit_writer(self, name, kind, fields, attributes, optional=False):
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("def _write_%s(w, node):" % name, 0)
+        if optional:
+            self.emit("if node is None:", 1)
+            self.emit("w.out.append(0)", 2)
+            self.emit("return", 2)
+        self.emit(self.write_kind(kind, kind), 1)
+        for field_name, f in (list(zip(field_names(fields), fields)) +
+                              list(zip(field_names(attributes), attributes))):
+            if keyword.iskeyword(field_name):
+                value = "getattr(node, %r)" % field_name
+            else:
+                value = "node.%s" % field_name
+            if f.seq:
+                self.emit("w.seq(%s, %s)" % (value, self.writer(f)), 1)
+            elif str(f.type) == "int" and not f.opt:
+                self.emit("w.int(%s)" % value, 1)
+            elif str(f.type) in asdl.builtin_types:
+                self.emit("w.value(%s)" % value, 1)
+            else:
+                self.emit("_write_%s(w, %s)" % (f.type, value), 1)
+
+    def writer(self, field):
+        type = str(field.type)
+        if type == "int":
+            return "_Writer.int"
+        if type in asdl.builtin_types:
+            return "_Writer.value"
+        return "_write_%s" % type
+
+    def emit_reader(self, name, fields, attributes):
+        self.emit("", 0)
+        self.emit("", 0)
+        self.emit("def _read_%s(r):" % name, 0)
+        self.emit_return(name, fields, attributes, 1)
+
+    def emit_return(self, name, fields, attributes, depth):
+        args = [self.reader(f) for f in fields]
+        args += ["%s=%s" % (ClassVisitor.param(a_name), self.reader(a))
+                 for a_name, a in zip(field_names(attributes), attributes)]
+        self.emit_wrapped("return %s(" % name, args, ")", depth)
+
+    def reader(self, field):
+        type = str(field.type)
+        if field.seq:
+            if type == "int":
+                read = "_Reader.int"
+            elif type in asdl.builtin_types:
+                read = "_Reader.value"
+            else:
+                read = "_read_%s" % type
+            return "r.seq(%s)" % read
+        if type == "int" and not field.opt:
+            return "r.int()"
+        if type in asdl.builtin_types:
+            return "r.value()"
+        return "_read_%s(r)" % type
+
+
+# Shared by the serializer functions. Each str value is numbered when first
+# written, and written again as a reference to its number.
+SERIALIZER_CODE = '''
+_MALFORMED = "truncated or malformed AST data"
+_double = struct.Struct("<d")
+_complex = struct.Struct("<dd")
+
+
+class _TypeTable(_DispatchTable):
+    __slots__ = ("type",)
+
+    def __init__(self, type, items):
+        super().__init__(items)
+        self.type = type
+
+    def __missing__(self, cls):
+        try:
+            return super().__missing__(cls)
+        except TypeError:
+            raise TypeError("expected some sort of %s, but got %s"
+                            % (self.type, cls.__name__)) from None
+
+
+def _kind_table(sum):
+    return _TypeTable(sum.__name__,
+                      ((cls, cls._kind) for cls in sum._constructors))
+
+
+def _writer_table(sum):
+    return _TypeTable(sum.__name__,
+                      ((cls, globals()["_write_" + cls.__name__])
+                       for cls in sum._constructors))
+
+
+def _reader_table(sum):
+    return (_read_none,) + tuple(globals()["_read_" + cls.__name__]
+                                 for cls in sum._constructors)
+
+
+class _Writer:
+    __slots__ = ("out", "strs")
+
+    def __init__(self):
+        self.out = bytearray()
+        self.strs = {}
+
+    def varint(self, value):
+        out = self.out
+        while value > 0x7f:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+
+    def int(self, value):
+        self.varint(value << 1 if value >= 0 else ~(value << 1))
+
+    def sized(self, tag, data):
+        self.out.append(tag)
+        self.varint(len(data))
+        self.out += data
+
+    def value(self, value):
+        out = self.out
+        if value is None:
+            out.append(_NONE)
+        elif value is False:
+            out.append(_FALSE)
+        elif value is True:
+            out.append(_TRUE)
+        elif isinstance(value, str):
+            index = self.strs.get(value)
+            if index is None:
+                self.strs[value] = len(self.strs)
+                self.sized(_STR, value.encode("utf-8", "surrogatepass"))
+            else:
+                out.append(_STR_REF)
+                self.varint(index)
+        elif isinstance(value, int):
+            if -1 << 63 <= value < 1 << 63:
+                out.append(_INT)
+                self.int(value)
+            else:
+                self.sized(_BIG_INT, str(int(value)).encode("ascii"))
+        elif isinstance(value, float):
+            out.append(_FLOAT)
+            out += _double.pack(value)
+        elif isinstance(value, complex):
+            out.append(_COMPLEX)
+            out += _complex.pack(value.real, value.imag)
+        elif isinstance(value, bytes):
+            self.sized(_BYTES, value)
+        else:
+            raise TypeError("cannot serialize %s objects"
+                            % type(value).__name__)
+
+    def seq(self, items, write):
+        self.varint(len(items))
+        for item in items:
+            write(self, item)
+
+
+class _Reader:
+    __slots__ = ("data", "pos", "strs")
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.strs = []
+
+    def varint(self):
+        data = self.data
+        pos = self.pos
+        byte = data[pos]
+        if byte < 0x80:
+            self.pos = pos + 1
+            return byte
+        value = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            pos += 1
+            byte = data[pos]
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        self.pos = pos + 1
+        return value
+
+    def int(self):
+        pos = self.pos
+        value = self.data[pos]
+        if value < 0x80:
+            self.pos = pos + 1
+        else:
+            value = self.varint()
+        return ~(value >> 1) if value & 1 else value >> 1
+
+    def raw(self, size):
+        pos = self.pos
+        self.pos = end = pos + size
+        if end > len(self.data):
+            raise ValueError(_MALFORMED)
+        return self.data[pos:end]
+
+    def value(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == _STR_REF:
+            return self.strs[self.varint()]
+        if tag == _STR:
+            value = self.raw(self.varint()).decode("utf-8", "surrogatepass")
+            self.strs.append(value)
+            return value
+        if tag == _INT:
+            return self.int()
+        if tag <= _TRUE:
+            return (None, False, True)[tag]
+        if tag == _FLOAT:
+            return _double.unpack(self.raw(8))[0]
+        if tag == _COMPLEX:
+            return complex(*_complex.unpack(self.raw(16)))
+        if tag == _BYTES:
+            return self.raw(self.varint())
+        if tag == _BIG_INT:
+            return int(self.raw(self.varint()))
+        raise ValueError(_MALFORMED)
+
+    def seq(self, read):
+        size = self.varint()
+        if size > len(self.data) - self.pos:
+            raise ValueError(_MALFORMED)
+        return [read(self) for _ in range(size)]
+
+
+def _read_none(r):
+    return None'''
+
+ENCODE_CODE = '''
+
+def encode(node):
+    """Return the %(root)s tree node serialized to bytes."""
+    w = _Writer()
+    w.out.append(_VERSION)
+    _write_%(root)s(w, node)
+    return bytes(w.out)
+
+
+def decode(data):
+    """Return the %(root)s tree serialized in data by encode()."""
+    r = _Reader(bytes(data))
+    try:
+        version = r.varint()
+        if version != _VERSION:
+            raise ValueError("unsupported AST data version %%d" %% version)
+        node = _read_%(root)s(r)
+    except IndexError:
+        raise ValueError(_MALFORMED) from None
+    if r.pos != len(r.data):
+        raise ValueError(_MALFORMED)
+    return node'''
+
+
+def generate(mod):
+    """Return the source of the node class module for mod."""
+    f = io.StringIO()
+    f.write(auto_gen_msg % os.path.basename(__file__))
+    f.write("\n")
+    ClassVisitor(f).visit(mod)
+    VisitorClassVisitor(f).visit(mod)
+    SerializerVisitor(f).visit(mod)
+    return f.getvalue()
+
+
+def main(srcfile, out_dir):
+    mod = asdl.parse(srcfile)
+    if not asdl.check(mod):
+        return 1
+    p = os.path.join(out_dir, "%s_ast.py" % str(mod.name).lower())
+    if asdl_c.update_file(p, generate(mod)):
+        print("Updated %s" % p)
+    else:
+        print("Unchanged %s" % p)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", dest="out_dir", default=".",
+                        help="directory to write <module>_ast.py to")
+    parser.add_argument("srcfile", help="the ASDL file")
+    args = parser.parse_args()
+    sys.exit(main(args.srcfile, args.out_dir))
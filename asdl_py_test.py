@@ -0,0 +1,223 @@
+# Simple testing / sanity-checking for asdl_py.py
+# Assumes some things about the current Python.asdl, which is used as input.
+
+import contextlib, importlib, io, os, pickle, sys, tempfile, unittest
+import asdl, asdl_py
+
+
+def load(mod):
+    ns = {}
+    exec(asdl_py.generate(mod), ns)
+    return ns
+
+
+class TestPythonAsdl(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.ns = load(asdl.parse('./Python.asdl'))
+
+    def test_classes(self):
+        ns = self.ns
+        self.assertTrue(issubclass(ns['BinOp'], ns['expr']))
+        self.assertTrue(issubclass(ns['expr'], ns['AST']))
+        self.assertTrue(issubclass(ns['arguments'], ns['AST']))
+        self.assertIn('Load', ns['__all__'])
+
+    def test_metadata(self):
+        ns = self.ns
+        self.assertEqual(ns['BinOp']._fields, ('left', 'op', 'right'))
+        self.assertEqual(ns['BinOp']._attributes, ('lineno', 'col_offset'))
+        self.assertEqual(ns['BinOp']._kind, 2)
+        self.assertEqual(ns['expr']._constructors[:2],
+                         (ns['BoolOp'], ns['BinOp']))
+        self.assertEqual(ns['arg']._field_types,
+                         (('arg', 'identifier', ''),
+                          ('annotation', 'expr', '?'),
+                          ('lineno', 'int', ''), ('col_offset', 'int', '')))
+        self.assertEqual(ns['Load']._fields, ())
+
+    def test_constructor(self):
+        ns = self.ns
+        name = ns['Name']('x', ns['Load'](), lineno=1, col_offset=2)
+        self.assertEqual((name.id, name.lineno, name.col_offset), ('x', 1, 2))
+        call = ns['Call'](func=name)
+        self.assertEqual(call.args, [])
+        self.assertIsNone(call.kwargs)
+        self.assertIsNot(ns['Call']().args, ns['Call']().args)
+        with self.assertRaises(TypeError):
+            ns['Name']('x', ns['Load'](), 1)
+        self.assertEqual(repr(ns['keyword']('k', name)),
+                         "keyword(arg='k', value=Name(id='x', ctx=Load()))")
+
+    def test_slots(self):
+        name = self.ns['Name']('x')
+        self.assertFalse(hasattr(name, '__dict__'))
+        with self.assertRaises(AttributeError):
+            name.other = 1
+
+
+class TestVisitors(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.ns = load(asdl.parse('./Python.asdl'))
+
+    def tree(self):
+        ns = self.ns
+        return ns['Module']([
+            ns['Assign']([ns['Name']('x', ns['Store']())],
+                         ns['BinOp'](ns['Name']('a', ns['Load']()), ns['Add'](),
+                                     ns['Num'](1))),
+            ns['Pass'](),
+            ns['Expr'](ns['Lambda'](ns['arguments'](kw_defaults=[None]),
+                                    ns['Name']('b', ns['Load']())))])
+
+    def test_visitor(self):
+        ns = self.ns
+        class Names(ns['NodeVisitor']):
+            def __init__(self):
+                self.names = []
+            def visit_Name(self, node):
+                self.names.append(node.id)
+            def visit_Assign(self, node):
+                # Only visit the value
+                self.visit(node.value)
+        visitor = Names()
+        visitor.visit(self.tree())
+        self.assertEqual(visitor.names, ['a', 'b'])
+
+        class MyName(ns['Name']):
+            pass
+        visitor = Names()
+        visitor.visit(ns['Expression'](MyName('c')))
+        self.assertEqual(visitor.names, ['c'])
+        with self.assertRaises(TypeError):
+            visitor.visit(1)
+
+    def test_generic_visit(self):
+        ns = self.ns
+        class Kinds(ns['NodeVisitor']):
+            def __init__(self):
+                self.kinds = []
+            def visit_BinOp(self, node):
+                self.kinds.append(node._kind)
+                self.generic_visit(node)
+            def visit_Num(self, node):
+                self.kinds.append(node._kind)
+        visitor = Kinds()
+        visitor.visit(self.tree())
+        self.assertEqual(visitor.kinds, [ns['BinOp']._kind, ns['Num']._kind])
+
+    def test_transformer(self):
+        ns = self.ns
+        class Transform(ns['NodeTransformer']):
+            def visit_Pass(self, node):
+                return None
+            def visit_Num(self, node):
+                return ns['Num'](node.n + 1)
+            def visit_Expr(self, node):
+                return [node, ns['Break']()]
+        tree = Transform().visit(self.tree())
+        self.assertEqual([type(s).__name__ for s in tree.body],
+                         ['Assign', 'Expr', 'Break'])
+        self.assertEqual(tree.body[0].value.right.n, 2)
+        self.assertEqual(tree.body[1].value.args.kw_defaults, [None])
+
+
+class TestSerializer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.ns = load(asdl.parse('./Python.asdl'))
+
+    def test_round_trip(self):
+        ns = self.ns
+        values = [0, -1, 2**63, -2**70, 1.5, 2j, 'x', 'x', '\ud800', b'\0',
+                  None, True]
+        mod = ns['Module']([
+            ns['Expr'](ns['Num'](v, lineno=i, col_offset=-i), lineno=i,
+                       col_offset=0)
+            for i, v in enumerate(values)])
+        mod.body.append(ns['ImportFrom']('m', [ns['alias']('a')], None,
+                                         lineno=1, col_offset=0))
+        mod.body.append(ns['FunctionDef'](
+            'f', ns['arguments']([ns['arg']('a', lineno=1, col_offset=2)],
+                                 kw_defaults=[None]),
+            [ns['Pass'](lineno=2, col_offset=4)], lineno=1, col_offset=0))
+        data = ns['encode'](mod)
+        copy = ns['decode'](data)
+        self.assertEqual(repr(copy), repr(mod))
+        self.assertEqual([s.value.lineno for s in copy.body[:3]], [0, 1, 2])
+        self.assertIsNone(copy.body[-2].level)
+        self.assertEqual(copy.body[-1].args.args[0].col_offset, 2)
+        self.assertIs(copy.body[-1].args.args[0].annotation, None)
+        self.assertEqual(ns['encode'](copy), data)
+        # The second 'x' refers back to the first
+        self.assertEqual(data.count(b'x'), 1)
+
+    def test_enums_are_shared(self):
+        ns = self.ns
+        name = ns['Name']('x', ns['Load'](), lineno=1, col_offset=0)
+        data = ns['encode'](ns['Expression'](name))
+        tree = ns['decode'](data)
+        self.assertIs(tree.body.ctx, ns['decode'](data).body.ctx)
+
+    def test_errors(self):
+        ns = self.ns
+        with self.assertRaises(TypeError):
+            ns['encode'](ns['Expression'](ns['Pass']()))
+        with self.assertRaises(TypeError):
+            ns['encode'](ns['Expression'](ns['Num'](object(), lineno=1,
+                                                    col_offset=0)))
+        data = ns['encode'](ns['Expression'](ns['Num'](1, lineno=1,
+                                                       col_offset=0)))
+        for bad in (data[:-1], data + b'\0', b'\2' + data[1:],
+                    data[:2] + b'\x7f' + data[3:]):
+            with self.assertRaises(ValueError):
+                ns['decode'](bad)
+
+
+class TestNames(unittest.TestCase):
+    def test_unnamed_and_keyword_fields(self):
+        ns = load(asdl.ASDLParser().parse("""
+            module M {
+                stmt = Import(identifier, identifier, identifier? from)
+                     | If(stmt? else)
+            }"""))
+        self.assertEqual(ns['Import']._fields,
+                         ('identifier', 'name1', 'from'))
+        node = ns['Import']('a', 'b', from_='c')
+        self.assertEqual(getattr(node, 'from'), 'c')
+
+        class Transform(ns['NodeTransformer']):
+            def visit_Import(self, node):
+                return ns['If']()
+        node = Transform().visit(ns['If'](node))
+        self.assertIsInstance(getattr(node, 'else'), ns['If'])
+
+
+class TestMain(unittest.TestCase):
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                self.assertEqual(asdl_py.main('./Python.asdl', tmp), 0)
+                asdl_py.main('./Python.asdl', tmp)
+            self.assertEqual(os.listdir(tmp), ['python_ast.py'])
+            self.assertIn('Unchanged', out.getvalue())
+
+    def test_pickle(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with contextlib.redirect_stdout(io.StringIO()):
+                asdl_py.main('./Python.asdl', tmp)
+            sys.path.insert(0, tmp)
+            try:
+                python_ast = importlib.import_module('python_ast')
+                mod = python_ast.Module([python_ast.Pass(lineno=1,
+                                                         col_offset=0)])
+                copy = pickle.loads(pickle.dumps(mod))
+            finally:
+                sys.path.remove(tmp)
+                sys.modules.pop('python_ast', None)
+        self.assertEqual(copy.body[0].lineno, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 # Simple testing / sanity-checking for asdl.py
 # Assumes some things about the current Python.asdl, which is used as input.
 
-import sys, unittest
+import io, os, pickle, sys, tempfile, unittest
 import asdl
 
 
@@ -95,6 +95,150 @@ class TestAsdlParser(unittest.TestCase):
         v.visit(self.types['mod'])
         self.assertEqual(v.names_with_seq, ['Module', 'Interactive', 'Suite'])
 
+    def test_visitor_profile(self):
+        class CustomVisitor(asdl.VisitorBase):
+            def visitSum(self, sum):
+                for t in sum.types:
+                    self.visit(t)
+
+            def visitConstructor(self, cons):
+                pass
+
+        # Each call of the clock takes a second
+        ticks = iter(range(100))
+        profile = asdl.VisitorProfile(clock=lambda: next(ticks))
+        CustomVisitor().visit(self.types['mod'])
+        with profile:
+            CustomVisitor().visit(self.types['mod'])
+        self.assertIsNone(asdl.VisitorProfile.active)
+        self.assertEqual(profile.methods[('CustomVisitor', 'visitConstructor')],
+                         [4, 4.0, 4.0])
+        self.assertEqual(profile.methods[('CustomVisitor', 'visitSum')],
+                         [1, 9.0, 5.0])
+        self.assertEqual(profile.classes['CustomVisitor'], [5, 9.0, 9.0])
+
+    def test_visitor_profile_disable(self):
+        class CustomVisitor(asdl.VisitorBase):
+            def visitSum(self, sum):
+                pass
+
+        v = CustomVisitor()
+        profile = asdl.VisitorProfile()
+        with profile:
+            v.visit(self.types['mod'])
+        # Disabling the profile forgets the wrapped method, so that another
+        # profile can wrap it, and calls made without one are not recorded.
+        self.assertEqual(v.cache, {})
+        with asdl.VisitorProfile() as other:
+            v.visit(self.types['mod'])
+        v.visit(self.types['mod'])
+        self.assertEqual(v.cache, {asdl.Sum: v.visitSum})
+        self.assertEqual(profile.methods[('CustomVisitor', 'visitSum')][0], 1)
+        self.assertEqual(other.methods[('CustomVisitor', 'visitSum')][0], 1)
+
+class TestTokenizer(unittest.TestCase):
+    def tokens(self, buf):
+        return [(t.kind, t.value, t.lineno) for t in asdl.tokenize_asdl(buf)]
+
+    def test_tokens(self):
+        K = asdl.TokenKind
+        self.assertEqual(
+            self.tokens('module M {\n  -- comment ( )\n  t = C(int* x)\n}'),
+            [(K.TypeId, 'module', 1), (K.ConstructorId, 'M', 1),
+             (K.LBrace, '{', 1), (K.TypeId, 't', 3), (K.Equals, '=', 3),
+             (K.ConstructorId, 'C', 3), (K.LParen, '(', 3),
+             (K.TypeId, 'int', 3), (K.Asterisk, '*', 3), (K.TypeId, 'x', 3),
+             (K.RParen, ')', 3), (K.RBrace, '}', 4)])
+
+    def test_line_breaks(self):
+        # Line numbers follow str.splitlines, so \r\n counts once.
+        linenos = [t[2] for t in self.tokens('a\r\nb\rc\x0cd\u2028e  \n\n')]
+        self.assertEqual(linenos, [1, 2, 3, 4, 5])
+
+    def test_invalid_operator(self):
+        with self.assertRaises(asdl.ASDLSyntaxError) as cm:
+            self.tokens('module M\n{\n  t = C(int x) ; \n}')
+        self.assertEqual(cm.exception.lineno, 3)
+        self.assertEqual(cm.exception.msg, 'Invalid operator ;')
+
+        with self.assertRaises(asdl.ASDLSyntaxError) as cm:
+            self.tokens('\n\n_t')
+        self.assertEqual(cm.exception.lineno, 3)
+
+    def test_chunks(self):
+        buf = 'module M {\r\n  -- comment\r\n  t = C(int* x)\r}\n'
+        chunks = [buf[i:i + 3] for i in range(0, len(buf), 3)]
+        self.assertEqual(list(asdl.tokenize_asdl_chunks(chunks)),
+                         list(asdl.tokenize_asdl(buf)))
+
+
+class TestParseStream(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open('./Python.asdl') as f:
+            cls.source = f.read()
+        cls.expected = repr(asdl.ASDLParser().parse(cls.source))
+
+    def test_parse_stream(self):
+        mod = asdl.parse_stream(io.StringIO(self.source), chunk_size=100)
+        self.assertEqual(repr(mod), self.expected)
+
+    def test_parse(self):
+        self.assertEqual(repr(asdl.parse('./Python.asdl')), self.expected)
+
+    def test_parse_mmap(self):
+        mod = asdl.parse('./Python.asdl', use_mmap=True)
+        self.assertEqual(repr(mod), self.expected)
+
+
+class TestParseCached(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = tmp.name
+        self.expected = repr(asdl.parse('./Python.asdl'))
+
+    def cache_entries(self):
+        return [os.path.join(self.cache_dir, name)
+                for name in os.listdir(self.cache_dir)]
+
+    def test_hit(self):
+        mod = asdl.parse_cached('./Python.asdl', self.cache_dir)
+        self.assertEqual(repr(mod), self.expected)
+        self.assertEqual(len(self.cache_entries()), 1)
+
+        # A hit must not parse again.
+        parse = asdl.parse
+        asdl.parse = None
+        try:
+            mod = asdl.parse_cached('./Python.asdl', self.cache_dir)
+        finally:
+            asdl.parse = parse
+        self.assertEqual(repr(mod), self.expected)
+
+    def test_corrupt_entry(self):
+        asdl.parse_cached('./Python.asdl', self.cache_dir)
+        [entry] = self.cache_entries()
+        with open(entry, 'wb') as f:
+            f.write(b'garbage')
+        mod = asdl.parse_cached('./Python.asdl', self.cache_dir)
+        self.assertEqual(repr(mod), self.expected)
+        # The entry is rewritten.
+        with open(entry, 'rb') as f:
+            self.assertNotEqual(f.read(), b'garbage')
+
+    def test_failed_store(self):
+        def dump(*args):
+            raise pickle.PicklingError('cannot pickle')
+        asdl.pickle.dump, saved = dump, asdl.pickle.dump
+        try:
+            with self.assertRaises(pickle.PicklingError):
+                asdl.parse_cached('./Python.asdl', self.cache_dir)
+        finally:
+            asdl.pickle.dump = saved
+        # The temporary file is removed.
+        self.assertEqual(self.cache_entries(), [])
+
 
 if __name__ == '__main__':
     unittest.main()
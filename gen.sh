@@ -2,5 +2,4 @@
 set -eu
 set -x
 
-python3 asdl_c.py -h /tmp Python.asdl
-python3 asdl_c.py -c /tmp Python.asdl
+python3 asdl_c.py -h /tmp -c /tmp Python.asdl
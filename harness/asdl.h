@@ -0,0 +1,40 @@
+/* Stand-in for CPython's Include/asdl.h, so that a generated Python-ast.c
+   builds as an extension module against the public headers of the running
+   interpreter. harness.c implements the functions declared here. */
+#ifndef Py_ASDL_H
+#define Py_ASDL_H
+
+#include "Python.h"
+
+typedef PyObject * identifier;
+typedef PyObject * string;
+typedef PyObject * bytes;
+typedef PyObject * object;
+typedef PyObject * singleton;
+
+typedef struct _arena PyArena;
+void *PyArena_Malloc(PyArena *, size_t);
+int PyArena_AddPyObject(PyArena *, PyObject *);
+
+typedef struct {
+    Py_ssize_t size;
+    void *elements[1];
+} asdl_seq;
+
+typedef struct {
+    Py_ssize_t size;
+    int elements[1];
+} asdl_int_seq;
+
+asdl_seq *_Py_asdl_seq_new(Py_ssize_t size, PyArena *arena);
+asdl_int_seq *_Py_asdl_int_seq_new(Py_ssize_t size, PyArena *arena);
+
+#define asdl_seq_GET(S, I) (S)->elements[(I)]
+#define asdl_seq_LEN(S) ((S) == NULL ? 0 : (S)->size)
+#define asdl_seq_SET(S, I, V) (S)->elements[I] = (V)
+
+/* Private helpers of CPython 3.4 that the generated code calls */
+int _PyObject_HasAttrId(PyObject *, _Py_Identifier *);
+PyObject *_PyDict_GetItemId(PyObject *, _Py_Identifier *);
+
+#endif /* !Py_ASDL_H */
@@ -0,0 +1,372 @@
+/* Builds a generated Python-ast.c as the extension module "harness", for the
+   tests and benchmarks of asdl_c.py. See asdl_harness.py.
+
+   The arena is a simplified pyarena.c: nodes are bump-allocated from 8K
+   blocks held by a list of bytes objects, so freeing an arena is a single
+   Py_DECREF. It counts its PyArena_Malloc calls and the bytes they take.
+
+   Compile with -DSLAB for code generated with --slab-alloc, and with
+   -DMARSHAL for code generated with --marshal. */
+#include "Python.h"
+#include "asdl.h"
+
+#define BLOCK_SIZE 8192
+
+struct _arena {
+    PyObject *objects;
+    char *next;
+    char *end;
+    size_t mallocs;
+    size_t bytes;
+};
+
+static int
+arena_init(PyArena *arena)
+{
+    arena->objects = PyList_New(0);
+    arena->next = arena->end = NULL;
+    arena->mallocs = arena->bytes = 0;
+    return arena->objects ? 0 : -1;
+}
+
+static void
+arena_free(PyArena *arena)
+{
+    Py_CLEAR(arena->objects);
+}
+
+void *
+PyArena_Malloc(PyArena *arena, size_t size)
+{
+    void *p;
+    size = (size + 7) & ~(size_t)7;
+    arena->mallocs++;
+    arena->bytes += size;
+    if ((size_t)(arena->end - arena->next) < size) {
+        size_t block_size = size > BLOCK_SIZE ? size : BLOCK_SIZE;
+        PyObject *block = PyBytes_FromStringAndSize(NULL, block_size + 8);
+        if (!block)
+            return NULL;
+        if (PyList_Append(arena->objects, block) < 0) {
+            Py_DECREF(block);
+            return NULL;
+        }
+        Py_DECREF(block);
+        arena->next = (char *)(((size_t)PyBytes_AS_STRING(block) + 7) &
+                               ~(size_t)7);
+        arena->end = arena->next + block_size;
+    }
+    p = arena->next;
+    arena->next += size;
+    return p;
+}
+
+int
+PyArena_AddPyObject(PyArena *arena, PyObject *obj)
+{
+    int r = PyList_Append(arena->objects, obj);
+    if (r == 0)
+        Py_DECREF(obj);
+    return r;
+}
+
+asdl_seq *
+_Py_asdl_seq_new(Py_ssize_t size, PyArena *arena)
+{
+    asdl_seq *seq = PyArena_Malloc(arena, sizeof(asdl_seq) +
+                                   (size ? size - 1 : 0) * sizeof(void *));
+    if (!seq)
+        return NULL;
+    memset(seq, 0, sizeof(asdl_seq));
+    seq->size = size;
+    return seq;
+}
+
+asdl_int_seq *
+_Py_asdl_int_seq_new(Py_ssize_t size, PyArena *arena)
+{
+    asdl_int_seq *seq = PyArena_Malloc(arena, sizeof(asdl_int_seq) +
+                                       (size ? size - 1 : 0) * sizeof(int));
+    if (!seq)
+        return NULL;
+    seq->size = size;
+    return seq;
+}
+
+int
+_PyObject_HasAttrId(PyObject *obj, _Py_Identifier *id)
+{
+    PyObject *res = _PyObject_GetAttrId(obj, id);
+    if (!res) {
+        PyErr_Clear();
+        return 0;
+    }
+    Py_DECREF(res);
+    return 1;
+}
+
+PyObject *
+_PyDict_GetItemId(PyObject *dict, _Py_Identifier *id)
+{
+    PyObject *key = _PyUnicode_FromId(id);
+    return key ? PyDict_GetItem(dict, key) : NULL;
+}
+
+#include "Python-ast.c"
+
+/* module() -> the _ast module */
+static PyObject *
+harness_module(PyObject *self, PyObject *unused)
+{
+    return PyInit__ast();
+}
+
+/* roundtrip(tree, mode[, n]) -> PyAST_mod2obj(PyAST_obj2mod(tree)), n times */
+static PyObject *
+harness_roundtrip(PyObject *self, PyObject *args)
+{
+    PyObject *obj, *res = NULL;
+    int mode, n = 1, i;
+    PyArena arena;
+    mod_ty mod;
+    if (!PyArg_ParseTuple(args, "Oi|i", &obj, &mode, &n))
+        return NULL;
+    for (i = 0; i < n; i++) {
+        if (arena_init(&arena) < 0)
+            return NULL;
+        mod = PyAST_obj2mod(obj, &arena, mode);
+        Py_XDECREF(res);
+        res = mod ? PyAST_mod2obj(mod) : NULL;
+        arena_free(&arena);
+        if (!res)
+            return NULL;
+    }
+    return res;
+}
+
+/* obj2mod(tree, mode, n) -> PyArena_Malloc calls of one PyAST_obj2mod
+   Converts tree n times, each time into a new arena. */
+static PyObject *
+harness_obj2mod(PyObject *self, PyObject *args)
+{
+    PyObject *obj;
+    int mode, n, i;
+    size_t mallocs = 0;
+    PyArena arena;
+    if (!PyArg_ParseTuple(args, "Oii", &obj, &mode, &n))
+        return NULL;
+    for (i = 0; i < n; i++) {
+        if (arena_init(&arena) < 0)
+            return NULL;
+        if (!PyAST_obj2mod(obj, &arena, mode)) {
+            arena_free(&arena);
+            return NULL;
+        }
+        mallocs = arena.mallocs;
+        arena_free(&arena);
+    }
+    return PyLong_FromSize_t(mallocs);
+}
+
+/* arena_bytes(tree, mode) -> bytes PyAST_obj2mod(tree) takes from the arena,
+   with each PyArena_Malloc call rounded up to 8 bytes */
+static PyObject *
+harness_arena_bytes(PyObject *self, PyObject *args)
+{
+    PyObject *obj;
+    int mode;
+    size_t bytes;
+    PyArena arena;
+    if (!PyArg_ParseTuple(args, "Oi", &obj, &mode))
+        return NULL;
+    if (arena_init(&arena) < 0)
+        return NULL;
+    if (!PyAST_obj2mod(obj, &arena, mode)) {
+        arena_free(&arena);
+        return NULL;
+    }
+    bytes = arena.bytes;
+    arena_free(&arena);
+    return PyLong_FromSize_t(bytes);
+}
+
+/* A tree converted by PyAST_obj2mod, with the arena that holds it */
+typedef struct {
+    PyArena arena;
+    mod_ty mod;
+} converted;
+
+static void
+converted_free(PyObject *capsule)
+{
+    converted *c = PyCapsule_GetPointer(capsule, "harness.mod");
+    arena_free(&c->arena);
+    PyMem_Free(c);
+}
+
+/* mod(tree, mode) -> PyAST_obj2mod(tree), as a capsule for mod2obj */
+static PyObject *
+harness_mod(PyObject *self, PyObject *args)
+{
+    PyObject *obj, *capsule;
+    int mode;
+    converted *c;
+    if (!PyArg_ParseTuple(args, "Oi", &obj, &mode))
+        return NULL;
+    c = PyMem_Malloc(sizeof(converted));
+    if (!c)
+        return PyErr_NoMemory();
+    if (arena_init(&c->arena) < 0) {
+        PyMem_Free(c);
+        return NULL;
+    }
+    c->mod = PyAST_obj2mod(obj, &c->arena, mode);
+    capsule = c->mod ? PyCapsule_New(c, "harness.mod", converted_free) : NULL;
+    if (!capsule) {
+        arena_free(&c->arena);
+        PyMem_Free(c);
+    }
+    return capsule;
+}
+
+static mod_ty
+get_mod(PyObject *capsule)
+{
+    converted *c = PyCapsule_GetPointer(capsule, "harness.mod");
+    return c ? c->mod : NULL;
+}
+
+/* mod2obj(mod, n) -> PyAST_mod2obj(mod), n times; mod is from mod() */
+static PyObject *
+harness_mod2obj(PyObject *self, PyObject *args)
+{
+    PyObject *capsule, *res = NULL;
+    int n, i;
+    mod_ty mod;
+    if (!PyArg_ParseTuple(args, "Oi", &capsule, &n))
+        return NULL;
+    if (!(mod = get_mod(capsule)))
+        return NULL;
+    for (i = 0; i < n; i++) {
+        Py_XDECREF(res);
+        res = PyAST_mod2obj(mod);
+        if (!res)
+            break;
+    }
+    return res;
+}
+
+/* alloc(n, rounds) -> PyArena_Malloc calls of one round
+   Each round calls the constructor functions of Name, Num and keyword n
+   times each, into a new arena. */
+static PyObject *
+harness_alloc(PyObject *self, PyObject *args)
+{
+    int n, rounds, i, r;
+    size_t mallocs = 0;
+    PyArena arena;
+    if (!PyArg_ParseTuple(args, "ii", &n, &rounds))
+        return NULL;
+    for (r = 0; r < rounds; r++) {
+        if (arena_init(&arena) < 0)
+            return NULL;
+        for (i = 0; i < n; i++) {
+            if (!Name(Py_None, Load, i, 0, &arena) ||
+                !Num(Py_None, i, 0, &arena) ||
+                !keyword(Py_None, Py_None, &arena)) {
+                arena_free(&arena);
+                return NULL;
+            }
+        }
+        mallocs = arena.mallocs;
+        arena_free(&arena);
+    }
+    return PyLong_FromSize_t(mallocs);
+}
+
+#ifdef SLAB
+/* slab_stats() -> (nodes, blocks) from _PyAST_SlabStats */
+static PyObject *
+harness_slab_stats(PyObject *self, PyObject *unused)
+{
+    Py_ssize_t nodes, blocks;
+    _PyAST_SlabStats(&nodes, &blocks);
+    return Py_BuildValue("nn", nodes, blocks);
+}
+#endif
+
+#ifdef MARSHAL
+/* mod2bytes(mod[, n]) -> PyAST_mod2bytes(mod), n times; mod is from mod() */
+static PyObject *
+harness_mod2bytes(PyObject *self, PyObject *args)
+{
+    PyObject *capsule, *res = NULL;
+    int n = 1, i;
+    mod_ty mod;
+    if (!PyArg_ParseTuple(args, "O|i", &capsule, &n))
+        return NULL;
+    if (!(mod = get_mod(capsule)))
+        return NULL;
+    for (i = 0; i < n; i++) {
+        Py_XDECREF(res);
+        res = PyAST_mod2bytes(mod);
+        if (!res)
+            break;
+    }
+    return res;
+}
+
+/* bytes2obj(data[, n]) -> PyAST_mod2obj(PyAST_bytes2mod(data))
+   Reads data n times, each time into a new arena. */
+static PyObject *
+harness_bytes2obj(PyObject *self, PyObject *args)
+{
+    Py_buffer data;
+    PyObject *res = NULL;
+    int n = 1, i;
+    PyArena arena;
+    mod_ty mod;
+    if (!PyArg_ParseTuple(args, "y*|i", &data, &n))
+        return NULL;
+    for (i = 0; i < n; i++) {
+        if (arena_init(&arena) < 0)
+            break;
+        mod = PyAST_bytes2mod(data.buf, data.len, &arena);
+        if (mod && i == n - 1)
+            res = PyAST_mod2obj(mod);
+        arena_free(&arena);
+        if (!mod)
+            break;
+    }
+    PyBuffer_Release(&data);
+    return res;
+}
+#endif
+
+static PyMethodDef harness_methods[] = {
+    {"module", harness_module, METH_NOARGS, NULL},
+    {"roundtrip", harness_roundtrip, METH_VARARGS, NULL},
+    {"obj2mod", harness_obj2mod, METH_VARARGS, NULL},
+    {"arena_bytes", harness_arena_bytes, METH_VARARGS, NULL},
+    {"mod", harness_mod, METH_VARARGS, NULL},
+    {"mod2obj", harness_mod2obj, METH_VARARGS, NULL},
+    {"alloc", harness_alloc, METH_VARARGS, NULL},
+#ifdef SLAB
+    {"slab_stats", harness_slab_stats, METH_NOARGS, NULL},
+#endif
+#ifdef MARSHAL
+    {"mod2bytes", harness_mod2bytes, METH_VARARGS, NULL},
+    {"bytes2obj", harness_bytes2obj, METH_VARARGS, NULL},
+#endif
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef harness_def = {
+    PyModuleDef_HEAD_INIT, "harness", NULL, -1, harness_methods
+};
+
+PyMODINIT_FUNC
+PyInit_harness(void)
+{
+    return PyModule_Create(&harness_def);
+}